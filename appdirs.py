@@ -16,13 +16,26 @@ __version__ = "1.4.4"
 __version_info__ = tuple(int(segment) for segment in __version__.split("."))
 
 
+# Only modules that are loaded at startup anyway (or builtin, like errno)
+# are imported here; the rest are imported where they are used, to keep
+# `import appdirs` cheap for the tools importing it.
+import errno
+import io
 import sys
 import os
+import stat
+import time
 
 PY3 = sys.version_info[0] == 3
 
 if PY3:
     unicode = str
+    # `_thread` is loaded at startup, unlike `threading`.
+    from _thread import allocate_lock as _allocate_lock
+    from _thread import get_ident as _get_thread_ident
+else:
+    from thread import allocate_lock as _allocate_lock
+    from thread import get_ident as _get_thread_ident
 
 if sys.platform.startswith('java'):
     import platform
@@ -41,7 +54,8 @@ else:
 
 
 
-def user_data_dir(appname=None, appauthor=None, version=None, roaming=False):
+def user_data_dir(appname=None, appauthor=None, version=None, roaming=False,
+                  ensure_exists=False):
     r"""Return full path to the user-specific data dir for this application.
 
         "appname" is the name of application.
@@ -61,6 +75,10 @@ def user_data_dir(appname=None, appauthor=None, version=None, roaming=False):
             sync'd on login. See
             <http://technet.microsoft.com/en-us/library/cc766489(WS.10).aspx>
             for a discussion of issues.
+        "ensure_exists" (boolean, default False) can be set True to create
+            the dir, with mode 0700, if it doesn't exist yet. Dirs are only
+            created (or found to exist) once per process; later calls make
+            no syscalls.
 
     Typical user data directories are:
         Mac OS X:               ~/Library/Application Support/<AppName>
@@ -73,30 +91,14 @@ def user_data_dir(appname=None, appauthor=None, version=None, roaming=False):
     For Unix, we follow the XDG spec and support $XDG_DATA_HOME.
     That means, by default "~/.local/share/<AppName>".
     """
-    if system == "win32":
-        if appauthor is None:
-            appauthor = appname
-        const = "CSIDL_APPDATA" if roaming else "CSIDL_LOCAL_APPDATA"
-        path = os.path.normpath(_get_win_folder(const))
-        if appname:
-            if appauthor is not False:
-                path = os.path.join(path, appauthor, appname)
-            else:
-                path = os.path.join(path, appname)
-    elif system == 'darwin':
-        path = os.path.expanduser('~/Library/Application Support/')
-        if appname:
-            path = os.path.join(path, appname)
-    else:
-        path = os.getenv('XDG_DATA_HOME', os.path.expanduser("~/.local/share"))
-        if appname:
-            path = os.path.join(path, appname)
-    if appname and version:
-        path = os.path.join(path, version)
+    path = _host_resolver().user_data_dir(appname, appauthor, version, roaming)
+    if ensure_exists:
+        _ensure_dirs(path, 0o700)
     return path
 
 
-def site_data_dir(appname=None, appauthor=None, version=None, multipath=False):
+def site_data_dir(appname=None, appauthor=None, version=None, multipath=False,
+                  ensure_exists=False):
     r"""Return full path to the user-shared data dir for this application.
 
         "appname" is the name of application.
@@ -115,6 +117,9 @@ def site_data_dir(appname=None, appauthor=None, version=None, multipath=False):
             returned. By default, the first item from XDG_DATA_DIRS is
             returned, or '/usr/local/share/<AppName>',
             if XDG_DATA_DIRS is not set
+        "ensure_exists" (boolean, default False) can be set True to create
+            the dir(s), with mode 0755, if they don't exist yet. Dirs are
+            only created (or found to exist) once per process.
 
     Typical site data directories are:
         Mac OS X:   /Library/Application Support/<AppName>
@@ -127,42 +132,15 @@ def site_data_dir(appname=None, appauthor=None, version=None, multipath=False):
 
     WARNING: Do not use this on Windows. See the Vista-Fail note above for why.
     """
-    if system == "win32":
-        if appauthor is None:
-            appauthor = appname
-        path = os.path.normpath(_get_win_folder("CSIDL_COMMON_APPDATA"))
-        if appname:
-            if appauthor is not False:
-                path = os.path.join(path, appauthor, appname)
-            else:
-                path = os.path.join(path, appname)
-    elif system == 'darwin':
-        path = os.path.expanduser('/Library/Application Support')
-        if appname:
-            path = os.path.join(path, appname)
-    else:
-        # XDG default for $XDG_DATA_DIRS
-        # only first, if multipath is False
-        path = os.getenv('XDG_DATA_DIRS',
-                         os.pathsep.join(['/usr/local/share', '/usr/share']))
-        pathlist = [os.path.expanduser(x.rstrip(os.sep)) for x in path.split(os.pathsep)]
-        if appname:
-            if version:
-                appname = os.path.join(appname, version)
-            pathlist = [os.sep.join([x, appname]) for x in pathlist]
-
-        if multipath:
-            path = os.pathsep.join(pathlist)
-        else:
-            path = pathlist[0]
-        return path
-
-    if appname and version:
-        path = os.path.join(path, version)
+    path = _host_resolver().site_data_dir(appname, appauthor,
+                                          version, multipath)
+    if ensure_exists:
+        _ensure_dirs(path, 0o755, multipath)
     return path
 
 
-def user_config_dir(appname=None, appauthor=None, version=None, roaming=False):
+def user_config_dir(appname=None, appauthor=None, version=None, roaming=False,
+                    ensure_exists=False):
     r"""Return full path to the user-specific config dir for this application.
 
         "appname" is the name of application.
@@ -182,6 +160,10 @@ def user_config_dir(appname=None, appauthor=None, version=None, roaming=False):
             sync'd on login. See
             <http://technet.microsoft.com/en-us/library/cc766489(WS.10).aspx>
             for a discussion of issues.
+        "ensure_exists" (boolean, default False) can be set True to create
+            the dir, with mode 0700, if it doesn't exist yet. Dirs are only
+            created (or found to exist) once per process; later calls make
+            no syscalls.
 
     Typical user config directories are:
         Mac OS X:               ~/Library/Preferences/<AppName>
@@ -191,22 +173,15 @@ def user_config_dir(appname=None, appauthor=None, version=None, roaming=False):
     For Unix, we follow the XDG spec and support $XDG_CONFIG_HOME.
     That means, by default "~/.config/<AppName>".
     """
-    if system == "win32":
-        path = user_data_dir(appname, appauthor, None, roaming)
-    elif system == 'darwin':
-        path = os.path.expanduser('~/Library/Preferences/')
-        if appname:
-            path = os.path.join(path, appname)
-    else:
-        path = os.getenv('XDG_CONFIG_HOME', os.path.expanduser("~/.config"))
-        if appname:
-            path = os.path.join(path, appname)
-    if appname and version:
-        path = os.path.join(path, version)
+    path = _host_resolver().user_config_dir(appname, appauthor,
+                                            version, roaming)
+    if ensure_exists:
+        _ensure_dirs(path, 0o700)
     return path
 
 
-def site_config_dir(appname=None, appauthor=None, version=None, multipath=False):
+def site_config_dir(appname=None, appauthor=None, version=None, multipath=False,
+                    ensure_exists=False):
     r"""Return full path to the user-shared data dir for this application.
 
         "appname" is the name of application.
@@ -224,6 +199,9 @@ def site_config_dir(appname=None, appauthor=None, version=None, multipath=False)
             which indicates that the entire list of config dirs should be
             returned. By default, the first item from XDG_CONFIG_DIRS is
             returned, or '/etc/xdg/<AppName>', if XDG_CONFIG_DIRS is not set
+        "ensure_exists" (boolean, default False) can be set True to create
+            the dir(s), with mode 0755, if they don't exist yet. Dirs are
+            only created (or found to exist) once per process.
 
     Typical site config directories are:
         Mac OS X:   same as site_data_dir
@@ -236,32 +214,15 @@ def site_config_dir(appname=None, appauthor=None, version=None, multipath=False)
 
     WARNING: Do not use this on Windows. See the Vista-Fail note above for why.
     """
-    if system == 'win32':
-        path = site_data_dir(appname, appauthor)
-        if appname and version:
-            path = os.path.join(path, version)
-    elif system == 'darwin':
-        path = os.path.expanduser('/Library/Preferences')
-        if appname:
-            path = os.path.join(path, appname)
-    else:
-        # XDG default for $XDG_CONFIG_DIRS
-        # only first, if multipath is False
-        path = os.getenv('XDG_CONFIG_DIRS', '/etc/xdg')
-        pathlist = [os.path.expanduser(x.rstrip(os.sep)) for x in path.split(os.pathsep)]
-        if appname:
-            if version:
-                appname = os.path.join(appname, version)
-            pathlist = [os.sep.join([x, appname]) for x in pathlist]
-
-        if multipath:
-            path = os.pathsep.join(pathlist)
-        else:
-            path = pathlist[0]
+    path = _host_resolver().site_config_dir(appname, appauthor,
+                                            version, multipath)
+    if ensure_exists:
+        _ensure_dirs(path, 0o755, multipath)
     return path
 
 
-def user_cache_dir(appname=None, appauthor=None, version=None, opinion=True):
+def user_cache_dir(appname=None, appauthor=None, version=None, opinion=True,
+                   ensure_exists=False):
     r"""Return full path to the user-specific cache dir for this application.
 
         "appname" is the name of application.
@@ -278,6 +239,10 @@ def user_cache_dir(appname=None, appauthor=None, version=None, opinion=True):
         "opinion" (boolean) can be False to disable the appending of
             "Cache" to the base app data dir for Windows. See
             discussion below.
+        "ensure_exists" (boolean, default False) can be set True to create
+            the dir, with mode 0700, if it doesn't exist yet. Dirs are only
+            created (or found to exist) once per process; later calls make
+            no syscalls.
 
     Typical user cache directories are:
         Mac OS X:   ~/Library/Caches/<AppName>
@@ -294,31 +259,15 @@ def user_cache_dir(appname=None, appauthor=None, version=None, opinion=True):
     OPINION: This function appends "Cache" to the `CSIDL_LOCAL_APPDATA` value.
     This can be disabled with the `opinion=False` option.
     """
-    if system == "win32":
-        if appauthor is None:
-            appauthor = appname
-        path = os.path.normpath(_get_win_folder("CSIDL_LOCAL_APPDATA"))
-        if appname:
-            if appauthor is not False:
-                path = os.path.join(path, appauthor, appname)
-            else:
-                path = os.path.join(path, appname)
-            if opinion:
-                path = os.path.join(path, "Cache")
-    elif system == 'darwin':
-        path = os.path.expanduser('~/Library/Caches')
-        if appname:
-            path = os.path.join(path, appname)
-    else:
-        path = os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
-        if appname:
-            path = os.path.join(path, appname)
-    if appname and version:
-        path = os.path.join(path, version)
+    path = _host_resolver().user_cache_dir(appname, appauthor,
+                                           version, opinion)
+    if ensure_exists:
+        _ensure_dirs(path, 0o700)
     return path
 
 
-def user_state_dir(appname=None, appauthor=None, version=None, roaming=False):
+def user_state_dir(appname=None, appauthor=None, version=None, roaming=False,
+                   ensure_exists=False):
     r"""Return full path to the user-specific state dir for this application.
 
         "appname" is the name of application.
@@ -338,6 +287,10 @@ def user_state_dir(appname=None, appauthor=None, version=None, roaming=False):
             sync'd on login. See
             <http://technet.microsoft.com/en-us/library/cc766489(WS.10).aspx>
             for a discussion of issues.
+        "ensure_exists" (boolean, default False) can be set True to create
+            the dir, with mode 0700, if it doesn't exist yet. Dirs are only
+            created (or found to exist) once per process; later calls make
+            no syscalls.
 
     Typical user state directories are:
         Mac OS X:  same as user_data_dir
@@ -349,18 +302,15 @@ def user_state_dir(appname=None, appauthor=None, version=None, roaming=False):
 
     That means, by default "~/.local/state/<AppName>".
     """
-    if system in ["win32", "darwin"]:
-        path = user_data_dir(appname, appauthor, None, roaming)
-    else:
-        path = os.getenv('XDG_STATE_HOME', os.path.expanduser("~/.local/state"))
-        if appname:
-            path = os.path.join(path, appname)
-    if appname and version:
-        path = os.path.join(path, version)
+    path = _host_resolver().user_state_dir(appname, appauthor,
+                                           version, roaming)
+    if ensure_exists:
+        _ensure_dirs(path, 0o700)
     return path
 
 
-def user_log_dir(appname=None, appauthor=None, version=None, opinion=True):
+def user_log_dir(appname=None, appauthor=None, version=None, opinion=True,
+                 ensure_exists=False):
     r"""Return full path to the user-specific log dir for this application.
 
         "appname" is the name of application.
@@ -377,6 +327,10 @@ def user_log_dir(appname=None, appauthor=None, version=None, opinion=True):
         "opinion" (boolean) can be False to disable the appending of
             "Logs" to the base app data dir for Windows, and "log" to the
             base cache dir for Unix. See discussion below.
+        "ensure_exists" (boolean, default False) can be set True to create
+            the dir, with mode 0700, if it doesn't exist yet. Dirs are only
+            created (or found to exist) once per process; later calls make
+            no syscalls.
 
     Typical user log directories are:
         Mac OS X:   ~/Library/Logs/<AppName>
@@ -392,212 +346,4967 @@ def user_log_dir(appname=None, appauthor=None, version=None, opinion=True):
     value for Windows and appends "log" to the user cache dir for Unix.
     This can be disabled with the `opinion=False` option.
     """
-    if system == "darwin":
-        path = os.path.join(
-            os.path.expanduser('~/Library/Logs'),
-            appname)
-    elif system == "win32":
-        path = user_data_dir(appname, appauthor, version)
-        version = False
-        if opinion:
-            path = os.path.join(path, "Logs")
-    else:
-        path = user_cache_dir(appname, appauthor, version)
-        version = False
-        if opinion:
-            path = os.path.join(path, "log")
-    if appname and version:
-        path = os.path.join(path, version)
+    path = _host_resolver().user_log_dir(appname, appauthor, version, opinion)
+    if ensure_exists:
+        _ensure_dirs(path, 0o700)
     return path
 
 
-class AppDirs(object):
-    """Convenience wrapper for getting application dirs."""
-    def __init__(self, appname=None, appauthor=None, version=None,
-            roaming=False, multipath=False):
-        self.appname = appname
-        self.appauthor = appauthor
-        self.version = version
-        self.roaming = roaming
-        self.multipath = multipath
+def user_runtime_dir(appname=None, appauthor=None, version=None,
+                     ensure_exists=False):
+    r"""Return full path to the user-specific runtime dir for this application.
+
+        "appname" is the name of application.
+            If None, just the system directory is returned.
+        "appauthor" (only used on Windows) is the name of the
+            appauthor or distributing body for this application. Typically
+            it is the owning company name. This falls back to appname. You may
+            pass False to disable it.
+        "version" is an optional version path element to append to the
+            path. You might want to use this if you want multiple versions
+            of your app to be able to run independently. If used, this
+            would typically be "<major>.<minor>".
+            Only applied when appname is present.
+        "ensure_exists" (boolean, default False) can be set True to create
+            the dir, with mode 0700, if it doesn't exist yet. Dirs are only
+            created (or found to exist) once per process; later calls make
+            no syscalls.
+
+    The runtime dir is for sockets, pid files and other small files that
+    needn't outlive the user's session. Typical user runtime directories are:
+        Mac OS X:   ~/Library/Caches/TemporaryItems/<AppName>
+        Unix:       /run/user/<uid>/<AppName>   # or in $XDG_RUNTIME_DIR, if defined
+        Win *:      C:\Users\<username>\AppData\Local\Temp\<AppAuthor>\<AppName>
+
+    On Unix, $XDG_RUNTIME_DIR is usually a tmpfs, see `is_memory_backed`.
+    If it isn't set, "/run/user/<uid>" is used if it exists, else
+    "<tempdir>/runtime-<uid>", which is created with mode 0700 and only
+    used if it belongs to this user and others can't access it; otherwise
+    a new private temp dir is used.
+    """
+    path = _host_resolver().user_runtime_dir(appname, appauthor, version)
+    if ensure_exists:
+        _ensure_dirs(path, 0o700)
+    return path
+
+
+#---- resolution engine
+
+class Resolver(object):
+    r"""Compute app dirs from explicit inputs rather than from this process.
+
+        "platform" is a *sys.platform* style string. "win32" and "darwin"
+            give the Windows and Mac OS X layouts, anything else the XDG one.
+        "env" is the mapping of environment variables to use. It defaults
+            to an empty one, i.e. no XDG_* overrides.
+        "home" is the user's home dir, used for "~". If None, the HOME
+            variable in "env" is used (USERPROFILE for "win32"); only
+            with neither is `pathmod.expanduser` used, which looks at this
+            process.
+        "win_folders" gives the Windows shell folders, as a mapping or a
+            function from "CSIDL_APPDATA", "CSIDL_LOCAL_APPDATA" and
+            "CSIDL_COMMON_APPDATA" to paths. If None, they are read from
+            the APPDATA, LOCALAPPDATA and ALLUSERSPROFILE variables in "env".
+        "pathmod" is the path module used to build paths. It defaults to
+            `ntpath` for "win32" and `posixpath` otherwise; pass `os.path`
+            for paths as this process would build them.
+        "runtime_base" is the Unix runtime dir used when XDG_RUNTIME_DIR
+            isn't set, as a path or a function returning one. If None, it
+            is "/run/user/<uid>".
+        "uid" is the user id for that default. If None, the UID variable
+            in "env" is used; with neither, `user_runtime_dir` raises
+            ValueError unless XDG_RUNTIME_DIR is set.
+
+    A `Resolver` only reads its inputs and keeps no state of its own, so
+    one can be shared by any number of threads, or pickled to other
+    processes, to compute layouts for other platforms than this one:
+
+        >>> Resolver("win32", win_folders={"CSIDL_LOCAL_APPDATA":
+        ...     "C:\\Users\\me\\AppData\\Local"}).user_cache_dir("SuperApp")
+        'C:\\Users\\me\\AppData\\Local\\SuperApp\\SuperApp\\Cache'
+
+    The methods take the same arguments as the module functions of the same
+    name, less "ensure_exists", and return the same paths for the same
+    inputs. The module functions are wrappers around a `Resolver` for this
+    process.
+    """
+    def __init__(self, platform, env=None, home=None, win_folders=None,
+                 pathmod=None, runtime_base=None, uid=None):
+        if pathmod is None:
+            if platform == "win32":
+                import ntpath as pathmod
+            else:
+                import posixpath as pathmod
+        self.platform = platform
+        self.env = {} if env is None else env
+        self.home = home
+        self.win_folders = win_folders
+        self.pathmod = pathmod
+        self.runtime_base = runtime_base
+        self.uid = uid
+
+    def __repr__(self):
+        return "%s(%r, home=%r, pathmod=%s)" % (
+            self.__class__.__name__, self.platform, self.home,
+            self.pathmod.__name__)
+
+    def __getstate__(self):
+        # Modules don't pickle; path modules are top-level, so the name does.
+        state = self.__dict__.copy()
+        state["pathmod"] = self.pathmod.__name__
+        return state
+
+    def __setstate__(self, state):
+        __import__(state["pathmod"])
+        state["pathmod"] = sys.modules[state["pathmod"]]
+        self.__dict__.update(state)
+
+    def _expand(self, path):
+        """`expanduser` against "home"."""
+        home = self.home
+        if home is None:
+            home = self.env.get(
+                "USERPROFILE" if self.platform == "win32" else "HOME")
+            if not home:
+                return self.pathmod.expanduser(path)
+        if path[:1] != "~" or path[1:2] not in ("", "/", self.pathmod.sep):
+            return path
+        return home.rstrip(self.pathmod.sep) + path[1:] or self.pathmod.sep
+
+    def _win_folder(self, csidl_name):
+        folders = self.win_folders
+        if folders is None:
+            path = self.env[_WIN_FOLDER_ENV_VARS[csidl_name]]
+        elif callable(folders):
+            path = folders(csidl_name)
+        else:
+            path = folders[csidl_name]
+        return self.pathmod.normpath(path)
+
+    def _runtime_base(self):
+        base = self.runtime_base
+        if base is not None:
+            return base() if callable(base) else base
+        uid = self.uid
+        if uid is None:
+            uid = self.env.get("UID")
+            if uid is None:
+                raise ValueError("no runtime dir: XDG_RUNTIME_DIR isn't set "
+                                 "and there is no uid to default to")
+        return "/run/user/%s" % uid
+
+    def _xdg_dirs(self, name, default):
+        """The dirs in the XDG_*_DIRS variable `name`, as a list."""
+        sep = self.pathmod.sep
+        return [self._expand(x.rstrip(sep))
+                for x in self.env.get(name, default).split(
+                    self.pathmod.pathsep)]
+
+    def _win_app_path(self, path, appname, appauthor):
+        if appname:
+            if appauthor is None:
+                appauthor = appname
+            if appauthor is not False:
+                return self.pathmod.join(path, appauthor, appname)
+            return self.pathmod.join(path, appname)
+        return path
+
+    def _join_xdg_app(self, pathlist, appname, version, multipath):
+        pathmod = self.pathmod
+        if appname:
+            if version:
+                appname = pathmod.join(appname, version)
+            pathlist = [pathmod.sep.join([x, appname]) for x in pathlist]
+        if multipath:
+            return pathmod.pathsep.join(pathlist)
+        return pathlist[0]
+
+    def user_data_dir(self, appname=None, appauthor=None, version=None,
+                      roaming=False):
+        join = self.pathmod.join
+        if self.platform == "win32":
+            path = self._win_app_path(self._win_folder(
+                "CSIDL_APPDATA" if roaming else "CSIDL_LOCAL_APPDATA"),
+                appname, appauthor)
+        elif self.platform == "darwin":
+            path = self._expand('~/Library/Application Support/')
+            if appname:
+                path = join(path, appname)
+        else:
+            path = self.env.get('XDG_DATA_HOME',
+                                self._expand("~/.local/share"))
+            if appname:
+                path = join(path, appname)
+        if appname and version:
+            path = join(path, version)
+        return path
+
+    def site_data_dir(self, appname=None, appauthor=None, version=None,
+                      multipath=False):
+        join = self.pathmod.join
+        if self.platform == "win32":
+            path = self._win_app_path(
+                self._win_folder("CSIDL_COMMON_APPDATA"), appname, appauthor)
+        elif self.platform == "darwin":
+            path = '/Library/Application Support'
+            if appname:
+                path = join(path, appname)
+        else:
+            # XDG default for $XDG_DATA_DIRS
+            # only first, if multipath is False
+            return self._join_xdg_app(self._xdg_dirs(
+                'XDG_DATA_DIRS',
+                self.pathmod.pathsep.join(['/usr/local/share', '/usr/share'])),
+                appname, version, multipath)
+        if appname and version:
+            path = join(path, version)
+        return path
+
+    def user_config_dir(self, appname=None, appauthor=None, version=None,
+                        roaming=False):
+        join = self.pathmod.join
+        if self.platform == "win32":
+            path = self.user_data_dir(appname, appauthor, None, roaming)
+        elif self.platform == "darwin":
+            path = self._expand('~/Library/Preferences/')
+            if appname:
+                path = join(path, appname)
+        else:
+            path = self.env.get('XDG_CONFIG_HOME', self._expand("~/.config"))
+            if appname:
+                path = join(path, appname)
+        if appname and version:
+            path = join(path, version)
+        return path
+
+    def site_config_dir(self, appname=None, appauthor=None, version=None,
+                        multipath=False):
+        join = self.pathmod.join
+        if self.platform == "win32":
+            path = self.site_data_dir(appname, appauthor)
+            if appname and version:
+                path = join(path, version)
+        elif self.platform == "darwin":
+            path = '/Library/Preferences'
+            if appname:
+                path = join(path, appname)
+        else:
+            # XDG default for $XDG_CONFIG_DIRS
+            # only first, if multipath is False
+            path = self._join_xdg_app(
+                self._xdg_dirs('XDG_CONFIG_DIRS', '/etc/xdg'),
+                appname, version, multipath)
+        return path
+
+    def user_cache_dir(self, appname=None, appauthor=None, version=None,
+                       opinion=True):
+        join = self.pathmod.join
+        if self.platform == "win32":
+            path = self._win_app_path(
+                self._win_folder("CSIDL_LOCAL_APPDATA"), appname, appauthor)
+            if appname and opinion:
+                path = join(path, "Cache")
+        elif self.platform == "darwin":
+            path = self._expand('~/Library/Caches')
+            if appname:
+                path = join(path, appname)
+        else:
+            path = self.env.get('XDG_CACHE_HOME', self._expand('~/.cache'))
+            if appname:
+                path = join(path, appname)
+        if appname and version:
+            path = join(path, version)
+        return path
+
+    def user_state_dir(self, appname=None, appauthor=None, version=None,
+                       roaming=False):
+        join = self.pathmod.join
+        if self.platform in ("win32", "darwin"):
+            path = self.user_data_dir(appname, appauthor, None, roaming)
+        else:
+            path = self.env.get('XDG_STATE_HOME',
+                                self._expand("~/.local/state"))
+            if appname:
+                path = join(path, appname)
+        if appname and version:
+            path = join(path, version)
+        return path
+
+    def user_log_dir(self, appname=None, appauthor=None, version=None,
+                     opinion=True):
+        join = self.pathmod.join
+        if self.platform == "darwin":
+            path = join(self._expand('~/Library/Logs'), appname)
+            if appname and version:
+                path = join(path, version)
+        elif self.platform == "win32":
+            path = self.user_data_dir(appname, appauthor, version)
+            if opinion:
+                path = join(path, "Logs")
+        else:
+            path = self.user_cache_dir(appname, appauthor, version)
+            if opinion:
+                path = join(path, "log")
+        return path
+
+    def user_runtime_dir(self, appname=None, appauthor=None, version=None):
+        join = self.pathmod.join
+        if self.platform == "win32":
+            path = self._win_app_path(
+                join(self._win_folder("CSIDL_LOCAL_APPDATA"), "Temp"),
+                appname, appauthor)
+        elif self.platform == "darwin":
+            path = self._expand('~/Library/Caches/TemporaryItems')
+            if appname:
+                path = join(path, appname)
+        else:
+            path = self.env.get('XDG_RUNTIME_DIR') or self._runtime_base()
+            if appname:
+                path = join(path, appname)
+        if appname and version:
+            path = join(path, version)
+        return path
+
+
+def _host_win_folder(csidl_name):
+    # Looked up on each call so that `enable_instrumentation` sees it.
+    return _get_win_folder(csidl_name)
+
+# `system` -> the `Resolver` for this process. Keyed by `system` because
+# tests and benchmarks simulate other platforms by setting it.
+_host_resolvers = {}
+
+def _host_resolver():
+    """Return the `Resolver` the module functions use: `system`, the live
+    environment, the Windows folder backends and `os.path`.
+    """
+    try:
+        return _host_resolvers[system]
+    except KeyError:
+        return _host_resolvers.setdefault(system, Resolver(
+            system, os.environ, win_folders=_host_win_folder,
+            pathmod=os.path, runtime_base=_default_runtime_base))
+
+
+class _AppDirsBase(object):
+    """The properties and methods of `AppDirs` and `FrozenAppDirs`."""
+    __slots__ = ()
+
+    def refresh(self):
+        """Forget all cached paths and dir listings so the next access
+        re-resolves them.
+        """
+        self._cache = {}
+        self._cache_key = None
+        self._pinned = False
+        _listing_cache.clear()
+
+    def snapshot(self):
+        """Return a JSON-serializable dict of the arguments and all the
+        resolved dirs, for `from_snapshot`.
+        """
+        return {
+            "format": 1,
+            "appdirs_version": __version__,
+            "system": system,
+            "appname": self.appname,
+            "appauthor": self.appauthor,
+            "version": self.version,
+            "roaming": self.roaming,
+            "multipath": self.multipath,
+            "dirs": dict((kind, getattr(self, kind)) for kind in _DIR_KINDS),
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Return an `AppDirs` with the dirs in `snapshot` precomputed.
+
+        "snapshot" is a dict from `snapshot()`, or the path of a JSON file
+        with one, e.g. from "python -m appdirs APPNAME --format json".
+
+        The dirs are used as they are: nothing is resolved and the
+        environment isn't checked for changes, which makes this the
+        cheapest way to get the dirs in short-lived processes. Call
+        `refresh()` to go back to resolving them.
+        """
+        import json
+        if not isinstance(snapshot, dict):
+            with open(snapshot, "rb") as f:
+                snapshot = json.loads(f.read().decode("utf-8"))
+        if snapshot.get("format") != 1:
+            raise ValueError("unsupported appdirs snapshot format: %r"
+                             % snapshot.get("format"))
+        dirs = cls(snapshot["appname"], snapshot["appauthor"],
+                   snapshot["version"], roaming=snapshot["roaming"],
+                   multipath=snapshot["multipath"])
+        dirs._cache = dict(snapshot["dirs"])
+        dirs._pinned = True
+        return dirs
+
+    def _resolve(self, name, func, **kwargs):
+        if not self._pinned:
+            key = (self.appname, self.appauthor, self.version, self.roaming,
+                   self.multipath, self.ensure_exists) + _env_snapshot()
+            if key != self._cache_key:
+                self._cache.clear()
+                self._cache_key = key
+        try:
+            return self._cache[name]
+        except KeyError:
+            if self.ensure_exists and name.startswith("user_"):
+                kwargs["ensure_exists"] = True
+            path = self._cache[name] = func(self.appname, self.appauthor,
+                                            **kwargs)
+            return path
+
+    def ensure_all(self, include_site=False):
+        """Create all the user dirs, and the site dirs too if
+        "include_site" is true, in one pass. Return the list of dirs.
+        """
+        dirs = []
+        for kind in _DIR_KINDS:
+            path = getattr(self, kind)
+            if kind.startswith("user_"):
+                dirs.append((path, 0o700))
+            elif include_site:
+                if self.multipath:
+                    dirs.extend((p, 0o755) for p in _split_multipath(path))
+                else:
+                    dirs.append((path, 0o755))
+        created = []
+        for path, mode in dirs:
+            if path not in created:
+                _ensure_dirs(path, mode)
+                created.append(path)
+        return created
 
     @property
     def user_data_dir(self):
-        return user_data_dir(self.appname, self.appauthor,
+        return self._resolve("user_data_dir", user_data_dir,
                              version=self.version, roaming=self.roaming)
 
     @property
     def site_data_dir(self):
-        return site_data_dir(self.appname, self.appauthor,
+        return self._resolve("site_data_dir", site_data_dir,
                              version=self.version, multipath=self.multipath)
 
     @property
     def user_config_dir(self):
-        return user_config_dir(self.appname, self.appauthor,
-                               version=self.version, roaming=self.roaming)
+        return self._resolve("user_config_dir", user_config_dir,
+                             version=self.version, roaming=self.roaming)
 
     @property
     def site_config_dir(self):
-        return site_config_dir(self.appname, self.appauthor,
+        return self._resolve("site_config_dir", site_config_dir,
                              version=self.version, multipath=self.multipath)
 
     @property
     def user_cache_dir(self):
-        return user_cache_dir(self.appname, self.appauthor,
-                              version=self.version)
+        return self._resolve("user_cache_dir", user_cache_dir,
+                             version=self.version)
 
     @property
     def user_state_dir(self):
-        return user_state_dir(self.appname, self.appauthor,
-                              version=self.version)
+        return self._resolve("user_state_dir", user_state_dir,
+                             version=self.version)
 
     @property
     def user_log_dir(self):
-        return user_log_dir(self.appname, self.appauthor,
-                            version=self.version)
+        return self._resolve("user_log_dir", user_log_dir,
+                             version=self.version)
 
+    @property
+    def user_runtime_dir(self):
+        return self._resolve("user_runtime_dir", user_runtime_dir,
+                             version=self.version)
 
-#---- internal support stuff
+    @property
+    def data_dirs(self):
+        """All data dirs in precedence order: `user_data_dir` first, then
+        each of the `site_data_dir` entries.
+        """
+        return [self.user_data_dir] + _split_multipath(self._resolve(
+            "site_data_dirs", site_data_dir, version=self.version,
+            multipath=True))
 
-def _get_win_folder_from_registry(csidl_name):
-    """This is a fallback technique at best. I'm not sure if using the
-    registry for this guarantees us the correct answer for all CSIDL_*
-    names.
-    """
-    if PY3:
-      import winreg as _winreg
-    else:
-      import _winreg
+    @property
+    def config_dirs(self):
+        """All config dirs in precedence order: `user_config_dir` first,
+        then each of the `site_config_dir` entries.
+        """
+        return [self.user_config_dir] + _split_multipath(self._resolve(
+            "site_config_dirs", site_config_dir, version=self.version,
+            multipath=True))
 
-    shell_folder_name = {
-        "CSIDL_APPDATA": "AppData",
-        "CSIDL_COMMON_APPDATA": "Common AppData",
-        "CSIDL_LOCAL_APPDATA": "Local AppData",
-    }[csidl_name]
+    def find_data_file(self, relpath):
+        """Return the path of the first `relpath` found in `data_dirs`,
+        or None. See `_ListingCache` for how the lookup is cached.
+        """
+        return _find_in_layers(self.data_dirs, relpath)
 
-    key = _winreg.OpenKey(
-        _winreg.HKEY_CURRENT_USER,
-        r"Software\Microsoft\Windows\CurrentVersion\Explorer\Shell Folders"
-    )
-    dir, type = _winreg.QueryValueEx(key, shell_folder_name)
-    return dir
+    def find_config_file(self, relpath):
+        """Return the path of the first `relpath` found in `config_dirs`,
+        or None.
+        """
+        return _find_in_layers(self.config_dirs, relpath)
 
+    def read_data_file(self, relpath, bundle="data.bundle"):
+        """Return the data of the first file `relpath` in `data_dirs` as a
+        `memoryview` (a `buffer` on Python 2), or None.
 
-def _get_win_folder_with_ctypes(csidl_name):
-    import ctypes
+        In each dir, a loose file is looked for first, then the file
+        in the "bundle" bundle (see `pack_bundle`) in it, if there is one.
+        Packing a site data dir's files into a bundle thus doesn't change
+        what this returns, but reading from the bundle takes no syscalls.
+        """
+        return _read_in_layers(self.data_dirs, relpath, bundle)
 
-    csidl_const = {
-        "CSIDL_APPDATA": 26,
-        "CSIDL_COMMON_APPDATA": 35,
-        "CSIDL_LOCAL_APPDATA": 28,
-    }[csidl_name]
+    def glob_data_files(self, pattern):
+        """Return the paths matching the glob `pattern` across `data_dirs`.
 
-    buf = ctypes.create_unicode_buffer(1024)
-    ctypes.windll.shell32.SHGetFolderPathW(None, csidl_const, None, 0, buf)
+        A file found in a dir hides the same relative path in dirs of lower
+        precedence. Paths are ordered by dir precedence, then by name.
+        """
+        return _glob_in_layers(self.data_dirs, pattern)
 
-    # Downgrade to short path name if have highbit chars. See
-    # <http://bugs.activestate.com/show_bug.cgi?id=85099>.
-    has_high_char = False
-    for c in buf:
-        if ord(c) > 255:
-            has_high_char = True
-            break
-    if has_high_char:
-        buf2 = ctypes.create_unicode_buffer(1024)
-        if ctypes.windll.kernel32.GetShortPathNameW(buf.value, buf2, 1024):
-            buf = buf2
+    def glob_config_files(self, pattern):
+        """Return the paths matching the glob `pattern` across
+        `config_dirs`. See `glob_data_files`.
+        """
+        return _glob_in_layers(self.config_dirs, pattern)
 
-    return buf.value
+    def _with_version(self, version):
+        return type(self)(self.appname, self.appauthor, version,
+                          roaming=self.roaming, multipath=self.multipath)
 
-def _get_win_folder_with_jna(csidl_name):
-    import array
-    from com.sun import jna
-    from com.sun.jna.platform import win32
+    def version_dirs(self, kind):
+        """Return a dict mapping each version of the app that has a `kind`
+        dir (e.g. "user_cache_dir") to the path of that dir.
 
-    buf_size = win32.WinDef.MAX_PATH * 2
-    buf = array.zeros('c', buf_size)
-    shell = win32.Shell32.INSTANCE
-    shell.SHGetFolderPath(None, getattr(win32.ShlObj, csidl_name), None, win32.ShlObj.SHGFP_TYPE_CURRENT, buf)
-    dir = jna.Native.toString(buf.tostring()).rstrip("\0")
+        These are the sibling version dirs the "version" argument creates,
+        found by listing the dir that holds them. Only version numbers
+        (dotted numbers with an optional pre-, post- or dev-release suffix,
+        like "1.0", "2.1b1" or "3.0.post1") and this instance's version
+        count: the same dir holds the files of the unversioned app, like a
+        "blobs" dir or the "log" dir below the Unix cache dir. A plain
+        number like "2023" counts too, so pass `collect_garbage` a "keep"
+        only for dirs that hold no such names. Returns {} if there is no
+        appname.
+        """
+        import re
+        if not kind.startswith("user_") or kind not in _DIR_KINDS:
+            raise ValueError("not a user dir kind: %r" % kind)
+        if not self.appname:
+            return {}
+        marker = "\0version\0"
+        parent, suffix = getattr(self._with_version(marker), kind).split(
+            marker, 1)
+        parent = parent.rstrip(os.sep)
+        unversioned = self._with_version(None)
+        reserved = [getattr(unversioned, k) for k in _DIR_KINDS
+                    if k.startswith("user_")]
+        versions = {}
+        for name in _listdir_or_empty(parent):
+            if name != self.version and not re.match(
+                    r"\d+(\.\d+)*((a|b|rc|\.?post|\.?dev)\d*)*\Z", name):
+                continue
+            sibling = os.path.join(parent, name)
+            if any(path == sibling or path.startswith(sibling + os.sep)
+                   for path in reserved):
+                continue
+            path = sibling + suffix
+            if os.path.isdir(path):
+                versions[name] = path
+        return versions
 
-    # Downgrade to short path name if have highbit chars. See
-    # <http://bugs.activestate.com/show_bug.cgi?id=85099>.
-    has_high_char = False
-    for c in dir:
-        if ord(c) > 255:
-            has_high_char = True
-            break
-    if has_high_char:
-        buf = array.zeros('c', buf_size)
-        kernel = win32.Kernel32.INSTANCE
-        if kernel.GetShortPathName(dir, buf, buf_size):
-            dir = jna.Native.toString(buf.tostring()).rstrip("\0")
+    def disk_usage(self, kinds=("user_cache_dir", "user_log_dir",
+                                "user_state_dir"),
+                   max_workers=8, summary_path=None, full=False):
+        """Return the bytes and file counts in the app's dirs.
 
-    return dir
+            "kinds" are the dir kinds to report on.
+            "max_workers" is the size of the thread pool that scans dirs.
+                Python 2 lacks `concurrent.futures`, so there dirs are
+                scanned one at a time.
+            "summary_path" is where a summary of each scanned dir is kept
+                between calls. By default it is ".appdirs-usage.json" in
+                the unversioned `user_cache_dir`. Pass False to not keep
+                one.
+            "full" ignores the summary and rescans everything.
 
-def _get_win_folder_from_environ(csidl_name):
-    env_var_name = {
-        "CSIDL_APPDATA": "APPDATA",
-        "CSIDL_COMMON_APPDATA": "ALLUSERSPROFILE",
-        "CSIDL_LOCAL_APPDATA": "LOCALAPPDATA",
-    }[csidl_name]
+        The result maps each kind to a dict with the "path", "bytes" and
+        "files" of the dir, and a "versions" dict with the same for each
+        version dir of that kind (see `version_dirs`).
 
-    return os.environ[env_var_name]
+        Dirs whose mtime matches the summary aren't listed again: a dir's
+        mtime changes when entries are added, removed or renamed, so the
+        names from the summary are still right, and only the files in it
+        are stat'ed again, to see ones that grew or shrank in place.
+        """
+        import json
+        if summary_path is None:
+            summary_path = os.path.join(self._with_version(None).user_cache_dir,
+                                        ".appdirs-usage.json")
+        summary = {}
+        if summary_path and not full:
+            try:
+                with open(summary_path, "rb") as f:
+                    summary = json.loads(f.read().decode("utf-8"))
+            except (IOError, OSError, ValueError):
+                pass
 
-if system == "win32":
-    try:
-        from ctypes import windll
-    except ImportError:
-        try:
-            import com.sun.jna
-        except ImportError:
+        report = {}
+        roots = set()
+        for kind in kinds:
+            versions = self.version_dirs(kind)
+            report[kind] = {"path": getattr(self, kind), "versions": dict(
+                (version, {"path": path}) for version, path in versions.items())}
+            roots.add(report[kind]["path"])
+            roots.update(versions.values())
+
+        scanned = _scan_tree(roots, summary, max_workers)
+        for kind_report in report.values():
+            for entry in [kind_report] + list(kind_report["versions"].values()):
+                entry["bytes"], entry["files"] = _subtree_usage(
+                    scanned, entry["path"])
+
+        if summary_path:
             try:
-                if PY3:
-                  import winreg as _winreg
+                _write_file_atomic(summary_path,
+                                   json.dumps(scanned).encode("utf-8"))
+            except (IOError, OSError):
+                pass
+        return report
+
+    def collect_garbage(self, kinds=("user_cache_dir", "user_log_dir",
+                                      "user_state_dir"),
+                        keep=None, keep_versions=None, ttl=None, dry_run=False,
+                        max_workers=4):
+        """Remove stale version dirs and old files from the app's dirs.
+
+            "kinds" are the dir kinds to clean up.
+            "keep" is how many of the newest version dirs (see
+                `version_dirs`) of each kind to keep. The dirs of this
+                instance's version are always kept. None (the default)
+                keeps them all, so version dirs are only removed when this
+                is passed.
+            "keep_versions" is an optional function that is called with a
+                version and returns True if that version must be kept.
+            "ttl" removes files that haven't been modified for this many
+                seconds from the dirs that are kept. None disables this.
+            "dry_run" only reports what would be removed.
+            "max_workers" is the size of the thread pool doing the removal
+                (see `_map_unordered`).
+
+        Versions are ordered by comparing their numeric parts, so "1.10" is
+        newer than "1.9". This holds `gc_lock()` exclusively, and raises
+        `LockTimeout` right away if another process holds it.
+
+        Returns a dict with the "removed_dirs" and "removed_files" lists,
+        the "bytes_freed" and whether this was a "dry_run".
+        """
+        stale_dirs = []
+        kept_dirs = []
+        for kind in kinds:
+            versions = self.version_dirs(kind)
+            ordered = sorted(versions, key=_version_sort_key, reverse=True)
+            for i, version in enumerate(ordered):
+                if (version == self.version
+                        or keep is None or i < keep
+                        or (keep_versions is not None
+                            and keep_versions(version))):
+                    kept_dirs.append(versions[version])
                 else:
-                  import _winreg
-            except ImportError:
-                _get_win_folder = _get_win_folder_from_environ
-            else:
-                _get_win_folder = _get_win_folder_from_registry
-        else:
-            _get_win_folder = _get_win_folder_with_jna
-    else:
-        _get_win_folder = _get_win_folder_with_ctypes
+                    stale_dirs.append(versions[version])
+            own_dir = getattr(self, kind)
+            if own_dir not in kept_dirs:
+                kept_dirs.append(own_dir)
 
+        with self.gc_lock().exclusive(timeout=0):
+            stale_files = []
+            if ttl is not None:
+                stale_files = _files_older_than(kept_dirs, stale_dirs,
+                                                time.time() - ttl)
+            freed = [nbytes for path, nbytes in _map_unordered(
+                lambda path: _remove_tree(path, dry_run), stale_dirs,
+                max_workers)]
+            freed.extend(nbytes for item, nbytes in _map_unordered(
+                lambda item: _remove_sized_file(item, dry_run), stale_files,
+                max_workers))
+        return {
+            "removed_dirs": stale_dirs,
+            "removed_files": [path for path, size in stale_files],
+            "bytes_freed": sum(freed),
+            "dry_run": dry_run,
+        }
 
-#---- self test code
+    def migrate_from(self, version, kinds=("user_data_dir", "user_config_dir",
+                                           "user_state_dir"),
+                     link=False, max_workers=8, progress=None):
+        """Copy the dirs of another version of the app into this version's.
 
-if __name__ == "__main__":
-    appname = "MyApp"
-    appauthor = "MyCompany"
+            "version" is the version to migrate from. None is the
+                unversioned layout, which is copied without the dirs of
+                this version inside it.
+            "kinds" are the dir kinds to migrate.
+            "link" hard-links files instead of copying them. That is the
+                fastest and takes no space, but the versions then share the
+                files, so only use it if files are replaced rather than
+                modified in place. Files that can't be linked are copied.
+            "max_workers" is the size of the thread pool doing the copies.
+                Python 2 lacks `concurrent.futures`, so there the files are
+                copied one at a time.
+            "progress" is an optional function that is called, from the
+                calling thread, as
+                `progress(files_done, files_total, bytes_done, bytes_total)`
+                each time a file is done.
 
-    props = ("user_data_dir",
-             "user_config_dir",
-             "user_cache_dir",
-             "user_state_dir",
-             "user_log_dir",
-             "site_data_dir",
-             "site_config_dir")
+        Files are copied with the fastest method that works for the pair of
+        filesystems: a reflink (a copy-on-write clone), `os.copy_file_range`,
+        `os.sendfile`, then reads and writes. Each file is written to a
+        ".part" file that is then renamed into place, and files that exist
+        with the size and mtime of the source are skipped, so running it
+        again finishes an interrupted migration. This holds `gc_lock()`
+        shared, so garbage collection can't remove the source meanwhile.
 
-    print("-- app dirs %s --" % __version__)
+        Returns a dict with the numbers of "files" copied or linked and of
+        files "skipped", the "bytes" copied, the "seconds" taken, the
+        "bytes_per_second" and a count of files per copy "methods".
+        """
+        if version == self.version:
+            raise ValueError("can't migrate version %r onto itself"
+                             % version)
+        start = _monotonic()
+        source = self._with_version(version)
+        pairs = []
+        for kind in kinds:
+            pair = (getattr(source, kind), getattr(self, kind))
+            if pair not in pairs:
+                pairs.append(pair)
+        report = {"files": 0, "skipped": 0, "bytes": 0, "methods": {}}
+        with self.gc_lock().shared():
+            files = _migration_plan(pairs)
+            bytes_total = sum(st.st_size for src, dst, st in files)
+            bytes_done = 0
+            results = _map_unordered(
+                lambda item: _migrate_file(item[0], item[1], item[2], link),
+                files, max_workers)
+            for done, (item, method) in enumerate(results, 1):
+                size = item[2].st_size
+                bytes_done += size
+                if method == "skipped":
+                    report["skipped"] += 1
+                else:
+                    report["files"] += 1
+                    report["bytes"] += size
+                    report["methods"][method] = \
+                        report["methods"].get(method, 0) + 1
+                if progress is not None:
+                    progress(done, len(files), bytes_done, bytes_total)
+        report["seconds"] = seconds = _monotonic() - start
+        report["bytes_per_second"] = report["bytes"] / seconds if seconds \
+            else 0.0
+        return report
 
-    print("-- app dirs (with optional 'version')")
-    dirs = AppDirs(appname, appauthor, version="1.0")
-    for prop in props:
-        print("%s: %s" % (prop, getattr(dirs, prop)))
+    def lock(self, name, kind="user_state_dir"):
+        """Return the `AppDirLock` for the resource `name` in the `kind`
+        dir. The lock file is "<dir>/.locks/<name>.lock".
+        """
+        if not name or os.sep in name or (os.altsep and os.altsep in name):
+            raise ValueError("invalid lock name: %r" % name)
+        return AppDirLock(os.path.join(getattr(self, kind), ".locks",
+                                       name + ".lock"))
 
-    print("\n-- app dirs (without optional 'version')")
-    dirs = AppDirs(appname, appauthor)
-    for prop in props:
-        print("%s: %s" % (prop, getattr(dirs, prop)))
+    def gc_lock(self):
+        """Return the `AppDirLock` that `collect_garbage` holds exclusively
+        while it runs. Processes that must not have their files removed
+        under them can hold it shared.
+        """
+        return AppDirLock(os.path.join(
+            self._with_version(None).user_state_dir, ".appdirs-gc.lock"))
 
-    print("\n-- app dirs (without optional 'appauthor')")
-    dirs = AppDirs(appname)
-    for prop in props:
-        print("%s: %s" % (prop, getattr(dirs, prop)))
+    def watch_config(self, callback):
+        """Call `callback(paths)` when files in `config_dirs` change, using
+        the shared `ConfigWatcher`. Returns a handle for
+        `ConfigWatcher.shared().unwatch`.
+        """
+        return ConfigWatcher.shared().watch(self.config_dirs, callback)
 
-    print("\n-- app dirs (with disabled 'appauthor')")
-    dirs = AppDirs(appname, appauthor=False)
-    for prop in props:
-        print("%s: %s" % (prop, getattr(dirs, prop)))
+
+class AppDirs(_AppDirsBase):
+    """Convenience wrapper for getting application dirs.
+
+    Resolved paths are cached per instance. The cache is dropped whenever
+    the constructor arguments, `system` or one of the environment
+    variables the resolvers read (see `_ENV_VARS`) change, so repeated
+    property access is cheap. Use `refresh()` to force re-resolution.
+
+    If "ensure_exists" is true, the user dirs are created as for the
+    "ensure_exists" argument of the functions when they are first accessed.
+    Site dirs are normally installed by packaging and aren't created; see
+    `ensure_all` for that.
+    """
+    def __init__(self, appname=None, appauthor=None, version=None,
+            roaming=False, multipath=False, ensure_exists=False):
+        self.appname = appname
+        self.appauthor = appauthor
+        self.version = version
+        self.roaming = roaming
+        self.multipath = multipath
+        self.ensure_exists = ensure_exists
+        self._cache = {}
+        self._cache_key = None
+        self._pinned = False
+
+    def frozen(self):
+        """Return the `FrozenAppDirs` with the same arguments."""
+        return FrozenAppDirs(self.appname, self.appauthor, self.version,
+                             self.roaming, self.multipath)
+
+
+class FrozenAppDirs(_AppDirsBase):
+    """Immutable, hashable and interned variant of `AppDirs`.
+
+    Instances have no "ensure_exists" option. They compare and hash by
+    their arguments, so they can be used as dict keys, and the constructor
+    returns the same instance for the same arguments, so the resolved
+    paths cached on it are shared by everything that uses those arguments.
+    Instances are kept for the life of the process.
+
+    The arguments are kept in one tuple, which is also the key of the
+    intern table, and with `__slots__` and the path cache only created on
+    first use, an instance takes less memory than an `AppDirs`; see
+    "python -m test.benchmark".
+    """
+    __slots__ = ("_args", "_cache", "_cache_key", "_pinned")
+
+    ensure_exists = False
+
+    appname = property(lambda self: self._args[0])
+    appauthor = property(lambda self: self._args[1])
+    version = property(lambda self: self._args[2])
+    roaming = property(lambda self: self._args[3])
+    multipath = property(lambda self: self._args[4])
+
+    _instances = {}     # args -> instance
+    _instances_lock = _allocate_lock()
+
+    def __new__(cls, appname=None, appauthor=None, version=None,
+                roaming=False, multipath=False):
+        args = (appname, appauthor, version, bool(roaming), bool(multipath))
+        self = cls._instances.get(args)
+        if self is None:
+            with cls._instances_lock:
+                self = cls._instances.get(args)
+                if self is None:
+                    self = object.__new__(cls)
+                    object.__setattr__(self, "_args", args)
+                    object.__setattr__(self, "_cache", None)
+                    object.__setattr__(self, "_cache_key", None)
+                    object.__setattr__(self, "_pinned", False)
+                    cls._instances[args] = self
+        return self
+
+    def __setattr__(self, name, value):
+        # Only the cache state can change.
+        if not name.startswith("_") or name == "_args":
+            raise AttributeError("FrozenAppDirs is immutable")
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError("FrozenAppDirs is immutable")
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Not supported: instances are shared, so pinning one to the dirs
+        in a snapshot would change them for every user. Use
+        `AppDirs.from_snapshot` instead.
+        """
+        raise TypeError("FrozenAppDirs can't be loaded from a snapshot; "
+                        "use AppDirs.from_snapshot()")
+
+    def _resolve(self, name, func, **kwargs):
+        # Like `AppDirs._resolve`, but the arguments can't change.
+        cache = self._cache
+        if not self._pinned:
+            key = _env_snapshot()
+            if cache is None or key != self._cache_key:
+                # Swap in a new dict rather than clearing the shared one
+                # under other threads.
+                cache = self._cache = {}
+                self._cache_key = key
+        try:
+            return cache[name]
+        except KeyError:
+            path = cache[name] = func(self._args[0], self._args[1], **kwargs)
+            return path
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, FrozenAppDirs):
+            return NotImplemented
+        return self._args == other._args
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(self._args)
+
+    def __reduce__(self):
+        return (FrozenAppDirs, self._args)
+
+    def __repr__(self):
+        return "FrozenAppDirs(%r, %r, %r, roaming=%r, multipath=%r)" % (
+            self._args)
+
+
+def _scan_dir(path, cached):
+    """Return the summary of dir `path`: its mtime, the bytes and number of
+    the files directly in it, and the names of its files and subdirs. If
+    the mtime hasn't changed, the names in the `cached` summary are reused
+    rather than listing the dir, but the files are stat'ed again, as they
+    may have grown. None if `path` doesn't exist.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    mtime = getattr(st, "st_mtime_ns", st.st_mtime)
+    nbytes = nfiles = 0
+    if (cached is not None and cached["mtime"] == mtime
+            and "filenames" in cached):
+        for name in cached["filenames"]:
+            try:
+                child_st = os.lstat(os.path.join(path, name))
+            except OSError:
+                continue
+            if stat.S_ISREG(child_st.st_mode):
+                nbytes += child_st.st_size
+                nfiles += 1
+        return {"mtime": mtime, "bytes": nbytes, "files": nfiles,
+                "filenames": cached["filenames"],
+                "subdirs": cached["subdirs"]}
+    filenames = []
+    subdirs = []
+    if hasattr(os, "scandir"):
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return None
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file(follow_symlinks=False):
+                    nbytes += entry.stat(follow_symlinks=False).st_size
+                    nfiles += 1
+                    filenames.append(entry.name)
+            except OSError:
+                continue
+    else:
+        for name in _listdir_or_empty(path):
+            child = os.path.join(path, name)
+            try:
+                child_st = os.lstat(child)
+            except OSError:
+                continue
+            if stat.S_ISDIR(child_st.st_mode):
+                subdirs.append(name)
+            elif stat.S_ISREG(child_st.st_mode):
+                nbytes += child_st.st_size
+                nfiles += 1
+                filenames.append(name)
+    return {"mtime": mtime, "bytes": nbytes, "files": nfiles,
+            "filenames": sorted(filenames), "subdirs": sorted(subdirs)}
+
+
+def _scan_tree(roots, summary, max_workers):
+    """Scan the trees under `roots` on a thread pool, one task per dir.
+
+    Returns a dict mapping every dir found to its `_scan_dir` summary.
+    """
+    try:
+        from concurrent.futures import (ThreadPoolExecutor, wait,
+                                        FIRST_COMPLETED)
+    except ImportError:     # Python 2
+        return _scan_tree_serially(roots, summary)
+    scanned = {}
+    with ThreadPoolExecutor(max_workers) as executor:
+        pending = {}
+        for root in roots:
+            pending[executor.submit(_scan_dir, root, summary.get(root))] = root
+        queued = set(roots)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                result = future.result()
+                if result is None:
+                    continue
+                scanned[path] = result
+                for name in result["subdirs"]:
+                    child = os.path.join(path, name)
+                    if child not in queued:
+                        queued.add(child)
+                        pending[executor.submit(
+                            _scan_dir, child, summary.get(child))] = child
+    return scanned
+
+
+def _scan_tree_serially(roots, summary):
+    """Like `_scan_tree`, but in this thread."""
+    scanned = {}
+    queued = set(roots)
+    stack = list(roots)
+    while stack:
+        path = stack.pop()
+        result = _scan_dir(path, summary.get(path))
+        if result is None:
+            continue
+        scanned[path] = result
+        for name in result["subdirs"]:
+            child = os.path.join(path, name)
+            if child not in queued:
+                queued.add(child)
+                stack.append(child)
+    return scanned
+
+
+def _subtree_usage(scanned, root):
+    """Return the total (bytes, files) of the tree at `root`."""
+    nbytes = nfiles = 0
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        entry = scanned.get(path)
+        if entry is None:
+            continue
+        nbytes += entry["bytes"]
+        nfiles += entry["files"]
+        stack.extend(os.path.join(path, name) for name in entry["subdirs"])
+    return nbytes, nfiles
+
+
+def _version_sort_key(version):
+    import re
+    # Compare numeric parts as numbers and rank anything else after a
+    # number (like "b1" in "1.9b1") as older than the number alone, so
+    # "1.10" > "1.9" > "1.9b1".
+    key = [(1, int(part)) if part.isdigit() else (0, part)
+           for part in re.split(r"(\d+)", version) if part and part != "."]
+    key.append((0.5,))
+    return key
+
+
+def _files_older_than(dirs, skip_dirs, cutoff):
+    """Return (path, size) for each file under `dirs` (but not under
+    `skip_dirs`) last modified before `cutoff`.
+    """
+    skip = set(skip_dirs)
+    seen = set()
+    old_files = []
+    for top in dirs:
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames[:] = [name for name in dirnames
+                           if os.path.join(dirpath, name) not in skip]
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if path in seen or name.startswith(".appdirs-"):
+                    continue
+                seen.add(path)
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    continue
+                if st.st_mtime < cutoff:
+                    old_files.append((path, st.st_size))
+    return old_files
+
+
+def _remove_tree(path, dry_run):
+    """Remove the tree at `path`, or just measure it if `dry_run`. Return
+    the bytes freed.
+    """
+    import shutil
+    nbytes = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                nbytes += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    if not dry_run:
+        shutil.rmtree(path, True)
+    return nbytes
+
+
+def _remove_sized_file(item, dry_run):
+    path, size = item
+    if not dry_run and not _remove(path):
+        return 0
+    return size
+
+
+def _migration_plan(pairs):
+    """Return a (src, dst, stat) tuple for each regular file to migrate
+    between the (src root, dst root) `pairs`, creating the dst dirs and
+    copying symlinks on the way.
+    """
+    dst_roots = set(dst for src, dst in pairs)
+    plan = []
+    for src_root, dst_root in pairs:
+        if not os.path.isdir(src_root):
+            continue
+        for dirpath, dirnames, filenames in os.walk(src_root):
+            rel = os.path.relpath(dirpath, src_root)
+            dst_dir = dst_root if rel == os.curdir else os.path.join(
+                dst_root, rel)
+            _makedirs(dst_dir)
+            for name in list(dirnames):
+                src = os.path.join(dirpath, name)
+                if src in dst_roots:
+                    dirnames.remove(name)
+                elif os.path.islink(src):
+                    dirnames.remove(name)
+                    filenames.append(name)
+            for name in filenames:
+                if name.endswith(".part"):
+                    continue
+                src = os.path.join(dirpath, name)
+                dst = os.path.join(dst_dir, name)
+                st = os.lstat(src)
+                if stat.S_ISLNK(st.st_mode):
+                    _copy_symlink(src, dst)
+                elif stat.S_ISREG(st.st_mode):
+                    plan.append((src, dst, st))
+    return plan
+
+
+def _copy_symlink(src, dst):
+    target = os.readlink(src)
+    if os.path.islink(dst):
+        if os.readlink(dst) == target:
+            return
+        _remove(dst)
+    os.symlink(target, dst)
+
+
+def _same_mtime(st1, st2):
+    if hasattr(st1, "st_mtime_ns"):
+        return st1.st_mtime_ns == st2.st_mtime_ns
+    # Python 2 sets times to the microsecond, through a float.
+    return abs(st1.st_mtime - st2.st_mtime) < 2e-6
+
+
+def _migrate_file(src, dst, st, link):
+    """Copy or link `src` (with stat `st`) to `dst` unless it's already
+    there. Return the method used, or "skipped".
+    """
+    try:
+        dst_st = os.stat(dst)
+    except OSError:
+        pass
+    else:
+        if dst_st.st_size == st.st_size and _same_mtime(dst_st, st):
+            return "skipped"
+    tmp_path = dst + ".part"
+    _remove(tmp_path)
+    if link:
+        try:
+            os.link(src, tmp_path)
+        except OSError as ex:
+            if ex.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK,
+                                errno.EOPNOTSUPP, errno.EACCES):
+                raise
+        else:
+            _replace(tmp_path, dst)
+            return "link"
+    fd_in = os.open(src, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        fd_out = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+                         | getattr(os, "O_BINARY", 0), 0o600)
+        try:
+            method = _copy_file_data(fd_in, fd_out, st.st_size)
+        finally:
+            os.close(fd_out)
+    finally:
+        os.close(fd_in)
+    os.chmod(tmp_path, stat.S_IMODE(st.st_mode))
+    if hasattr(st, "st_mtime_ns"):
+        os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    else:
+        os.utime(tmp_path, (st.st_atime, st.st_mtime))
+    _replace(tmp_path, dst)
+    return method
+
+
+class _CopyNotSupported(Exception):
+    pass
+
+# errnos meaning a copy method doesn't work for a pair of files.
+_COPY_UNSUPPORTED_ERRNOS = frozenset(
+    getattr(errno, name) for name in ("EXDEV", "EOPNOTSUPP", "ENOTSUP",
+                                      "ENOSYS", "EINVAL", "ENOTTY", "EBADF")
+    if hasattr(errno, name))
+
+_FICLONE = 0x40049409   # from <linux/fs.h>
+
+def _copy_reflink(fd_in, fd_out, size):
+    if not sys.platform.startswith("linux"):
+        raise _CopyNotSupported()
+    import fcntl
+    try:
+        fcntl.ioctl(fd_out, _FICLONE, fd_in)
+    except (IOError, OSError) as ex:
+        if ex.errno in _COPY_UNSUPPORTED_ERRNOS:
+            raise _CopyNotSupported()
+        raise
+
+def _copy_loop(copy, size):
+    # Call `copy(count)`, which returns the number of bytes copied, until
+    # `size` bytes are copied. Some filesystems return 0 from the first
+    # call rather than failing, which means the method doesn't work.
+    done = 0
+    while done < size:
+        try:
+            copied = copy(min(size - done, 1 << 30))
+        except OSError as ex:
+            if not done and ex.errno in _COPY_UNSUPPORTED_ERRNOS:
+                raise _CopyNotSupported()
+            raise
+        if not copied:
+            if not done:
+                raise _CopyNotSupported()
+            raise IOError(errno.EIO, "source ended after %d of %d bytes"
+                          % (done, size))
+        done += copied
+
+def _copy_file_range(fd_in, fd_out, size):
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range is None:
+        raise _CopyNotSupported()
+    _copy_loop(lambda count: copy_file_range(fd_in, fd_out, count), size)
+
+def _copy_sendfile(fd_in, fd_out, size):
+    # Only Linux can sendfile to a regular file.
+    sendfile = getattr(os, "sendfile", None)
+    if sendfile is None or not sys.platform.startswith("linux"):
+        raise _CopyNotSupported()
+    _copy_loop(lambda count: sendfile(fd_out, fd_in, None, count), size)
+
+def _copy_read_write(fd_in, fd_out, size):
+    while True:
+        data = os.read(fd_in, 1 << 20)
+        if not data:
+            break
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd_out, view):]
+
+# Copy methods, fastest first.
+_copy_methods = [
+    ("reflink", _copy_reflink),
+    ("copy_file_range", _copy_file_range),
+    ("sendfile", _copy_sendfile),
+    ("read_write", _copy_read_write),
+]
+
+# (method, src device, dst device) for the methods found not to work.
+_copy_methods_failed = set()
+
+def _copy_file_data(fd_in, fd_out, size):
+    """Copy the data of `fd_in` to `fd_out`, both at offset 0, with the
+    fastest method that works. Return the name of the method.
+    """
+    devs = (os.fstat(fd_in).st_dev, os.fstat(fd_out).st_dev)
+    for method, copy in _copy_methods:
+        if (method,) + devs in _copy_methods_failed:
+            continue
+        try:
+            copy(fd_in, fd_out, size)
+        except _CopyNotSupported:
+            _copy_methods_failed.add((method,) + devs)
+            os.lseek(fd_in, 0, os.SEEK_SET)
+            os.lseek(fd_out, 0, os.SEEK_SET)
+            os.ftruncate(fd_out, 0)
+            continue
+        return method
+    raise AssertionError("the read_write copy method can't fail")
+
+
+#---- batch resolution
+
+# The directory kinds resolved for every app, in display order.
+_DIR_KINDS = ("user_data_dir",
+              "user_config_dir",
+              "user_cache_dir",
+              "user_state_dir",
+              "user_log_dir",
+              "user_runtime_dir",
+              "site_data_dir",
+              "site_config_dir")
+
+def _make_app_dirs_record():
+    import collections
+    return collections.namedtuple(
+        "AppDirsRecord", ("appname", "appauthor", "version") + _DIR_KINDS)
+
+
+class _BatchResolver(object):
+    """Resolve the dirs of many apps against one read of the environment.
+
+    The platform base dirs (and the split XDG_DATA_DIRS/XDG_CONFIG_DIRS
+    lists) are computed once up front from a `Resolver`; `resolve` then
+    only does the per-app joins. The results are identical to calling each
+    of the `Resolver` methods.
+    """
+    def __init__(self, resolver, roaming=False, multipath=False, opinion=True):
+        self.pathmod = resolver.pathmod
+        self.multipath = multipath
+        self.opinion = opinion
+        if resolver.platform == "win32":
+            self.resolve = self._resolve_windows
+            self.user_base = resolver.user_data_dir(roaming=roaming)
+            self.local_base = resolver.user_data_dir()
+            self.common_base = resolver.site_data_dir()
+            self.runtime_base = resolver.user_runtime_dir()
+        elif resolver.platform == "darwin":
+            self.resolve = self._resolve_mac
+            self.data_base = resolver.user_data_dir()
+            self.site_data_base = resolver.site_data_dir()
+            self.config_base = resolver.user_config_dir()
+            self.site_config_base = resolver.site_config_dir()
+            self.cache_base = resolver.user_cache_dir()
+            self.log_base = resolver._expand('~/Library/Logs')
+            self.runtime_base = resolver.user_runtime_dir()
+        else:
+            self.resolve = self._resolve_xdg
+            self.data_base = resolver.user_data_dir()
+            self.config_base = resolver.user_config_dir()
+            self.cache_base = resolver.user_cache_dir()
+            self.state_base = resolver.user_state_dir()
+            try:
+                self.runtime_base = resolver.user_runtime_dir()
+            except ValueError:      # no uid to default to
+                self.runtime_base = None
+            self.site_data_bases = resolver._xdg_dirs(
+                'XDG_DATA_DIRS',
+                resolver.pathmod.pathsep.join(['/usr/local/share',
+                                               '/usr/share']))
+            self.site_config_bases = resolver._xdg_dirs(
+                'XDG_CONFIG_DIRS', '/etc/xdg')
+
+    def _resolve_windows(self, appname, appauthor, version):
+        join = self.pathmod.join
+        if appauthor is None:
+            appauthor = appname
+        user_path = self.user_base
+        local_path = self.local_base
+        common_path = self.common_base
+        runtime_path = self.runtime_base
+        if appname:
+            if appauthor is not False:
+                user_path = join(user_path, appauthor, appname)
+                local_path = join(local_path, appauthor, appname)
+                common_path = join(common_path, appauthor, appname)
+                runtime_path = join(runtime_path, appauthor, appname)
+            else:
+                user_path = join(user_path, appname)
+                local_path = join(local_path, appname)
+                common_path = join(common_path, appname)
+                runtime_path = join(runtime_path, appname)
+        cache_path = local_path
+        if appname and self.opinion:
+            cache_path = join(cache_path, "Cache")
+        if appname and version:
+            user_path = join(user_path, version)
+            local_path = join(local_path, version)
+            common_path = join(common_path, version)
+            cache_path = join(cache_path, version)
+            runtime_path = join(runtime_path, version)
+        log_path = local_path
+        if self.opinion:
+            log_path = join(log_path, "Logs")
+        return (user_path, user_path, cache_path, user_path, log_path,
+                runtime_path, common_path, common_path)
+
+    def _resolve_mac(self, appname, appauthor, version):
+        join = self.pathmod.join
+        paths = [self.data_base, self.config_base, self.cache_base,
+                 self.runtime_base, self.site_data_base]
+        site_config = self.site_config_base
+        if appname:
+            paths = [join(path, appname) for path in paths]
+            site_config = join(site_config, appname)
+        log_path = join(self.log_base, appname)
+        # `site_config_dir` doesn't apply "version" on Mac.
+        if appname and version:
+            paths = [join(path, version) for path in paths]
+            log_path = join(log_path, version)
+        data, config, cache, runtime, site_data = paths
+        return (data, config, cache, data, log_path, runtime, site_data,
+                site_config)
+
+    def _resolve_xdg(self, appname, appauthor, version):
+        join = self.pathmod.join
+        paths = [self.data_base, self.config_base, self.cache_base,
+                 self.state_base]
+        runtime = self.runtime_base
+        site_data = self.site_data_bases
+        site_config = self.site_config_bases
+        if appname and runtime is not None:
+            runtime = join(runtime, appname)
+            if version:
+                runtime = join(runtime, version)
+        if appname:
+            paths = [join(path, appname) for path in paths]
+            subdir = join(appname, version) if version else appname
+            sep = self.pathmod.sep
+            site_data = [sep.join([x, subdir]) for x in site_data]
+            site_config = [sep.join([x, subdir]) for x in site_config]
+        if appname and version:
+            paths = [join(path, version) for path in paths]
+        data, config, cache, state = paths
+        log_path = cache
+        if self.opinion:
+            log_path = join(log_path, "log")
+        if self.multipath:
+            pathsep = self.pathmod.pathsep
+            site_data = pathsep.join(site_data)
+            site_config = pathsep.join(site_config)
+        else:
+            site_data = site_data[0]
+            site_config = site_config[0]
+        return (data, config, cache, state, log_path, runtime, site_data,
+                site_config)
+
+
+def _split_app_spec(spec):
+    if spec is None or isinstance(spec, (str, unicode)):
+        return spec, None, None
+    if isinstance(spec, dict):
+        return (spec.get("appname"), spec.get("appauthor"),
+                spec.get("version"))
+    spec = tuple(spec)
+    if len(spec) > 3:
+        raise ValueError("app spec has more than 3 items: %r" % (spec,))
+    return (spec + (None, None, None))[:3]
+
+
+def iter_app_dirs(specs, roaming=False, multipath=False, opinion=True,
+                  resolver=None):
+    r"""Yield an `AppDirsRecord` with all dir kinds for each app in `specs`.
+
+        "specs" is an iterable of app specs. Each spec is either an appname,
+            a "(appname, appauthor, version)" tuple (trailing items may be
+            omitted) or a dict with any of those keys.
+        "roaming", "multipath" and "opinion" are applied to every app and
+            have the same meaning as for the individual functions.
+        "resolver" is the `Resolver` to use, e.g. for another platform. By
+            default the dirs are resolved for this process. The
+            "user_runtime_dir" of the records is None where the resolver
+            can't tell it (see `Resolver`).
+
+    The environment is read once, when iteration starts, so this is much
+    cheaper than calling each resolver function for each app.
+    """
+    if resolver is None:
+        resolver = _host_resolver()
+    resolve = _BatchResolver(resolver, roaming, multipath, opinion).resolve
+    record = _lazy_attribute("AppDirsRecord")
+    for spec in specs:
+        appname, appauthor, version = _split_app_spec(spec)
+        yield record(appname, appauthor, version,
+                     *resolve(appname, appauthor, version))
+
+
+def resolve_app_dirs(specs, roaming=False, multipath=False, opinion=True,
+                     resolver=None):
+    """Return a list of `AppDirsRecord`s for `specs`.
+
+    See `iter_app_dirs` for details.
+    """
+    return list(iter_app_dirs(specs, roaming, multipath, opinion, resolver))
+
+
+#---- resource lookup
+
+class _ListingCache(object):
+    """Caches the listings of dirs, for finding files across layered dirs
+    without listing each dir per lookup.
+
+    Each use stats the dir and only lists it again if it changed (or was
+    replaced). With a "recheck_interval" (in seconds), a listing is trusted
+    for that long without a stat. Missing dirs are cached too.
+    """
+    # A listing taken less than this many seconds after the dir changed
+    # isn't reused, as a change in the same mtime tick wouldn't show.
+    mtime_granularity = 2.0
+
+    def __init__(self, recheck_interval=0):
+        self.recheck_interval = recheck_interval
+        # path -> ((inode, mtime), time last checked, {name: is_dir} or
+        #          None, whether the listing may miss a change)
+        self._listings = {}
+
+    def clear(self):
+        self._listings.clear()
+
+    def listing(self, path):
+        """Return a dict mapping the names in dir `path` to whether they
+        are dirs, or None if `path` isn't a dir.
+        """
+        now = _monotonic()
+        entry = self._listings.get(path)
+        if entry is not None and now - entry[1] < self.recheck_interval:
+            return entry[2]
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        version = None if st is None else (
+            st.st_ino, getattr(st, "st_mtime_ns", st.st_mtime))
+        if entry is not None and entry[0] == version and not entry[3]:
+            listing = entry[2]
+        elif st is None:
+            listing = None
+        else:
+            try:
+                listing = _list_dir(path)
+            except OSError:     # not a dir, or gone since the stat
+                listing = None
+        racy = (st is not None
+                and time.time() - st.st_mtime < self.mtime_granularity)
+        self._listings[path] = (version, now, listing, racy)
+        return listing
+
+_listing_cache = _ListingCache()
+
+
+def _list_dir(path):
+    if hasattr(os, "scandir"):
+        listing = {}
+        for entry in os.scandir(path):
+            try:
+                listing[entry.name] = entry.is_dir()
+            except OSError:
+                listing[entry.name] = False
+        return listing
+    return dict((name, os.path.isdir(os.path.join(path, name)))
+                for name in os.listdir(path))
+
+
+def _split_multipath(path):
+    # Only the XDG resolvers return several os.pathsep-separated dirs.
+    if system in ("win32", "darwin"):
+        return [path]
+    return path.split(os.pathsep)
+
+
+def _split_relpath(relpath):
+    parts = [part for part in relpath.replace("\\", "/").split("/")
+             if part not in ("", ".")]
+    if not parts or ".." in parts or os.path.isabs(relpath):
+        raise ValueError("not a relative path below the dir: %r" % relpath)
+    return parts
+
+
+def _find_in_layers(layers, relpath, files_only=False):
+    # Only the listing of the file's own dir is needed: the stat that
+    # checks it also tells that the dirs above it exist. So a lookup costs
+    # one stat per layer, plus a listing of the dirs that changed.
+    parts = _split_relpath(relpath)
+    name = parts.pop()
+    for layer in layers:
+        dir = os.path.join(layer, *parts)
+        listing = _listing_cache.listing(dir)
+        if listing is None or name not in listing:
+            continue
+        if files_only and listing[name]:
+            continue
+        return os.path.join(dir, name)
+    return None
+
+
+def _glob_in_layers(layers, pattern):
+    import fnmatch
+    import glob
+    parts = _split_relpath(pattern)
+    last = len(parts) - 1
+    seen = set()
+    paths = []
+    for layer in layers:
+        matches = [()]
+        for i, part in enumerate(parts):
+            next_matches = []
+            for match in matches:
+                listing = _listing_cache.listing(os.path.join(layer, *match))
+                if listing is None:
+                    continue
+                if glob.has_magic(part):
+                    names = sorted(fnmatch.filter(listing, part))
+                    if not part.startswith("."):
+                        names = [n for n in names if not n.startswith(".")]
+                elif part in listing:
+                    names = [part]
+                else:
+                    names = []
+                for name in names:
+                    if i < last and not listing[name]:
+                        continue
+                    next_matches.append(match + (name,))
+            matches = next_matches
+        for match in matches:
+            if match not in seen:
+                seen.add(match)
+                paths.append(os.path.join(layer, *match))
+    return paths
+
+
+#---- asset bundles
+
+# A bundle is a header, the file data, the names and a fixed-width index
+# with an entry per file, sorted by name:
+#   header: magic, format version, file count, offset of the index
+#   entry:  offset and length of the name (UTF-8, "/"-separated), offset
+#           and length of the data
+# The names are in index order and NUL-terminated, so they can be read in
+# one go.
+_BUNDLE_MAGIC = b"APPDIRSB"
+_BUNDLE_HEADER = "<8sIIQ"
+_BUNDLE_ENTRY = "<QQQQ"
+
+
+def pack_bundle(src_dir, bundle_path):
+    """Pack the files below `src_dir` into the bundle file `bundle_path`,
+    for reading with `AssetBundle`. Return the number of files packed.
+
+    The bundle is written to a temp file that is renamed into place, so
+    readers of an older bundle at that path keep seeing its contents.
+    """
+    import shutil
+    import struct
+    import tempfile
+    names = []
+    for dirpath, dirnames, filenames in os.walk(src_dir):
+        dirnames.sort()
+        rel = os.path.relpath(dirpath, src_dir)
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if os.path.abspath(path) == os.path.abspath(bundle_path):
+                continue
+            relpath = filename if rel == os.curdir else "/".join(
+                _split_relpath(os.path.join(rel, filename)))
+            if not isinstance(relpath, bytes):
+                relpath = relpath.encode("utf-8")
+            names.append((relpath, path))
+    names.sort()
+
+    header = struct.Struct(_BUNDLE_HEADER)
+    entry = struct.Struct(_BUNDLE_ENTRY)
+    _makedirs(os.path.dirname(os.path.abspath(bundle_path)))
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=".", dir=os.path.dirname(os.path.abspath(bundle_path)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(b"\0" * header.size)
+            offset = header.size
+            entries = []
+            for name, path in names:
+                # Align the data, for readers that map it onto arrays.
+                padding = -offset % 8
+                f.write(b"\0" * padding)
+                offset += padding
+                with open(path, "rb") as src:
+                    shutil.copyfileobj(src, f, 1 << 20)
+                    size = src.tell()
+                entries.append((offset, size))
+                offset += size
+            name_offsets = []
+            for name, path in names:
+                name_offsets.append(offset)
+                f.write(name + b"\0")
+                offset += len(name) + 1
+            padding = -offset % 8
+            f.write(b"\0" * padding)
+            index_offset = offset + padding
+            for (name, path), name_offset, (data_offset, size) in zip(
+                    names, name_offsets, entries):
+                f.write(entry.pack(name_offset, len(name),
+                                           data_offset, size))
+            f.seek(0)
+            f.write(header.pack(_BUNDLE_MAGIC, 1, len(names),
+                                        index_offset))
+        _replace(tmp_path, bundle_path)
+    except BaseException:
+        _remove(tmp_path)
+        raise
+    return len(names)
+
+
+class AssetBundle(object):
+    """Read-only access to a bundle made with `pack_bundle`.
+
+    The bundle is memory-mapped and files are returned as `memoryview`
+    slices of it, so reading one needs no syscalls or copies. The names
+    are read once, on open, and lookups are binary searches of them. The
+    slices must be released before `close()`.
+
+        with AssetBundle(path) as bundle:
+            data = bundle.get("icons/app.png")
+    """
+    def __init__(self, path):
+        import mmap
+        import struct
+        self.path = path
+        self._entry = entry = struct.Struct(_BUNDLE_ENTRY)
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, format, count, index_offset = struct.unpack_from(
+                _BUNDLE_HEADER, self._mmap, 0)
+            if magic != _BUNDLE_MAGIC or format != 1:
+                raise ValueError("not an appdirs bundle: %r" % path)
+            if index_offset + count * entry.size > len(self._mmap):
+                raise ValueError("truncated bundle: %r" % path)
+        except BaseException:
+            self._mmap.close()
+            raise
+        try:
+            self._view = memoryview(self._mmap)
+        except TypeError:   # Python 2 mmaps don't export buffers
+            self._view = None
+        # The names are read into a list up front, so that lookups are a
+        # binary search in C.
+        self._index_offset = index_offset
+        self._names = []
+        if count:
+            start = entry.unpack_from(self._mmap, index_offset)[0]
+            last_offset, last_length = entry.unpack_from(
+                self._mmap, index_offset + (count - 1) * entry.size)[:2]
+            self._names = self._mmap[
+                start:last_offset + last_length].split(b"\0")
+            if len(self._names) != count:
+                self.close()
+                raise ValueError("corrupt bundle: %r" % path)
+
+    def _find(self, relpath):
+        # Return the index of `relpath`, or -1.
+        import bisect
+        wrapped = "/%s/" % relpath
+        if ("\\" in relpath or "//" in wrapped or "/./" in wrapped
+                or "/../" in wrapped):
+            relpath = "/".join(_split_relpath(relpath))
+        key = relpath if isinstance(relpath, bytes) else relpath.encode("utf-8")
+        i = bisect.bisect_left(self._names, key)
+        if i < len(self._names) and self._names[i] == key:
+            return i
+        return -1
+
+    def get(self, relpath, default=None):
+        """Return the data of the file `relpath` in the bundle as a
+        `memoryview` (a `buffer` on Python 2), or `default`.
+        """
+        i = self._find(relpath)
+        if i < 0:
+            return default
+        entry = self._entry
+        name_offset, name_length, data_offset, size = entry.unpack_from(
+            self._mmap, self._index_offset + i * entry.size)
+        if self._view is None:
+            return buffer(self._mmap, data_offset, size)
+        return self._view[data_offset:data_offset + size]
+
+    def __contains__(self, relpath):
+        return self._find(relpath) >= 0
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        for name in self._names:
+            yield name.decode("utf-8")
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# bundle path -> ((inode, mtime, size) of the file when opened, AssetBundle)
+_bundle_cache = {}
+
+def _read_in_layers(layers, relpath, bundle_name):
+    """Return the data of `relpath` from the first of `layers` that has it,
+    loose or in its `bundle_name` bundle, as a `memoryview` (a `buffer` on
+    Python 2), or None.
+    """
+    for layer in layers:
+        path = _find_in_layers([layer], relpath, files_only=True)
+        if path is not None:
+            with open(path, "rb") as f:
+                data = f.read()
+            if not PY3:
+                return buffer(data)
+            return memoryview(data)
+        bundle_path = os.path.join(layer, bundle_name)
+        try:
+            st = os.stat(bundle_path)
+        except OSError:
+            continue
+        version = (st.st_ino, getattr(st, "st_mtime_ns", st.st_mtime),
+                   st.st_size)
+        entry = _bundle_cache.get(bundle_path)
+        if entry is None or entry[0] != version:
+            # The bundle was replaced or rewritten since it was opened.
+            old_entry = entry
+            entry = _bundle_cache[bundle_path] = (version,
+                                                  AssetBundle(bundle_path))
+            if old_entry is not None:
+                try:
+                    old_entry[1].close()
+                except BufferError:
+                    # Data read from it is still in use; the map is freed
+                    # with the last of it.
+                    pass
+        data = entry[1].get(relpath)
+        if data is not None:
+            return data
+    return None
+
+
+#---- locking
+
+class LockTimeout(Exception):
+    """Raised when an `AppDirLock` can't be acquired in time."""
+
+
+class AppDirLock(object):
+    """A cross-process, reentrant shared/exclusive lock on a lock file.
+
+    Use `AppDirs.lock` to get one for a named resource in an app dir.
+    Locks are taken with `fcntl.flock`. On platforms without it, shared
+    locks are taken as exclusive ones with `msvcrt.locking`.
+
+        lock = dirs.lock("index", "user_cache_dir")
+        with lock.shared(timeout=5):
+            ...read...
+        with lock.exclusive():
+            ...write...
+
+    Within a process the lock also works between threads: any number of
+    threads can hold it shared, or one thread exclusively. A thread that
+    holds it can acquire it again, in either mode if it holds it
+    exclusively, but a shared hold can't be upgraded to exclusive.
+
+    All `AppDirLock`s for a path in a process share one file descriptor,
+    opened on first use and kept open, so acquiring only costs the
+    `flock` call and a check that the lock file hasn't been removed or
+    replaced (a stale lock file); if it has, the new file is locked
+    instead. Exclusive holders record their pid in the file, see
+    `holder_pid`.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = _LockFile.get(path)
+
+    def acquire(self, shared=False, timeout=None):
+        """Acquire the lock, waiting at most "timeout" seconds (None waits
+        forever, 0 doesn't wait). Raises `LockTimeout` on timeout.
+        """
+        self._file.acquire(shared, timeout)
+
+    def release(self):
+        self._file.release()
+
+    def shared(self, timeout=None):
+        """Return a context manager holding the lock shared."""
+        return _HeldLock(self, True, timeout)
+
+    def exclusive(self, timeout=None):
+        """Return a context manager holding the lock exclusively."""
+        return _HeldLock(self, False, timeout)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def holder_pid(self):
+        """Return the pid of the last exclusive holder, or None."""
+        try:
+            with open(self.path, "rb") as f:
+                return int(f.read().strip() or 0) or None
+        except (IOError, OSError, ValueError):
+            return None
+
+
+class _HeldLock(object):
+    def __init__(self, lock, shared, timeout):
+        self.lock = lock
+        self.shared = shared
+        self.timeout = timeout
+
+    def __enter__(self):
+        self.lock.acquire(self.shared, self.timeout)
+        return self.lock
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+
+class _LockFile(object):
+    """The per-process state of a lock file, shared by its `AppDirLock`s."""
+    _instances = {}
+    _instances_lock = _allocate_lock()
+
+    @classmethod
+    def get(cls, path):
+        path = os.path.abspath(path)
+        with cls._instances_lock:
+            lock_file = cls._instances.get(path)
+            if lock_file is None:
+                lock_file = cls._instances[path] = cls(path)
+            return lock_file
+
+    def __init__(self, path):
+        import threading
+        try:
+            import fcntl
+        except ImportError:
+            fcntl = None    # msvcrt is used instead
+        self.path = path
+        self._fcntl = fcntl
+        self._cond = threading.Condition(_allocate_lock())
+        self._owners = {}       # thread ident -> [shared, count]
+        self._busy = False      # a thread is taking the OS lock
+        self._fd = None
+        self._pid = None
+
+    def _forked(self):
+        # In a forked child the locks are the parent's. So is the fd's open
+        # file, which holds the OS lock: close it, or the lock would outlive
+        # the parent.
+        self._owners.clear()
+        self._busy = False
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
+        self._pid = os.getpid()
+
+    @classmethod
+    def _after_fork(cls):
+        # Only this thread survives a fork, and the others may have held
+        # the locks.
+        import threading
+        cls._instances_lock = _allocate_lock()
+        for lock_file in cls._instances.values():
+            lock_file._cond = threading.Condition(_allocate_lock())
+            lock_file._forked()
+
+    def _compatible(self, shared):
+        if shared:
+            return all(owner[0] for owner in self._owners.values())
+        return not self._owners
+
+    def acquire(self, shared, timeout):
+        deadline = None if timeout is None else _monotonic() + timeout
+        tid = _get_thread_ident()
+        with self._cond:
+            if self._pid != os.getpid():
+                self._forked()
+            owner = self._owners.get(tid)
+            if owner is not None:
+                if shared or not owner[0]:
+                    owner[1] += 1
+                    return
+                raise RuntimeError("can't upgrade a shared lock to exclusive")
+            while self._busy or not self._compatible(shared):
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - _monotonic()
+                    if remaining <= 0:
+                        raise LockTimeout("timed out waiting for %s"
+                                          % self.path)
+                self._cond.wait(remaining)
+            if self._owners:
+                # Other threads hold it shared, so the OS lock is held too.
+                self._owners[tid] = [shared, 1]
+                return
+            self._busy = True
+        try:
+            self._os_lock(shared, deadline)
+        except BaseException:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            self._busy = False
+            self._owners[tid] = [shared, 1]
+
+    def release(self):
+        tid = _get_thread_ident()
+        with self._cond:
+            owner = self._owners.get(tid)
+            if owner is None:
+                raise RuntimeError("lock is not held by this thread")
+            owner[1] -= 1
+            if owner[1]:
+                return
+            del self._owners[tid]
+            if not self._owners:
+                self._os_unlock()
+            self._cond.notify_all()
+
+    def _open(self):
+        _makedirs(os.path.dirname(self.path))
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    def _os_lock(self, shared, deadline):
+        delay = 0.001
+        while True:
+            if self._fd is None:
+                self._open()
+            if self._try_os_lock(shared, blocking=deadline is None):
+                if self._is_current():
+                    break
+                # The lock file was removed or replaced while we waited for
+                # it: it's stale, lock the current one instead.
+                self._os_unlock()
+                os.close(self._fd)
+                self._fd = None
+                continue
+            if deadline is not None and _monotonic() >= deadline:
+                raise LockTimeout("timed out waiting for %s" % self.path)
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        if not shared:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            os.ftruncate(self._fd, 0)
+            os.write(self._fd, str(os.getpid()).encode("ascii"))
+
+    def _try_os_lock(self, shared, blocking):
+        fcntl = self._fcntl
+        if fcntl is not None:
+            flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(self._fd, flags)
+            except (IOError, OSError) as ex:
+                if ex.errno in (errno.EAGAIN, errno.EACCES,
+                                errno.EWOULDBLOCK):
+                    return False
+                raise
+            return True
+        import msvcrt
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        try:
+            msvcrt.locking(self._fd, msvcrt.LK_NBLCK, 1)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def _os_unlock(self):
+        if self._fcntl is not None:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+        else:
+            import msvcrt
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+
+    def _is_current(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        fst = os.fstat(self._fd)
+        return (st.st_ino, st.st_dev) == (fst.st_ino, fst.st_dev)
+
+if hasattr(os, "register_at_fork"):
+    # Forked children drop the parent's lock fds right away rather than on
+    # their next acquire, so workers that never lock don't keep them.
+    os.register_at_fork(after_in_child=_LockFile._after_fork)
+
+
+#---- filesystem info
+
+# Filesystem types whose contents live in memory.
+_MEMORY_FS_TYPES = frozenset(["tmpfs", "ramfs", "devtmpfs", "hugetlbfs",
+                              "shm"])
+
+
+def filesystem_type(path):
+    """Return the type of the filesystem `path` is on, e.g. "ext4" or
+    "tmpfs", or None if it can't be told.
+
+    The path needn't exist yet: its nearest existing parent is used. The
+    type is read from "/proc/mounts", so this only works on Linux.
+    """
+    path = os.path.realpath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    mounts = _read_mounts()
+    while True:
+        fs_type = mounts.get(path)
+        if fs_type is not None:
+            return fs_type
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def is_memory_backed(path):
+    """Return True if `path` is on a memory-backed filesystem like tmpfs,
+    False if it isn't, or None if that can't be told (see
+    `filesystem_type`).
+
+    Use this to route latency-sensitive scratch files, e.g. to
+    `user_runtime_dir` over `user_cache_dir`:
+
+        if appdirs.is_memory_backed(dirs.user_runtime_dir):
+            scratch = dirs.user_runtime_dir
+    """
+    fs_type = filesystem_type(path)
+    if fs_type is None:
+        return None
+    return fs_type in _MEMORY_FS_TYPES
+
+
+def _read_mounts():
+    """Return a dict mapping each mount point to its filesystem type.
+
+    Later mounts on the same point hide earlier ones, as in the kernel.
+    """
+    import re
+    mounts = {}
+    try:
+        with open("/proc/mounts", "rb") as f:
+            lines = f.read().decode("utf-8", "replace").splitlines()
+    except (IOError, OSError):
+        return mounts
+    for line in lines:
+        fields = line.split()
+        if len(fields) >= 3:
+            # Spaces and such in mount points are escaped as "\040".
+            mount_point = re.sub(r"\\([0-7]{3})",
+                                 lambda m: chr(int(m.group(1), 8)), fields[1])
+            mounts[mount_point] = fields[2]
+    return mounts
+
+
+#---- config loading
+
+class ConfigLoader(object):
+    """Loads a config file from every config dir and merges the layers.
+
+        "dirs" is the `AppDirs` whose `config_dirs` are searched.
+        "filename" is the path of the config file relative to each dir.
+        "format" is one of "ini", "json" or "toml". By default it is
+            guessed from the extension of "filename" (".ini", ".cfg" and
+            ".conf" are INI).
+
+    Layers are merged in XDG precedence order: the last `site_config_dir`
+    entry first and `user_config_dir` last, so values from the user's file
+    win. Dicts (and INI sections) are merged recursively, anything else is
+    replaced. Parsed files are cached process-wide on (path, mtime, size),
+    so unchanged files are never read twice.
+
+    TOML needs Python 3.11+ or the "tomli" package.
+    """
+    def __init__(self, dirs, filename, format=None):
+        if format is None:
+            ext = os.path.splitext(filename)[1].lower()
+            format = _CONFIG_FORMAT_FROM_EXT.get(ext)
+            if format is None:
+                raise ValueError("can't tell the config format of %r, "
+                                 "pass format explicitly" % filename)
+        if format not in _CONFIG_PARSERS:
+            raise ValueError("unknown config format: %r" % format)
+        self.dirs = dirs
+        self.filename = filename
+        self.format = format
+        self._stamps = None
+        self._merged = None
+
+    @property
+    def paths(self):
+        """The candidate config file paths, lowest precedence first."""
+        relparts = _split_relpath(self.filename)
+        return [os.path.join(dir, *relparts)
+                for dir in reversed(self.dirs.config_dirs)]
+
+    def load(self):
+        """Return the merged config, loading it on first use.
+
+        The returned dict is shared between calls; don't modify it.
+        """
+        if self._merged is None:
+            return self.reload()
+        return self._merged
+
+    def reload(self):
+        """Check every layer for changes and return the merged config,
+        parsing only the layers that changed.
+        """
+        stamps = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stamps.append(
+                (path, (getattr(st, "st_mtime_ns", st.st_mtime), st.st_size)))
+        if stamps != self._stamps:
+            merged = {}
+            for path, stamp in stamps:
+                _merge_config(merged, _parse_config_cached(
+                    path, stamp, self.format))
+            self._stamps = stamps
+            self._merged = merged
+        return self._merged
+
+
+def _parse_ini(f):
+    try:
+        import configparser
+    except ImportError:
+        import ConfigParser as configparser
+    parser = configparser.RawConfigParser()
+    parser.optionxform = str    # keep the case of keys, as JSON/TOML do
+    if hasattr(parser, "read_file"):
+        parser.read_file(io.TextIOWrapper(f, encoding="utf-8"))
+    else:
+        parser.readfp(f)
+    config = dict((section, dict(parser.items(section)))
+                  for section in parser.sections())
+    if parser.defaults():
+        config[parser.default_section if hasattr(parser, "default_section")
+               else "DEFAULT"] = dict(parser.defaults())
+    return config
+
+
+def _parse_json(f):
+    import json
+    return json.loads(f.read().decode("utf-8"))
+
+
+def _parse_toml(f):
+    try:
+        import tomllib
+    except ImportError:
+        try:
+            import tomli as tomllib
+        except ImportError:
+            raise RuntimeError("reading TOML config requires Python 3.11+ "
+                               "or the 'tomli' package")
+    return tomllib.load(f)
+
+
+_CONFIG_PARSERS = {
+    "ini": _parse_ini,
+    "json": _parse_json,
+    "toml": _parse_toml,
+}
+_CONFIG_FORMAT_FROM_EXT = {
+    ".ini": "ini",
+    ".cfg": "ini",
+    ".conf": "ini",
+    ".json": "json",
+    ".toml": "toml",
+}
+
+# path -> (stamp, format, parsed config), see `_parse_config_cached`
+_parsed_configs = {}
+
+def _parse_config_cached(path, stamp, format):
+    """Return the parsed config at `path`, reusing the last parse if the
+    file's (mtime, size) `stamp` hasn't changed.
+    """
+    entry = _parsed_configs.get(path)
+    if entry is not None and entry[0] == stamp and entry[1] == format:
+        return entry[2]
+    with open(path, "rb") as f:
+        config = _CONFIG_PARSERS[format](f)
+    _parsed_configs[path] = (stamp, format, config)
+    return config
+
+
+def _merge_config(base, layer):
+    """Merge the dict `layer` into `base`, recursing into dicts. Dicts from
+    `layer` are copied, so cached parses are never modified.
+    """
+    for key, value in layer.items():
+        if isinstance(value, dict):
+            if not isinstance(base.get(key), dict):
+                base[key] = {}
+            _merge_config(base[key], value)
+        else:
+            base[key] = value
+
+
+#---- config watching
+
+class ConfigWatcher(object):
+    """Watches config dirs for changes, all on one background thread.
+
+        "debounce" (seconds, default 0.1) is how long a watched set of dirs
+            must be quiet before its callback gets the changes. Changes
+            seen in the meantime are coalesced into one call.
+        "min_interval" and "max_interval" (seconds) bound the polling
+            interval when inotify isn't used. The interval doubles after
+            every poll that found nothing, up to "max_interval", and drops
+            back to "min_interval" when something changed.
+        "use_inotify" is None to use inotify on Linux when it is available,
+            True to require it or False to always poll.
+
+    Only the files directly in a watched dir are watched, which is enough
+    for config dirs. Dirs that don't exist yet are picked up once they are
+    created. Callbacks are called on the watcher thread with a sorted list
+    of the changed paths (including the dir itself, if it appeared or
+    disappeared).
+
+    Use `shared()` to get one process-wide watcher that serves every app.
+    """
+    _shared = None
+    _shared_lock = _allocate_lock()
+
+    def __init__(self, debounce=0.1, min_interval=0.25, max_interval=5.0,
+            use_inotify=None):
+        import threading
+        self.debounce = debounce
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._lock = _allocate_lock()
+        self._dir_watches = {}      # dir -> set of _Watch
+        self._inotify = None
+        if use_inotify or (use_inotify is None
+                           and sys.platform.startswith("linux")):
+            try:
+                self._inotify = _Inotify()
+            except (OSError, AttributeError):
+                if use_inotify:
+                    raise
+        if self._inotify is not None:
+            self._wds = {}          # inotify watch descriptor -> dir
+            self._dir_wds = {}      # dir -> inotify watch descriptor
+            self._missing = set()   # watched dirs that don't exist yet
+            self._wake_r, self._wake_w = os.pipe()
+        else:
+            self._snapshots = {}    # dir -> _snapshot_dir() result
+            self._interval = min_interval
+            self._wake = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run,
+                                        name="ConfigWatcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @classmethod
+    def shared(cls):
+        """Return the process-wide watcher, starting it if needed."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    @property
+    def uses_inotify(self):
+        return self._inotify is not None
+
+    def watch(self, dirs, callback):
+        """Call `callback(paths)` when files in `dirs` change.
+
+        "dirs" is an `AppDirs`, whose `config_dirs` are watched, or a list
+        of dirs. Returns a handle for `unwatch`.
+        """
+        if isinstance(dirs, _AppDirsBase):
+            dirs = dirs.config_dirs
+        watch = _Watch(dirs, callback)
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError("watcher is closed")
+            for dir in watch.dirs:
+                if dir not in self._dir_watches:
+                    self._dir_watches[dir] = set()
+                    self._start_watching(dir)
+                self._dir_watches[dir].add(watch)
+        self._wakeup()
+        return watch
+
+    def unwatch(self, watch):
+        """Stop a watch started with `watch` or `events`."""
+        with self._lock:
+            for dir in watch.dirs:
+                watches = self._dir_watches.get(dir)
+                if watches is None:
+                    continue
+                watches.discard(watch)
+                if not watches:
+                    del self._dir_watches[dir]
+                    self._stop_watching(dir)
+
+    def events(self, dirs):
+        """Return an async iterator of lists of changed paths in `dirs`.
+
+        Must be called with an asyncio event loop running (or set). Call
+        `close()` on the iterator to stop watching.
+        """
+        return _AsyncWatchEvents(self, dirs)
+
+    def close(self):
+        """Stop the watcher thread and release its resources."""
+        import threading
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+        self._wakeup()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        if self._inotify is not None:
+            self._inotify.close()
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+
+    def _wakeup(self):
+        if self._inotify is not None:
+            try:
+                os.write(self._wake_w, b"x")
+            except OSError:
+                pass
+        else:
+            self._wake.set()
+
+    def _start_watching(self, dir):
+        if self._inotify is not None:
+            self._add_inotify_watch(dir)
+        else:
+            self._snapshots[dir] = _snapshot_dir(dir)
+
+    def _stop_watching(self, dir):
+        if self._inotify is not None:
+            self._missing.discard(dir)
+            wd = self._dir_wds.pop(dir, None)
+            if wd is not None:
+                del self._wds[wd]
+                self._inotify.remove(wd)
+        else:
+            del self._snapshots[dir]
+
+    def _add_inotify_watch(self, dir):
+        wd = self._inotify.add(dir)
+        if wd is None:
+            self._missing.add(dir)
+        else:
+            self._missing.discard(dir)
+            self._wds[wd] = dir
+            self._dir_wds[dir] = wd
+        return wd
+
+    def _record(self, dir, path, now):
+        for watch in self._dir_watches.get(dir, ()):
+            watch.pending.add(path)
+            watch.last_event = now
+
+    def _timeout(self, now):
+        # Seconds until the loop has to do something without being woken.
+        timeouts = [watch.last_event + self.debounce - now
+                    for watches in self._dir_watches.values()
+                    for watch in watches if watch.pending]
+        if self._inotify is None:
+            timeouts.append(self._interval)
+        elif self._missing:
+            timeouts.append(self.max_interval)
+        return max(0, min(timeouts)) if timeouts else None
+
+    def _run(self):
+        import logging
+        import select
+        while True:
+            with self._lock:
+                if self._stopped:
+                    return
+                timeout = self._timeout(_monotonic())
+            if self._inotify is not None:
+                readable = select.select([self._inotify.fd, self._wake_r],
+                                         [], [], timeout)[0]
+                if self._wake_r in readable:
+                    os.read(self._wake_r, 4096)
+                events = self._inotify.read()
+                with self._lock:
+                    self._handle_inotify(events)
+            else:
+                self._wake.wait(timeout)
+                self._wake.clear()
+                with self._lock:
+                    self._poll()
+            with self._lock:
+                due = self._due_callbacks(_monotonic())
+            for callback, paths in due:
+                try:
+                    callback(paths)
+                except Exception:
+                    logging.getLogger("appdirs").exception(
+                        "error in config watch callback %r", callback)
+
+    def _handle_inotify(self, events):
+        now = _monotonic()
+        for wd, mask, name in events:
+            dir = self._wds.get(wd)
+            if dir is None:
+                continue
+            if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF | _IN_IGNORED):
+                del self._wds[wd]
+                del self._dir_wds[dir]
+                self._missing.add(dir)
+                self._record(dir, dir, now)
+            elif name:
+                self._record(dir, os.path.join(dir, name), now)
+        for dir in list(self._missing):
+            if self._add_inotify_watch(dir) is not None:
+                self._record(dir, dir, now)
+
+    def _poll(self):
+        now = _monotonic()
+        changed = False
+        for dir, old in list(self._snapshots.items()):
+            new = _snapshot_dir(dir)
+            if new == old:
+                continue
+            changed = True
+            self._snapshots[dir] = new
+            if old is None or new is None:
+                self._record(dir, dir, now)
+                old = old or {}
+                new = new or {}
+            for name in set(old) | set(new):
+                if old.get(name) != new.get(name):
+                    self._record(dir, os.path.join(dir, name), now)
+        if changed:
+            self._interval = self.min_interval
+        else:
+            self._interval = min(self._interval * 2, self.max_interval)
+
+    def _due_callbacks(self, now):
+        due = []
+        seen = set()
+        for watches in self._dir_watches.values():
+            for watch in watches:
+                if (watch.pending and watch not in seen
+                        and now - watch.last_event >= self.debounce):
+                    seen.add(watch)
+                    due.append((watch.callback, sorted(watch.pending)))
+                    watch.pending = set()
+        return due
+
+
+class _Watch(object):
+    def __init__(self, dirs, callback):
+        self.dirs = list(dirs)
+        self.callback = callback
+        self.pending = set()
+        self.last_event = None
+
+
+class _AsyncWatchEvents(object):
+    """Async iterator over the changes seen by a `ConfigWatcher` watch."""
+    def __init__(self, watcher, dirs):
+        import asyncio
+        try:
+            self._loop = asyncio.get_running_loop()
+        except (AttributeError, RuntimeError):
+            self._loop = asyncio.get_event_loop()
+        self._queue = asyncio.Queue()
+        self._watcher = watcher
+        self._watch = watcher.watch(dirs, self._on_change)
+
+    def _on_change(self, paths):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, paths)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return self._queue.get()
+
+    def close(self):
+        self._watcher.unwatch(self._watch)
+
+
+def _snapshot_dir(dir):
+    """Return {name: (mtime, size)} for the entries of `dir`, or None if it
+    doesn't exist.
+    """
+    try:
+        names = os.listdir(dir)
+    except OSError:
+        return None
+    snapshot = {}
+    for name in names:
+        try:
+            st = os.stat(os.path.join(dir, name))
+        except OSError:
+            continue
+        snapshot[name] = (getattr(st, "st_mtime_ns", st.st_mtime),
+                          st.st_size)
+    return snapshot
+
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM
+                  | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF
+                  | _IN_MOVE_SELF | _IN_ONLYDIR)
+
+
+class _Inotify(object):
+    """Minimal ctypes binding for Linux inotify."""
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        import struct
+        self._event_header = struct.Struct("iIII")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                           use_errno=True)
+        self._libc = libc
+        self._get_errno = ctypes.get_errno
+        flags = os.O_NONBLOCK | getattr(os, "O_CLOEXEC", 0)
+        self.fd = libc.inotify_init1(flags)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add(self, dir):
+        """Watch `dir`. Return the watch descriptor, or None if `dir`
+        doesn't exist (or isn't a dir).
+        """
+        if not isinstance(dir, bytes):
+            dir = dir.encode(sys.getfilesystemencoding())
+        wd = self._libc.inotify_add_watch(self.fd, dir, _IN_WATCH_MASK)
+        if wd < 0:
+            err = self._get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return None
+            raise OSError(err, os.strerror(err))
+        return wd
+
+    def remove(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        """Return the pending events as (wd, mask, name) tuples."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as ex:
+                if ex.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return events
+                raise
+            pos = 0
+            header = self._event_header
+            while pos < len(data):
+                wd, mask, cookie, length = header.unpack_from(data, pos)
+                pos += header.size
+                name = data[pos:pos+length].rstrip(b"\0")
+                pos += length
+                if not isinstance(name, str):
+                    name = name.decode(sys.getfilesystemencoding(),
+                                       "surrogateescape")
+                events.append((wd, mask, name))
+
+    def close(self):
+        os.close(self.fd)
+
+
+#---- cache store
+
+class CacheStore(object):
+    """Size-bounded LRU cache of byte strings under `user_cache_dir`.
+
+        "dirs" is the `AppDirs` whose `user_cache_dir` holds the entries.
+        "subdir" is the dir below it that holds them. Other names give an
+            app several independent stores.
+        "max_bytes" and "max_entries" bound the total size and the number
+            of entries. When either is exceeded, the least recently used
+            entries are evicted. None means no limit.
+
+    An in-memory index of the entries is built from one listing of the
+    dir when the store is opened and is kept up to date afterwards, so
+    lookups and evictions never rescan the dir. Only files named like
+    entries (hex sha256 digests) are indexed, so nothing else in the dir
+    is ever evicted. Writes go to a temp file
+    that is renamed into place, so readers (in this or other processes)
+    never see a partial entry.
+
+    Recency is only tracked in memory: when a store is reopened, entries
+    are ordered by the time they were written.
+    """
+    def __init__(self, dirs, subdir="cache", max_bytes=None,
+                 max_entries=None):
+        import collections
+        root = dirs.user_cache_dir
+        if subdir:
+            root = os.path.join(root, subdir)
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = _allocate_lock()
+        # entry name -> size, least recently used first
+        self._index = collections.OrderedDict()
+        self._total_bytes = 0
+        _makedirs(root)
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.root):
+            # Skips in-flight temp files (".*") and anything not ours.
+            if len(name) != 64 or name.strip("0123456789abcdef"):
+                continue
+            try:
+                st = os.lstat(os.path.join(self.root, name))
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            entries.append((st.st_mtime, name, st.st_size))
+        entries.sort()
+        for mtime, name, size in entries:
+            self._index[name] = size
+            self._total_bytes += size
+
+    @staticmethod
+    def _entry_name(key):
+        import hashlib
+        if not isinstance(key, bytes):
+            key = key.encode("utf-8")
+        return hashlib.sha256(key).hexdigest()
+
+    def _touch(self, name, size):
+        # Mark `name` as most recently used.
+        old_size = self._index.pop(name, None)
+        if old_size is not None:
+            self._total_bytes -= old_size
+        self._index[name] = size
+        self._total_bytes += size
+
+    def _forget(self, name):
+        size = self._index.pop(name, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def get(self, key, default=None):
+        """Return the bytes cached for `key`, or `default`."""
+        name = self._entry_name(key)
+        try:
+            with open(os.path.join(self.root, name), "rb") as f:
+                value = f.read()
+        except (IOError, OSError):
+            with self._lock:
+                self._forget(name)
+                self.misses += 1
+            return default
+        with self._lock:
+            # The entry may have been written by another process.
+            self._touch(name, len(value))
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store the bytes `value` for `key`, evicting as needed.
+
+        A value larger than "max_bytes" is not stored at all.
+        """
+        import tempfile
+        if self.max_bytes is not None and len(value) > self.max_bytes:
+            self.delete(key)
+            return
+        name = self._entry_name(key)
+        fd, tmp_path = tempfile.mkstemp(prefix=".", dir=self.root)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            _replace(tmp_path, os.path.join(self.root, name))
+        except BaseException:
+            _remove(tmp_path)
+            raise
+        with self._lock:
+            self._touch(name, len(value))
+            evicted = self._evict()
+        for name in evicted:
+            _remove(os.path.join(self.root, name))
+
+    def _evict(self):
+        # Drop LRU entries from the index until within bounds and return
+        # their names. Called with the lock held.
+        evicted = []
+        while self._index and (
+                (self.max_entries is not None
+                 and len(self._index) > self.max_entries)
+                or (self.max_bytes is not None
+                    and self._total_bytes > self.max_bytes)):
+            name, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            evicted.append(name)
+        self.evictions += len(evicted)
+        return evicted
+
+    def delete(self, key):
+        """Remove the entry for `key`. Return True if there was one."""
+        name = self._entry_name(key)
+        with self._lock:
+            self._forget(name)
+        return _remove(os.path.join(self.root, name))
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            names = list(self._index)
+            self._index.clear()
+            self._total_bytes = 0
+        for name in names:
+            _remove(os.path.join(self.root, name))
+
+    def __contains__(self, key):
+        return self._entry_name(key) in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def stats(self):
+        """Return a dict of counters for tuning the cache bounds."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+            }
+
+
+#---- blob store
+
+class BlobStore(object):
+    """Content-addressable blob store under `user_cache_dir`.
+
+        "dirs" is the `AppDirs` whose `user_cache_dir` holds the store.
+        "subdir" is the dir below it to use, "blobs" by default.
+        "levels" is the number of fanout dirs between the root and a blob.
+
+    Blobs are named by the SHA-256 hex digest of their content and sharded
+    into 256-way fanout dirs by the leading digest chars, e.g.
+    "blobs/ab/cd/abcd...", so that no single dir gets huge. Storing the
+    same content twice keeps one copy.
+    """
+    def __init__(self, dirs, subdir="blobs", levels=2):
+        self.root = os.path.join(dirs.user_cache_dir, subdir)
+        self.levels = levels
+        _makedirs(self.root)
+
+    def path(self, digest):
+        """Return the path of the blob with the given digest."""
+        parts = [digest[2*i:2*i+2] for i in range(self.levels)]
+        return os.path.join(self.root, *(parts + [digest]))
+
+    def put(self, data):
+        """Store the bytes `data` and return their digest."""
+        import hashlib
+        digest = hashlib.sha256(data).hexdigest()
+        if not os.path.exists(self.path(digest)):
+            with self.open_writer() as writer:
+                writer.write(data)
+        return digest
+
+    def open_writer(self):
+        """Return a `BlobWriter` for streaming a blob into the store.
+
+        Use it as a context manager; the blob is committed (and its digest
+        set on the writer) when the block exits without an exception.
+        """
+        return BlobWriter(self)
+
+    def get(self, digest):
+        """Return the content of a blob as a read-only memoryview of a
+        memory map of the blob file (a `buffer` on Python 2), without
+        copying it.
+
+        Raises KeyError if there is no such blob.
+        """
+        import mmap
+        try:
+            f = open(self.path(digest), "rb")
+        except (IOError, OSError):
+            raise KeyError(digest)
+        with f:
+            if os.fstat(f.fileno()).st_size == 0:
+                data = b""
+            else:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if not PY3:
+            # Python 2 mmaps don't export memoryviews.
+            return buffer(data)
+        return memoryview(data)
+
+    def open(self, digest):
+        """Return a binary file object for streaming a blob's content.
+
+        Raises KeyError if there is no such blob.
+        """
+        try:
+            return open(self.path(digest), "rb")
+        except (IOError, OSError):
+            raise KeyError(digest)
+
+    def __contains__(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def delete(self, digest):
+        """Remove a blob. Return True if it existed."""
+        return _remove(self.path(digest))
+
+    def __iter__(self):
+        """Yield the digest of every blob in the store."""
+        dirs = [self.root]
+        for _ in range(self.levels):
+            dirs = [os.path.join(d, name) for d in dirs
+                    for name in sorted(os.listdir(d))
+                    if not name.startswith(".")]
+        for d in dirs:
+            for name in sorted(os.listdir(d)):
+                yield name
+
+
+class BlobWriter(object):
+    """Streams a blob into a `BlobStore`; see `BlobStore.open_writer`."""
+    def __init__(self, store):
+        import hashlib
+        import tempfile
+        self.store = store
+        self.digest = None
+        self.size = 0
+        self._hash = hashlib.sha256()
+        fd, self._tmp_path = tempfile.mkstemp(prefix=".", dir=store.root)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data):
+        self._hash.update(data)
+        self._file.write(data)
+        self.size += len(data)
+
+    def commit(self):
+        """Finish writing and move the blob into place. Return its digest."""
+        self._file.close()
+        digest = self._hash.hexdigest()
+        path = self.store.path(digest)
+        if os.path.exists(path):
+            _remove(self._tmp_path)
+        else:
+            _makedirs(os.path.dirname(path))
+            _replace(self._tmp_path, path)
+        self.digest = digest
+        return digest
+
+    def abort(self):
+        """Discard the partially written blob."""
+        self._file.close()
+        _remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+#---- compressed store
+
+_codecs = None   # see `_get_codecs`
+
+def _get_codecs():
+    """Return the available codecs as a dict: name -> (header id,
+    compressor factory taking a level, decompressor factory). The level is
+    only a compression setting, so it isn't stored.
+    """
+    global _codecs
+    if _codecs is None:
+        import zlib
+        codecs = {"zlib": (b"z", zlib.compressobj, zlib.decompressobj)}
+        try:
+            import bz2
+            codecs["bz2"] = (b"b", bz2.BZ2Compressor, bz2.BZ2Decompressor)
+        except ImportError:
+            pass
+        try:
+            import lzma
+            codecs["lzma"] = (b"x",
+                              lambda level: lzma.LZMACompressor(preset=level),
+                              lzma.LZMADecompressor)
+        except ImportError:     # Python 2
+            pass
+        _codecs = codecs
+    return _codecs
+
+def _codec_name(codec_id):
+    """Return the name of the codec with header id `codec_id`, or None."""
+    for name, codec in _get_codecs().items():
+        if codec[0] == codec_id:
+            return name
+    return None
+
+# Header of compressed entries: magic, format version, codec id (b"n" for
+# stored uncompressed).
+_COMPRESSED_MAGIC = b"ADZ"
+_COMPRESSED_HEADER_SIZE = 5
+
+# (codec, level) candidates for each `CompressedStore` "prefer" setting.
+_COMPRESSION_CANDIDATES = {
+    "speed": [("zlib", 1)],
+    "balanced": [("zlib", 6), ("bz2", 9), ("lzma", 1)],
+    "ratio": [("zlib", 9), ("bz2", 9), ("lzma", 6)],
+}
+
+_cpu_time = getattr(time, "thread_time", None) or getattr(
+    time, "process_time", None) or time.clock
+
+
+class CompressedStore(object):
+    """Store of transparently compressed files in an app dir.
+
+        "dirs" is the `AppDirs` whose "kind" dir (by default
+            `user_cache_dir`) holds the files.
+        "subdir" is an optional dir below it to use instead.
+        "prefer" is "speed", "balanced" or "ratio", the tradeoff between
+            CPU time and size to make when picking a codec.
+        "min_size" is the size below which files are stored uncompressed.
+        "sample_size" is how much of a file is compressed with each codec
+            to pick one.
+
+    Each file is compressed with the stdlib codec (zlib, bz2 or lzma) that
+    suits it best: the first "sample_size" bytes are compressed with each
+    candidate codec for "prefer", and the smallest result wins ("balanced"
+    only considers codecs taking at most 4 times the CPU time of the
+    fastest). Files that don't compress to less than 90% are stored as
+    they are. Small files are compressed in one go with the winner of the
+    sample, so they aren't compressed twice.
+
+    Files are written and read as streams, see `open`, so they needn't fit
+    in memory, and written to a temp file that is renamed into place.
+    Files without the header, e.g. written before the store was used, are
+    read as they are. `stats` reports the compression ratio, the CPU time
+    spent and the codecs used.
+    """
+    def __init__(self, dirs, kind="user_cache_dir", subdir=None,
+                 prefer="balanced", min_size=512, sample_size=64 * 1024):
+        if prefer not in _COMPRESSION_CANDIDATES:
+            raise ValueError("unknown 'prefer' value: %r" % prefer)
+        root = getattr(dirs, kind)
+        if subdir:
+            root = os.path.join(root, subdir)
+        self.root = root
+        self.prefer = prefer
+        self.min_size = min_size
+        self.sample_size = sample_size
+        self._candidates = [(name, level) for name, level
+                            in _COMPRESSION_CANDIDATES[prefer]
+                            if name in _get_codecs()]
+        self._lock = _allocate_lock()
+        self._stats = {"files_written": 0, "bytes_in": 0, "bytes_out": 0,
+                       "compress_seconds": 0.0, "files_read": 0,
+                       "decompress_seconds": 0.0, "codecs": {}}
+        _makedirs(root)
+
+    def path(self, name):
+        """Return the path of the file `name`, a "/"-separated relative
+        path.
+        """
+        return os.path.join(self.root, *_split_relpath(name))
+
+    def open(self, name, mode="rb"):
+        """Open the file `name` for streaming reads ("rb") or writes
+        ("wb"). Written data becomes visible when the file is closed.
+        """
+        if mode == "wb":
+            path = self.path(name)
+            _makedirs(os.path.dirname(path))
+            return CompressedWriter(self, path)
+        if mode != "rb":
+            raise ValueError("mode must be 'rb' or 'wb': %r" % mode)
+        f = open(self.path(name), "rb")
+        try:
+            header = f.read(_COMPRESSED_HEADER_SIZE)
+            if (len(header) < _COMPRESSED_HEADER_SIZE
+                    or header[:3] != _COMPRESSED_MAGIC
+                    or header[3:4] != b"\x01"):
+                f.seek(0)
+                return f
+            codec_id = header[4:5]
+            if codec_id == b"n":
+                return f
+            codec = _codec_name(codec_id)
+            if codec is None:
+                raise ValueError("unsupported codec in %r" % name)
+        except BaseException:
+            f.close()
+            raise
+        decompressor = _get_codecs()[codec][2]()
+        return io.BufferedReader(_DecompressingReader(self, f, decompressor),
+                                 64 * 1024)
+
+    def put(self, name, data):
+        """Write the bytes `data` to the file `name`."""
+        with self.open(name, "wb") as f:
+            f.write(data)
+
+    def get(self, name, default=None):
+        """Return the content of the file `name`, or `default`."""
+        try:
+            f = self.open(name)
+        except (IOError, OSError):
+            return default
+        with f:
+            return f.read()
+
+    def delete(self, name):
+        """Remove the file `name`. Return True if it existed."""
+        return _remove(self.path(name))
+
+    def _choose_codec(self, sample):
+        # Return the (codec, level, compressed sample, CPU seconds) to use
+        # for data starting with `sample`; codec is None to not compress.
+        cpu_seconds = 0.0
+        if len(sample) < self.min_size:
+            return None, None, None, cpu_seconds
+        results = []
+        for name, level in self._candidates:
+            start = _cpu_time()
+            compressor = _get_codecs()[name][1](level)
+            compressed = compressor.compress(sample) + compressor.flush()
+            elapsed = _cpu_time() - start
+            cpu_seconds += elapsed
+            results.append((len(compressed), elapsed, name, level,
+                            compressed))
+        if self.prefer == "balanced":
+            limit = 4 * min(result[1] for result in results)
+            results = [result for result in results if result[1] <= limit] \
+                or results
+        size, elapsed, name, level, compressed = min(results)
+        if size >= 0.9 * len(sample):
+            return None, None, None, cpu_seconds
+        return name, level, compressed, cpu_seconds
+
+    def _record(self, key, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self._stats[name] += value
+            if key is not None:
+                codecs = self._stats["codecs"]
+                codecs[key] = codecs.get(key, 0) + 1
+
+    def stats(self):
+        """Return a dict with the number of files written, the "bytes_in"
+        written and "bytes_out" stored, their "ratio", the number of
+        compressed files read, the CPU seconds spent compressing and
+        decompressing, and the number of files written with each codec
+        ("none" for uncompressed).
+        """
+        with self._lock:
+            stats = dict(self._stats, codecs=dict(self._stats["codecs"]))
+        stats["ratio"] = (stats["bytes_out"] / float(stats["bytes_in"])
+                          if stats["bytes_in"] else 1.0)
+        return stats
+
+
+class CompressedWriter(object):
+    """A file being written to a `CompressedStore`, from
+    `CompressedStore.open(name, "wb")`.
+
+    The codec is picked once "sample_size" bytes were written, or on
+    `close` for smaller files. Closing makes the file visible; as a context
+    manager, an exception discards it instead.
+    """
+    def __init__(self, store, path):
+        import tempfile
+        self.store = store
+        self.path = path
+        self.codec = None
+        fd, self._tmp_path = tempfile.mkstemp(prefix=".",
+                                              dir=os.path.dirname(path))
+        self._f = os.fdopen(fd, "wb")
+        self._pending = []      # data written before the codec is picked
+        self._pending_size = 0
+        self._compressor = None
+        self._bytes_in = 0
+        self._cpu_seconds = 0.0
+        self.closed = False
+
+    def write(self, data):
+        if self._pending is not None:
+            self._pending.append(bytes(data))
+            self._pending_size += len(data)
+            if self._pending_size >= self.store.sample_size:
+                self._start(complete=False)
+        else:
+            self._write(data)
+        return len(data)
+
+    def _start(self, complete):
+        # Pick the codec from the pending data and write the header.
+        data = b"".join(self._pending)
+        self._pending = None
+        sample_size = self.store.sample_size
+        codec, level, compressed, cpu_seconds = self.store._choose_codec(
+            data[:sample_size])
+        self._cpu_seconds += cpu_seconds
+        self.codec = codec or "none"
+        self._f.write(_COMPRESSED_MAGIC + b"\x01" + (
+            _get_codecs()[codec][0] if codec else b"n"))
+        if codec is not None and complete and len(data) <= sample_size:
+            # The sample is all there is, and it's compressed already.
+            self._f.write(compressed)
+            self._bytes_in += len(data)
+            return
+        if codec is not None:
+            self._compressor = _get_codecs()[codec][1](level)
+        self._write(data)
+
+    def _write(self, data):
+        self._bytes_in += len(data)
+        if self._compressor is None:
+            self._f.write(data)
+            return
+        start = _cpu_time()
+        data = self._compressor.compress(data)
+        self._cpu_seconds += _cpu_time() - start
+        self._f.write(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self._pending is not None:
+                self._start(complete=True)
+            if self._compressor is not None:
+                start = _cpu_time()
+                data = self._compressor.flush()
+                self._cpu_seconds += _cpu_time() - start
+                self._f.write(data)
+            bytes_out = self._f.tell()
+            self._f.close()
+            _replace(self._tmp_path, self.path)
+        except BaseException:
+            self.abort()
+            raise
+        self.store._record(self.codec, files_written=1,
+                           bytes_in=self._bytes_in, bytes_out=bytes_out,
+                           compress_seconds=self._cpu_seconds)
+
+    def abort(self):
+        """Discard the file."""
+        self.closed = True
+        self._f.close()
+        _remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class _DecompressingReader(io.RawIOBase):
+    # The most output to make from one decompress() call, so that a short
+    # read of a highly compressed file takes little memory.
+    chunk_size = 64 * 1024
+
+    def __init__(self, store, f, decompressor):
+        self._store = store
+        self._f = f
+        self._decompressor = decompressor
+        self._buf = b""
+        self._pos = 0
+        self._eof = False
+        self._cpu_seconds = 0.0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._pos == len(self._buf) and not self._eof:
+            start = _cpu_time()
+            self._buf = self._decompress()
+            self._cpu_seconds += _cpu_time() - start
+            self._pos = 0
+        n = min(len(b), len(self._buf) - self._pos)
+        b[:n] = self._buf[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def _decompress(self):
+        # Return the next output, of at most `chunk_size` bytes: input the
+        # limit stops at is kept by bz2 and lzma decompressors, and handed
+        # back in `unconsumed_tail` by zlib ones. Python 2's bz2 can't
+        # limit its output. A stream that ends early raises EOFError, like
+        # `gzip` does; Python 2's decompressors can't tell.
+        decompressor = self._decompressor
+        size = self.chunk_size
+        if hasattr(decompressor, "needs_input"):
+            if decompressor.eof:
+                self._eof = True
+                return b""
+            data = b""
+            if decompressor.needs_input:
+                data = self._f.read(size)
+                if not data:
+                    raise EOFError("compressed file %r ended before the "
+                                   "end-of-stream marker" % self._f.name)
+            return decompressor.decompress(data, size)
+        if hasattr(decompressor, "unconsumed_tail"):
+            data = decompressor.unconsumed_tail or self._f.read(size)
+            if data:
+                return decompressor.decompress(data, size)
+        else:
+            data = self._f.read(size)
+            if data:
+                return decompressor.decompress(data)
+        self._eof = True
+        flush = getattr(decompressor, "flush", None)
+        data = flush() if flush is not None else b""
+        if not getattr(decompressor, "eof", True):
+            raise EOFError("compressed file %r ended before the "
+                           "end-of-stream marker" % self._f.name)
+        return data
+
+    def close(self):
+        if not self.closed:
+            self._f.close()
+            self._store._record(None, files_read=1,
+                                decompress_seconds=self._cpu_seconds)
+        io.RawIOBase.close(self)
+
+
+#---- state store
+
+class StateStore(object):
+    """Key-value store for small app state in `user_state_dir`, backed by
+    SQLite in WAL mode.
+
+        "dirs" is the `AppDirs` whose `user_state_dir` holds the database.
+        "name" is the name of the database file, without the ".sqlite3"
+            extension, so an app can have several independent stores.
+        "cache_size" is the number of values each thread keeps in its read
+            cache. 0 disables the cache.
+        "timeout" is how long, in seconds, a write waits for another
+            writer (in this or another process) to finish.
+
+    Keys are strings and values anything that JSON can encode. Values can
+    expire after "ttl" seconds. Each thread uses its own connection, which
+    is closed when the thread ends, so the store can be shared between
+    threads, and any number of processes can use the database at once.
+
+    Each write is its own transaction unless it is made in a `batch()`,
+    which commits all its writes at once and is much faster for many
+    small updates:
+
+        with store.batch():
+            for key, value in updates:
+                store.set(key, value)
+
+    Reads are served from a per-thread cache, which is dropped whenever
+    another connection (from another thread or process) commits, as
+    reported by SQLite's "PRAGMA data_version"; checking that is much
+    cheaper than a query.
+
+    WAL mode needs shared memory between the processes, so the state dir
+    mustn't be on a network filesystem.
+    """
+    def __init__(self, dirs, name="state", cache_size=1024, timeout=30.0):
+        import threading
+        import weakref
+        root = dirs.user_state_dir
+        _makedirs(root)
+        self.path = os.path.join(root, name + ".sqlite3")
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = _allocate_lock()
+        # The `_ThreadConnection` of each thread. Only the threads keep them
+        # alive, so a connection is closed when its thread ends.
+        self._connections = weakref.WeakSet()
+        self._epoch = 0     # bumped by `close` to invalidate connections
+        self._state().conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, "
+            "value TEXT NOT NULL, expires REAL)")
+
+    def _state(self):
+        # Return this thread's connection state, connecting if needed.
+        import collections
+        local = self._local
+        if (getattr(local, "epoch", None) != self._epoch
+                or local.pid != os.getpid()):
+            import sqlite3
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Durable across application crashes; in WAL mode only an OS
+            # crash can lose the last commits.
+            conn.execute("PRAGMA synchronous=NORMAL")
+            local.connection = _ThreadConnection(conn)
+            with self._lock:
+                self._connections.add(local.connection)
+            local.conn = conn
+            local.pid = os.getpid()
+            local.epoch = self._epoch
+            local.cache = collections.OrderedDict()
+            local.data_version = None
+            local.batch_depth = 0
+            local.pending = {}
+        return local
+
+    def _cached_row(self, local, key):
+        # Return the (value, expires) row for `key` from the cache, or None.
+        version = local.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != local.data_version:
+            local.cache.clear()
+            local.data_version = version
+            return None
+        return local.cache.get(key)
+
+    def _cache_row(self, local, key, row):
+        if local.batch_depth:
+            local.pending[key] = row
+            return
+        if not self.cache_size:
+            return
+        cache = local.cache
+        cache[key] = row
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def _get_row(self, local, key):
+        # Return the (raw value, expires) row for `key`; (None, None) if
+        # missing or expired.
+        row = None
+        if not local.batch_depth and self.cache_size:
+            row = self._cached_row(local, key)
+        if row is None:
+            row = local.conn.execute(
+                "SELECT value, expires FROM kv WHERE key = ?",
+                (key,)).fetchone() or (None, None)
+            if not local.batch_depth:
+                self._cache_row(local, key, row)
+        if row[1] is not None and row[1] <= time.time():
+            return (None, None)
+        return row
+
+    def get(self, key, default=None):
+        """Return the value for `key`, or `default` if it is missing or
+        has expired.
+        """
+        import json
+        raw = self._get_row(self._state(), key)[0]
+        if raw is None:
+            return default
+        return json.loads(raw)
+
+    def __contains__(self, key):
+        return self._get_row(self._state(), key)[0] is not None
+
+    def set(self, key, value, ttl=None):
+        """Set `key` to `value`, expiring it after "ttl" seconds if given."""
+        self.set_many([(key, value)], ttl)
+
+    def set_many(self, items, ttl=None):
+        """Set each (key, value) pair in `items` (or a dict) in one
+        transaction.
+        """
+        import json
+        if isinstance(items, dict):
+            items = items.items()
+        expires = None if ttl is None else time.time() + ttl
+        rows = [(key, json.dumps(value, separators=(",", ":")), expires)
+                for key, value in items]
+        self._write(rows)
+
+    def _write(self, rows):
+        local = self._state()
+        if len(rows) > 1 and not local.batch_depth:
+            # Outside a batch each row would be its own transaction.
+            with self.batch():
+                return self._write(rows)
+        local.conn.executemany(
+            "INSERT OR REPLACE INTO kv (key, value, expires) "
+            "VALUES (?, ?, ?)", rows)
+        for key, raw, expires in rows:
+            self._cache_row(local, key, (raw, expires))
+
+    def incr(self, key, delta=1, ttl=None):
+        """Atomically add `delta` to the number stored for `key` (0 if
+        missing) and return the new value.
+
+        The expiry of the key is kept unless "ttl" is given.
+        """
+        import json
+        with self.batch():
+            local = self._state()
+            raw, expires = self._get_row(local, key)
+            value = (0 if raw is None else json.loads(raw)) + delta
+            if ttl is not None or raw is None:
+                expires = None if ttl is None else time.time() + ttl
+            self._write([(key, json.dumps(value), expires)])
+        return value
+
+    def delete(self, key):
+        """Remove `key`. Return True if it was there."""
+        local = self._state()
+        cursor = local.conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+        self._cache_row(local, key, (None, None))
+        return cursor.rowcount > 0
+
+    def keys(self):
+        """Return the sorted list of keys that haven't expired."""
+        return [row[0] for row in self._state().conn.execute(
+            "SELECT key FROM kv WHERE expires IS NULL OR expires > ? "
+            "ORDER BY key", (time.time(),))]
+
+    def __len__(self):
+        return self._state().conn.execute(
+            "SELECT COUNT(*) FROM kv WHERE expires IS NULL OR expires > ?",
+            (time.time(),)).fetchone()[0]
+
+    def purge_expired(self):
+        """Delete the expired keys from the database. Return how many."""
+        return self._state().conn.execute(
+            "DELETE FROM kv WHERE expires <= ?", (time.time(),)).rowcount
+
+    def batch(self):
+        """Return a context manager that makes the writes of this thread
+        inside it one transaction. It commits on exit, or rolls back if
+        an exception is raised. Nested batches are part of the outermost
+        one.
+
+        The batch takes SQLite's write lock when it starts, so reads in it
+        see the latest data and read-modify-write sequences are atomic.
+        """
+        return _StateStoreBatch(self)
+
+    def _begin(self):
+        local = self._state()
+        if not local.batch_depth:
+            local.conn.execute("BEGIN IMMEDIATE")
+        local.batch_depth += 1
+
+    def _end(self, commit):
+        local = self._state()
+        local.batch_depth -= 1
+        if local.batch_depth:
+            return
+        pending, local.pending = local.pending, {}
+        if not commit:
+            local.conn.execute("ROLLBACK")
+            return
+        local.conn.execute("COMMIT")
+        for key, row in pending.items():
+            self._cache_row(local, key, row)
+
+    def close(self):
+        """Close the connections of all threads. The store reconnects if
+        it is used again.
+        """
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+            self._epoch += 1
+        for connection in connections:
+            connection.conn.close()
+
+
+class _ThreadConnection(object):
+    # A thread's `StateStore` connection, which (unlike the connection
+    # itself) the store can reference weakly.
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn):
+        self.conn = conn
+
+
+class _StateStoreBatch(object):
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        self.store._begin()
+        return self.store
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.store._end(exc_type is None)
+
+
+#---- transactional writes
+
+class TransactionalWriter(object):
+    """Group-commit writes of many files into an app dir.
+
+        "dirs" is the `AppDirs` to write into.
+        "kind" is the kind of dir to write into, e.g. "user_state_dir".
+        "subdir" is an optional dir below it to use instead.
+        "max_workers" is the size of the thread pool that syncs files and
+            dirs to disk. Python 2 lacks `concurrent.futures`, so there
+            they are synced one at a time.
+
+    A transaction stages any number of file writes and deletes, and
+    committing it makes them all happen, durably, or, after a crash, none
+    of them:
+
+        writer = TransactionalWriter(dirs)
+        with writer.transaction() as txn:
+            for name, data in items:
+                txn.write(name, data)
+
+    Replacing files safely one by one costs a write, an fsync, a rename and
+    an fsync of the dir for each. A commit instead syncs all the staged
+    files in parallel, which lets the filesystem group them into few
+    journal commits, then durably writes a journal of the renames (the
+    commit point), does them and syncs each affected dir once.
+
+    Commits interrupted after the commit point are finished by the next
+    commit or the next `TransactionalWriter` for the dir, see `recover`.
+    Commits from threads and processes are serialized with `lock`, which
+    readers can hold shared to not see a commit half done.
+
+    Transactions are staged in the ".txn" dir below the root, so that the
+    renames stay on one filesystem.
+    """
+    def __init__(self, dirs, kind="user_data_dir", subdir=None,
+                 max_workers=8):
+        root = getattr(dirs, kind)
+        if subdir:
+            root = os.path.join(root, subdir)
+        self.root = root
+        self.max_workers = max_workers
+        self._txn_dir = os.path.join(root, ".txn")
+        _makedirs(self._txn_dir)
+        self.lock = AppDirLock(os.path.join(self._txn_dir, "lock"))
+        self.recover()
+
+    def transaction(self):
+        """Return a new `WriteTransaction`."""
+        return WriteTransaction(self)
+
+    def recover(self):
+        """Finish the commits that were interrupted after their commit
+        point, and remove what transactions of processes that are gone
+        staged. Return the number of commits finished.
+        """
+        import shutil
+        with self.lock.exclusive():
+            finished = self._replay_journals()
+            for name in os.listdir(self._txn_dir):
+                if name.endswith(".staging"):
+                    pid = name.split("-", 1)[0]
+                    if pid.isdigit() and not _pid_alive(int(pid)):
+                        shutil.rmtree(os.path.join(self._txn_dir, name),
+                                      ignore_errors=True)
+                elif name.endswith(".journal.tmp"):
+                    _remove(os.path.join(self._txn_dir, name))
+        return finished
+
+    def _replay_journals(self):
+        # Finish the commits whose journals are left over. Called with the
+        # lock held.
+        import json
+        replayed = 0
+        for name in sorted(os.listdir(self._txn_dir)):
+            if name.endswith(".journal"):
+                with open(os.path.join(self._txn_dir, name), "rb") as f:
+                    entries = json.loads(f.read().decode("utf-8"))
+                self._apply(name[:-len(".journal")], entries)
+                replayed += 1
+        return replayed
+
+    def _commit(self, txid, entries):
+        # Called by `WriteTransaction.commit` with the staged files synced.
+        import json
+        with self.lock.exclusive():
+            self._replay_journals()
+            journal = os.path.join(self._txn_dir, txid + ".journal")
+            with open(journal + ".tmp", "wb") as f:
+                f.write(json.dumps(entries).encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            _replace(journal + ".tmp", journal)
+            _fsync_dir(self._txn_dir)
+            self._apply(txid, entries)
+
+    def _apply(self, txid, entries):
+        # Do the renames and deletes in `entries`, sync them, then drop the
+        # journal and the staged files. Renames whose staged file is gone
+        # were done before a crash, so replaying is safe.
+        import shutil
+        staging = os.path.join(self._txn_dir, txid + ".staging")
+        dirs = set()
+        for relpath, staged in entries:
+            target = os.path.join(self.root, *relpath.split("/"))
+            parent = os.path.dirname(target)
+            if staged is None:
+                if not os.path.isdir(parent):
+                    continue    # nothing to delete, or to sync
+                _remove(target)
+            else:
+                src = os.path.join(staging, staged)
+                if not os.path.exists(src):
+                    continue
+                dirs.update(_makedirs_tracked(parent))
+                _replace(src, target)
+            dirs.add(parent)
+        self._sync([(path, True) for path in dirs])
+        _remove(os.path.join(self._txn_dir, txid + ".journal"))
+        _fsync_dir(self._txn_dir)
+        shutil.rmtree(staging, ignore_errors=True)
+
+    def _sync(self, items):
+        # fsync each (path, is_dir) in `items`, in parallel where
+        # `_map_unordered` can.
+        if len(items) < 2:
+            for item in items:
+                _fsync_path(item)
+            return
+        for item, result in _map_unordered(
+                _fsync_path, items, min(self.max_workers, len(items))):
+            pass
+
+
+class WriteTransaction(object):
+    """File writes and deletes to commit together, from
+    `TransactionalWriter.transaction()`.
+
+    As a context manager it commits on exit, or aborts if an exception was
+    raised. Paths are relative to the writer's root, with "/" separators.
+    Writing a path again replaces the staged data.
+    """
+    def __init__(self, writer):
+        import binascii
+        import collections
+        self.writer = writer
+        self.txid = "%d-%s" % (os.getpid(),
+                               binascii.hexlify(os.urandom(8)).decode("ascii"))
+        self._staging = os.path.join(writer._txn_dir, self.txid + ".staging")
+        self._entries = collections.OrderedDict()   # relpath -> staged name
+        self._count = 0
+        self._done = False
+
+    def _key(self, relpath):
+        if self._done:
+            raise RuntimeError("transaction is already done")
+        parts = _split_relpath(relpath)
+        if parts[0] == ".txn":
+            raise ValueError("can't write to the staging dir: %r" % relpath)
+        return "/".join(parts)
+
+    def write(self, relpath, data):
+        """Stage writing the bytes `data` to `relpath`."""
+        key = self._key(relpath)
+        if not self._count:
+            _makedirs(self._staging)
+        self._count += 1
+        name = str(self._count)
+        with open(os.path.join(self._staging, name), "wb") as f:
+            f.write(data)
+        self._entries[key] = name
+
+    def delete(self, relpath):
+        """Stage deleting `relpath`, if it exists."""
+        self._entries[self._key(relpath)] = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def commit(self):
+        """Make all the staged changes, durably."""
+        if self._done:
+            raise RuntimeError("transaction is already done")
+        self._done = True
+        if not self._entries:
+            return
+        staged = [(os.path.join(self._staging, name), False)
+                  for name in self._entries.values() if name is not None]
+        if staged:
+            staged.append((self._staging, True))
+        self.writer._sync(staged)
+        self.writer._commit(self.txid, list(self._entries.items()))
+
+    def abort(self):
+        """Drop all the staged changes."""
+        import shutil
+        self._done = True
+        self._entries.clear()
+        shutil.rmtree(self._staging, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+def _makedirs_tracked(path):
+    """Create `path` and its missing parents. Return the parents of the
+    dirs created, which need to be synced.
+    """
+    created = []
+    while not os.path.isdir(path):
+        created.append(path)
+        path = os.path.dirname(path)
+    for dir in reversed(created):
+        try:
+            os.mkdir(dir)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+    return [os.path.dirname(dir) for dir in created]
+
+
+def _fsync_path(item):
+    path, is_dir = item
+    if is_dir:
+        _fsync_dir(path)
+        return
+    fd = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_dir(path):
+    """Make the entries of the dir `path` durable (a no-op on Windows,
+    which can't open dirs and doesn't need it).
+    """
+    if sys.platform == "win32":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _pid_alive(pid):
+    if sys.platform == "win32":
+        # os.kill would terminate it; assume it's alive.
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as ex:
+        return ex.errno == errno.EPERM
+    return True
+
+
+#---- asyncio support
+
+class AsyncAppDirs(object):
+    """asyncio companion to `AppDirs` for doing file I/O in app dirs.
+
+    The path properties are the same as those of `AppDirs` (the wrapped
+    instance is `self.dirs`). The other methods take the name of a dir
+    kind, e.g. "user_cache_dir", and a path relative to that dir, do their
+    blocking work on a thread pool and return an awaitable:
+
+        adirs = AsyncAppDirs("SuperApp", "Acme")
+        await adirs.write_text("user_state_dir", "cursor", "42")
+
+    All instances share one bounded thread pool by default, so thousands of
+    concurrent coroutines don't mean thousands of threads. Use
+    `AsyncAppDirs.set_max_workers` to size it, or pass your own
+    `concurrent.futures.Executor` as "executor".
+    """
+    max_workers = 8
+    _shared_executor = None
+    _shared_executor_lock = _allocate_lock()
+
+    def __init__(self, appname=None, appauthor=None, version=None,
+            roaming=False, multipath=False, executor=None):
+        self.dirs = AppDirs(appname, appauthor, version, roaming=roaming,
+                            multipath=multipath)
+        self.executor = executor
+
+    def __getattr__(self, name):
+        if name in _DIR_KINDS:
+            return getattr(self.dirs, name)
+        raise AttributeError(name)
+
+    @classmethod
+    def set_max_workers(cls, max_workers):
+        """Resize the shared thread pool. Work already submitted still
+        finishes on the old pool.
+        """
+        with cls._shared_executor_lock:
+            cls.max_workers = max_workers
+            old, cls._shared_executor = cls._shared_executor, None
+        if old is not None:
+            old.shutdown(wait=False)
+
+    @classmethod
+    def _get_shared_executor(cls):
+        with cls._shared_executor_lock:
+            if cls._shared_executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                cls._shared_executor = ThreadPoolExecutor(cls.max_workers)
+            return cls._shared_executor
+
+    def _run(self, func, *args):
+        import asyncio
+        try:
+            loop = asyncio.get_running_loop()
+        except (AttributeError, RuntimeError):
+            loop = asyncio.get_event_loop()
+        executor = self.executor or self._get_shared_executor()
+        return loop.run_in_executor(executor, func, *args)
+
+    def _path(self, kind, relpath=None):
+        if kind not in _DIR_KINDS:
+            raise ValueError("unknown dir kind: %r" % kind)
+        path = getattr(self.dirs, kind)
+        if relpath:
+            path = os.path.join(path, *_split_relpath(relpath))
+        return path
+
+    def makedirs(self, kind, relpath=None):
+        """Create the dir (or "relpath" below it). Resolves to its path."""
+        path = self._path(kind, relpath)
+        mode = 0o700 if kind.startswith("user_") else 0o755
+        return self._run(_makedirs_returning, path, mode)
+
+    def read_bytes(self, kind, relpath):
+        return self._run(_read_file, self._path(kind, relpath), "rb")
+
+    def read_text(self, kind, relpath, encoding="utf-8"):
+        return self._run(_read_file, self._path(kind, relpath), "r",
+                         encoding)
+
+    def write_bytes(self, kind, relpath, data):
+        """Atomically replace the file with `data`, creating dirs as
+        needed.
+        """
+        return self._run(_write_file_atomic, self._path(kind, relpath),
+                         data)
+
+    def write_text(self, kind, relpath, text, encoding="utf-8"):
+        return self.write_bytes(kind, relpath, text.encode(encoding))
+
+    def exists(self, kind, relpath=None):
+        return self._run(os.path.exists, self._path(kind, relpath))
+
+    def listdir(self, kind, relpath=None):
+        """Resolves to the sorted names in the dir, or [] if it's missing."""
+        return self._run(_listdir_or_empty, self._path(kind, relpath))
+
+    def remove(self, kind, relpath):
+        """Remove a file. Resolves to False if it didn't exist."""
+        return self._run(_remove, self._path(kind, relpath))
+
+    def rmtree(self, kind, relpath=None):
+        """Remove the dir (or "relpath" below it) and everything in it."""
+        import shutil
+        return self._run(shutil.rmtree, self._path(kind, relpath), True)
+
+
+def _makedirs_returning(path, mode):
+    _makedirs(path, mode)
+    return path
+
+
+def _read_file(path, mode, encoding=None):
+    if encoding is None:
+        f = open(path, mode)
+    else:
+        f = io.open(path, mode, encoding=encoding)
+    with f:
+        return f.read()
+
+
+def _write_file_atomic(path, data):
+    import tempfile
+    dir = os.path.dirname(path)
+    _makedirs(dir)
+    fd, tmp_path = tempfile.mkstemp(prefix=".", dir=dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        _replace(tmp_path, path)
+    except BaseException:
+        _remove(tmp_path)
+        raise
+
+
+def _listdir_or_empty(path):
+    try:
+        return sorted(os.listdir(path))
+    except OSError as ex:
+        if ex.errno != errno.ENOENT:
+            raise
+        return []
+
+
+#---- logging support
+
+class _UserLogHandlerBase(object):
+    """Logging handler that writes to a file in `user_log_dir` without
+    blocking the logging thread.
+
+        "dirs" is the `AppDirs` whose `user_log_dir` holds the log files.
+        "filename" is the name of the log file, "<appname>.log" by default.
+        "max_bytes" (default 10 MiB) rotates the file before it would grow
+            past this size. 0 disables size-based rotation.
+        "rotate_interval" rotates the file after this many seconds. None
+            (the default) disables time-based rotation.
+        "backup_count" (default 5) is the number of rotated files to keep.
+        "compress" (default True) gzips rotated files in the background.
+        "queue_size" (default 10000) bounds the records waiting to be
+            written. Records emitted while the queue is full are dropped
+            and counted, rather than blocking the caller.
+        "batch_size" (default 512) is the most records written at once.
+        "flush_interval" (default 1.0) is the most seconds a written record
+            may sit in the file buffer before being flushed.
+
+    `emit` only formats the record and queues it. A background thread
+    writes the queued records in batches, flushes, rotates, and hands
+    rotated files to a second thread for compression. Rotated files are
+    named "<filename>.<YYYYmmdd-HHMMSS>[.gz]". See `metrics` for counters.
+    A batch that can't be written is reported with `handleError` and
+    counted as dropped, and the file is reopened for the next one.
+    """
+    def __init__(self, dirs, filename=None, max_bytes=10*1024*1024,
+            rotate_interval=None, backup_count=5, compress=True,
+            queue_size=10000, batch_size=512, flush_interval=1.0):
+        import logging
+        import threading
+        logging.Handler.__init__(self)
+        if filename is None:
+            filename = (dirs.appname or "app") + ".log"
+        log_dir = dirs.user_log_dir
+        _ensure_dirs(log_dir, 0o700)
+        self.baseFilename = os.path.join(log_dir, filename)
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.compress = compress
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = self._queue_module.Queue(queue_size)
+        self._io_lock = _allocate_lock()
+        self._counters_lock = _allocate_lock()
+        self._counters = dict.fromkeys((
+            "records_emitted", "records_written", "records_dropped",
+            "bytes_written", "batches", "rotations", "compressed"), 0)
+        self._started = _monotonic()
+        self._stream = None
+        self._open()
+        self._compress_queue = self._queue_module.Queue()
+        self._writer = threading.Thread(target=self._write_loop,
+                                        name="UserLogHandler-writer")
+        self._writer.daemon = True
+        self._writer.start()
+        self._compressor = threading.Thread(target=self._compress_loop,
+                                            name="UserLogHandler-compress")
+        self._compressor.daemon = True
+        self._compressor.start()
+
+    def _count(self, **increments):
+        with self._counters_lock:
+            for name, n in increments.items():
+                self._counters[name] += n
+
+    def emit(self, record):
+        try:
+            line = self.format(record) + "\n"
+        except Exception:
+            self.handleError(record)
+            return
+        try:
+            self._queue.put_nowait(line)
+        except self._queue_module.Full:
+            self._count(records_dropped=1)
+        else:
+            self._count(records_emitted=1)
+
+    def _open(self):
+        self._stream = io.open(self.baseFilename, "ab")
+        self._size = self._stream.tell()
+        self._opened_at = time.time()
+
+    def _write_loop(self):
+        pending_flush = False
+        while True:
+            try:
+                line = self._queue.get(
+                    timeout=self.flush_interval if pending_flush else None)
+            except self._queue_module.Empty:
+                self._flush_stream()
+                pending_flush = False
+                continue
+            batch = [line]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except self._queue_module.Empty:
+                    break
+            stop = None in batch
+            if stop:
+                batch = batch[:batch.index(None)]
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception:
+                    self._write_failed(len(batch))
+                else:
+                    pending_flush = True
+            for _ in range(len(batch) + stop):
+                self._queue.task_done()
+            if stop:
+                self._flush_stream()
+                return
+
+    def _flush_stream(self):
+        try:
+            with self._io_lock:
+                if self._stream is not None:
+                    self._stream.flush()
+        except Exception:
+            self._write_failed(0)
+
+    def _write_failed(self, nrecords):
+        # Report the error through `handleError`, as `emit` would, count
+        # the records as dropped and reopen the file (which may have been
+        # removed), so that the writer keeps going.
+        import logging
+        self.handleError(logging.makeLogRecord({
+            "msg": "can't write to %s", "args": (self.baseFilename,)}))
+        self._count(records_dropped=nrecords)
+        with self._io_lock:
+            try:
+                if self._stream is not None:
+                    self._stream.close()
+            except Exception:
+                pass
+            self._stream = None
+            try:
+                _makedirs(os.path.dirname(self.baseFilename), 0o700)
+                self._open()
+            except (IOError, OSError):
+                pass    # tried again with the next batch
+
+    def _write_batch(self, lines):
+        data = "".join(lines).encode("utf-8")
+        with self._io_lock:
+            if self._stream is None:
+                self._open()
+            if self._should_rotate(len(data)):
+                self._rotate()
+            self._stream.write(data)
+            self._size += len(data)
+        self._count(records_written=len(lines), bytes_written=len(data),
+                    batches=1)
+
+    def _should_rotate(self, nbytes):
+        if self._size == 0:
+            return False
+        if self.max_bytes and self._size + nbytes > self.max_bytes:
+            return True
+        if (self.rotate_interval is not None
+                and time.time() - self._opened_at >= self.rotate_interval):
+            return True
+        return False
+
+    def _rotate(self):
+        self._stream.close()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime())
+        rotated = "%s.%s" % (self.baseFilename, stamp)
+        n = 1
+        while (os.path.exists(rotated) or os.path.exists(rotated + ".gz")):
+            rotated = "%s.%s-%d" % (self.baseFilename, stamp, n)
+            n += 1
+        try:
+            os.rename(self.baseFilename, rotated)
+        except OSError as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            # Removed meanwhile, e.g. by `collect_garbage`.
+            self._open()
+            return
+        self._open()
+        self._count(rotations=1)
+        if self.compress:
+            self._compress_queue.put(rotated)
+        else:
+            self._prune()
+
+    def _compress_loop(self):
+        while True:
+            path = self._compress_queue.get()
+            try:
+                if path is None:
+                    return
+                try:
+                    _gzip_file(path)
+                except (IOError, OSError):
+                    pass    # leave the rotated file uncompressed
+                else:
+                    self._count(compressed=1)
+                self._prune()
+            finally:
+                self._compress_queue.task_done()
+
+    def _prune(self):
+        """Remove all but the newest "backup_count" rotated files."""
+        dir, base = os.path.split(self.baseFilename)
+        prefix = base + "."
+        rotated = sorted((name for name in os.listdir(dir)
+                          if name.startswith(prefix)),
+                         key=lambda name: name[:-3] if name.endswith(".gz")
+                                          else name)
+        for name in rotated[:max(0, len(rotated) - self.backup_count)]:
+            _remove(os.path.join(dir, name))
+
+    def metrics(self):
+        """Return a dict of counters: records emitted, written and dropped,
+        bytes written, batches, rotations and compressed files, plus the
+        current queue depth and the write throughput since creation.
+        """
+        with self._counters_lock:
+            metrics = dict(self._counters)
+        elapsed = _monotonic() - self._started
+        metrics["queue_depth"] = self._queue.qsize()
+        metrics["records_per_second"] = (
+            metrics["records_written"] / elapsed if elapsed > 0 else 0.0)
+        metrics["bytes_per_second"] = (
+            metrics["bytes_written"] / elapsed if elapsed > 0 else 0.0)
+        return metrics
+
+    def flush(self):
+        """Wait until every queued record is written, then flush the file."""
+        if self._writer.is_alive():
+            self._queue.join()
+        with self._io_lock:
+            if self._stream is not None and not self._stream.closed:
+                self._stream.flush()
+
+    def close(self):
+        """Write all queued records, finish compressing rotated files and
+        stop the background threads.
+        """
+        import logging
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        if self._compressor.is_alive():
+            self._compress_queue.put(None)
+            self._compressor.join()
+        with self._io_lock:
+            if self._stream is not None:
+                self._stream.close()
+        logging.Handler.close(self)
+
+
+def _gzip_file(path):
+    """Compress `path` to "<path>.gz" and remove `path`."""
+    import gzip
+    import shutil
+    import tempfile
+    dir, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=".", dir=dir)
+    try:
+        with open(path, "rb") as src:
+            with os.fdopen(fd, "wb") as raw:
+                with gzip.GzipFile(name, "wb", fileobj=raw) as dst:
+                    shutil.copyfileobj(src, dst, 1024*1024)
+        _replace(tmp_path, path + ".gz")
+    except BaseException:
+        _remove(tmp_path)
+        raise
+    _remove(path)
+
+
+def _make_user_log_handler():
+    import logging
+    try:
+        import queue
+    except ImportError:     # Python 2
+        import Queue as queue
+
+    class UserLogHandler(_UserLogHandlerBase, logging.Handler):
+        __doc__ = _UserLogHandlerBase.__doc__
+        __qualname__ = "UserLogHandler"
+        _queue_module = queue
+
+    return UserLogHandler
+
+
+#---- internal support stuff
+
+# Environment variables that the resolvers above may consult on each
+# platform, directly or through `os.path.expanduser` and the environ
+# fallback for Windows folders.
+_WIN_ENV_VARS = ("APPDATA", "LOCALAPPDATA", "ALLUSERSPROFILE", "USERPROFILE",
+                 "HOMEDRIVE", "HOMEPATH")
+_MAC_ENV_VARS = ("HOME",)
+_XDG_ENV_VARS = ("HOME", "XDG_DATA_HOME", "XDG_DATA_DIRS", "XDG_CONFIG_HOME",
+                 "XDG_CONFIG_DIRS", "XDG_CACHE_HOME", "XDG_STATE_HOME",
+                 "XDG_RUNTIME_DIR")
+_ENV_VARS = _XDG_ENV_VARS + _WIN_ENV_VARS
+
+def _env_var_names(system):
+    if system == "win32":
+        return _WIN_ENV_VARS
+    elif system == "darwin":
+        return _MAC_ENV_VARS
+    return _XDG_ENV_VARS
+
+_env_getter_cache = {}
+
+def _env_getter(environ, system):
+    """Return a (get, keys) pair for cheaply reading the env vars relevant
+    on `system`.
+
+    `os.environ.get` re-encodes the key and decodes the value on every call,
+    which costs more than the resolution being cached, so go to the
+    underlying mapping where one is available.
+    """
+    cache_key = (id(environ), system)
+    entry = _env_getter_cache.get(cache_key)
+    if entry is not None and entry[0] is environ:
+        return entry[1]
+    names = _env_var_names(system)
+    data = getattr(environ, "_data", None)     # Python 3 os._Environ
+    encodekey = getattr(environ, "encodekey", None)
+    if isinstance(data, dict) and encodekey is not None:
+        getter = (data.get, tuple([encodekey(name) for name in names]))
+    elif isinstance(getattr(environ, "data", None), dict):   # Python 2
+        getter = (environ.data.get, names)
+    else:
+        getter = (environ.get, names)
+    _env_getter_cache[cache_key] = (environ, getter)
+    return getter
+
+def _env_snapshot():
+    """Return a hashable snapshot of every input that affects resolution."""
+    get, keys = _env_getter(os.environ, system)
+    return (system,) + tuple(map(get, keys))
+
+
+def _map_unordered(func, items, max_workers):
+    """Yield `(item, func(item))` for each of `items` as they finish, on a
+    pool of "max_workers" threads. Python 2 lacks `concurrent.futures`, so
+    there they run one at a time, in order.
+    """
+    try:
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+    except ImportError:     # Python 2
+        for item in items:
+            yield item, func(item)
+        return
+    with ThreadPoolExecutor(max_workers) as executor:
+        futures = dict((executor.submit(func, item), item) for item in items)
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+def _makedirs(path, mode=0o777):
+    """Like `os.makedirs(path, mode, exist_ok=True)`, which Python 2 lacks."""
+    try:
+        os.makedirs(path, mode)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+_monotonic = getattr(time, "monotonic", time.time)
+_perf_counter = getattr(time, "perf_counter", time.time)
+
+if hasattr(os, "replace"):
+    _replace = os.replace
+elif sys.platform == "win32":
+    def _replace(src, dst):
+        # Not atomic, but the best Python 2 can do on Windows.
+        _remove(dst)
+        os.rename(src, dst)
+else:
+    _replace = os.rename
+
+# Dirs that `_ensure_dirs` created or found to exist in this process.
+_ensured_dirs = set()
+
+def _ensure_dirs(path, mode, multipath=False):
+    """Create the dir `path` (or each dir in it if "multipath" is true)
+    unless this was already done in this process.
+    """
+    if path in _ensured_dirs:
+        return
+    for dir in (_split_multipath(path) if multipath else [path]):
+        if dir not in _ensured_dirs:
+            _makedirs(dir, mode)
+            _ensured_dirs.add(dir)
+    _ensured_dirs.add(path)
+
+def _default_runtime_base():
+    """The Unix runtime dir to use when $XDG_RUNTIME_DIR isn't set."""
+    uid = os.getuid()
+    path = "/run/user/%d" % uid
+    if os.path.isdir(path):
+        return path
+    return _private_temp_dir("runtime-%d" % uid)
+
+# name -> the temp dir `_private_temp_dir` made instead
+_private_temp_dirs = {}
+
+def _private_temp_dir(name):
+    """Return "<tempdir>/`name`", created with mode 0700 if needed.
+
+    Anyone can create that name first, so it is only used if it is a dir
+    (not a symlink) of this user that no one else can access, as the XDG
+    spec requires of runtime dirs. Otherwise a new private dir from
+    `tempfile.mkdtemp` is used for the rest of the process.
+    """
+    import tempfile
+    path = os.path.join(tempfile.gettempdir(), name)
+    try:
+        os.mkdir(path, 0o700)
+    except OSError:
+        pass    # it exists, or can't be made: checked below
+    try:
+        st = os.lstat(path)
+    except OSError:
+        st = None
+    if (st is not None and stat.S_ISDIR(st.st_mode)
+            and st.st_uid == os.getuid() and not st.st_mode & 0o077):
+        return path
+    try:
+        return _private_temp_dirs[name]
+    except KeyError:
+        return _private_temp_dirs.setdefault(
+            name, tempfile.mkdtemp(prefix=name + "-"))
+
+def _remove(path):
+    """Remove the file `path`. Return False if it didn't exist."""
+    try:
+        os.remove(path)
+    except OSError as ex:
+        if ex.errno != errno.ENOENT:
+            raise
+        return False
+    return True
+
+def _get_win_folder_from_registry(csidl_name):
+    """This is a fallback technique at best. I'm not sure if using the
+    registry for this guarantees us the correct answer for all CSIDL_*
+    names.
+    """
+    if PY3:
+      import winreg as _winreg
+    else:
+      import _winreg
+
+    shell_folder_name = {
+        "CSIDL_APPDATA": "AppData",
+        "CSIDL_COMMON_APPDATA": "Common AppData",
+        "CSIDL_LOCAL_APPDATA": "Local AppData",
+    }[csidl_name]
+
+    key = _winreg.OpenKey(
+        _winreg.HKEY_CURRENT_USER,
+        r"Software\Microsoft\Windows\CurrentVersion\Explorer\Shell Folders"
+    )
+    dir, type = _winreg.QueryValueEx(key, shell_folder_name)
+    return dir
+
+
+# Size of the buffers passed to SHGetFolderPathW and GetShortPathNameW.
+# SHGetFolderPathW is documented to never return more than MAX_PATH chars.
+_MAX_PATH = 260
+
+def _has_high_char(path):
+    """Return True if `path` has a char that doesn't fit in Latin-1."""
+    try:
+        path.encode("latin-1")
+    except UnicodeError:
+        return True
+    return False
+
+def _get_win_folder_with_ctypes(csidl_name):
+    import ctypes
+
+    csidl_const = {
+        "CSIDL_APPDATA": 26,
+        "CSIDL_COMMON_APPDATA": 35,
+        "CSIDL_LOCAL_APPDATA": 28,
+    }[csidl_name]
+
+    buf = ctypes.create_unicode_buffer(_MAX_PATH)
+    ctypes.windll.shell32.SHGetFolderPathW(None, csidl_const, None, 0, buf)
+    dir = buf.value
+
+    # Downgrade to short path name if have highbit chars. See
+    # <http://bugs.activestate.com/show_bug.cgi?id=85099>.
+    if _has_high_char(dir):
+        if ctypes.windll.kernel32.GetShortPathNameW(dir, buf, _MAX_PATH):
+            dir = buf.value
+
+    return dir
+
+def _get_win_folder_with_jna(csidl_name):
+    import array
+    from com.sun import jna
+    from com.sun.jna.platform import win32
+
+    buf_size = win32.WinDef.MAX_PATH * 2
+    buf = array.zeros('c', buf_size)
+    shell = win32.Shell32.INSTANCE
+    shell.SHGetFolderPath(None, getattr(win32.ShlObj, csidl_name), None, win32.ShlObj.SHGFP_TYPE_CURRENT, buf)
+    dir = jna.Native.toString(buf.tostring()).rstrip("\0")
+
+    # Downgrade to short path name if have highbit chars. See
+    # <http://bugs.activestate.com/show_bug.cgi?id=85099>.
+    if _has_high_char(dir):
+        buf = array.zeros('c', buf_size)
+        kernel = win32.Kernel32.INSTANCE
+        if kernel.GetShortPathName(dir, buf, buf_size):
+            dir = jna.Native.toString(buf.tostring()).rstrip("\0")
+
+    return dir
+
+# The environment variables holding the Windows shell folders.
+_WIN_FOLDER_ENV_VARS = {
+    "CSIDL_APPDATA": "APPDATA",
+    "CSIDL_COMMON_APPDATA": "ALLUSERSPROFILE",
+    "CSIDL_LOCAL_APPDATA": "LOCALAPPDATA",
+}
+
+def _get_win_folder_from_environ(csidl_name):
+    return os.environ[_WIN_FOLDER_ENV_VARS[csidl_name]]
+
+def _probe_ctypes():
+    from ctypes import windll
+
+def _probe_jna():
+    import com.sun.jna
+
+def _probe_winreg():
+    if PY3:
+      import winreg as _winreg
+    else:
+      import _winreg
+
+# Backends for `_get_win_folder` in order of preference, as
+# (probe, get_folder, memoize) tuples. The first backend whose probe doesn't
+# raise ImportError is used. The environ fallback isn't memoized because
+# `AppDirs` expects to see changes to those environment variables.
+_win_folder_backends = [
+    (_probe_ctypes, _get_win_folder_with_ctypes, True),
+    (_probe_jna, _get_win_folder_with_jna, True),
+    (_probe_winreg, _get_win_folder_from_registry, True),
+    (None, _get_win_folder_from_environ, False),
+]
+_win_folder_backend = None
+_win_folder_cache = {}
+_win_folder_lock = _allocate_lock()
+
+def _select_win_folder_backend():
+    for probe, get_folder, memoize in _win_folder_backends:
+        if probe is not None:
+            try:
+                probe()
+            except ImportError:
+                continue
+        return get_folder, memoize
+    raise RuntimeError("no usable backend for Windows folder lookup")
+
+def _get_win_folder(csidl_name):
+    """Return the path of the Windows shell folder `csidl_name`.
+
+    The backend is picked on first use rather than at import time, and each
+    folder is looked up at most once per process.
+    """
+    global _win_folder_backend
+    try:
+        return _win_folder_cache[csidl_name]
+    except KeyError:
+        pass
+    with _win_folder_lock:
+        if _win_folder_backend is None:
+            _win_folder_backend = _select_win_folder_backend()
+        get_folder, memoize = _win_folder_backend
+        if not memoize:
+            return get_folder(csidl_name)
+        if csidl_name not in _win_folder_cache:
+            _win_folder_cache[csidl_name] = get_folder(csidl_name)
+        return _win_folder_cache[csidl_name]
+
+def _reset_win_folder():
+    """Forget the selected backend and all looked up folders."""
+    global _win_folder_backend
+    with _win_folder_lock:
+        _win_folder_backend = None
+        _win_folder_cache.clear()
+
+
+#---- instrumentation
+
+# Functions that `enable_instrumentation` wraps.
+_INSTRUMENTED = _DIR_KINDS + ("_get_win_folder",)
+
+_instrumentation = None     # _Instrumentation while enabled
+_instrumentation_lock = _allocate_lock()
+
+
+class _Instrumentation(object):
+    max_samples = 1024      # latency samples kept per function
+
+    def __init__(self):
+        self.originals = {}
+        self.hooks = []
+        self.lock = _allocate_lock()
+        self.stats = {}     # function name -> _FunctionStats
+
+    def record(self, event):
+        import logging
+        with self.lock:
+            stats = self.stats.get(event["function"])
+            if stats is None:
+                stats = self.stats[event["function"]] = _FunctionStats()
+            stats.add(event, self.max_samples)
+            hooks = list(self.hooks)
+        for hook in hooks:
+            try:
+                hook(event)
+            except Exception:
+                logging.getLogger("appdirs").exception(
+                    "error in instrumentation hook %r", hook)
+
+
+class _FunctionStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.samples = []
+        self.last_inputs = None
+
+    def add(self, event, max_samples):
+        if len(self.samples) < max_samples:
+            self.samples.append(event["seconds"])
+        else:
+            self.samples[self.calls % max_samples] = event["seconds"]
+        self.calls += 1
+        self.total += event["seconds"]
+        self.last_inputs = event["inputs"]
+
+    def summary(self):
+        samples = sorted(self.samples)
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+        return {
+            "calls": self.calls,
+            "total_seconds": self.total,
+            "p50_seconds": percentile(0.50),
+            "p90_seconds": percentile(0.90),
+            "p99_seconds": percentile(0.99),
+            "max_seconds": samples[-1],
+            "inputs": self.last_inputs,
+        }
+
+
+def _resolution_inputs(name, args, kwargs):
+    if name == "_get_win_folder":
+        backend = _win_folder_backend and _win_folder_backend[0].__name__
+        return {"system": system, "csidl_name": args[0] if args else
+                kwargs.get("csidl_name"), "backend": backend}
+    environ = os.environ
+    return {"system": system,
+            "env": dict((var, environ[var]) for var in _env_var_names(system)
+                        if var in environ)}
+
+
+def _instrumented(name, func, instrumentation):
+    import functools
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = _perf_counter()
+        result = func(*args, **kwargs)
+        seconds = _perf_counter() - start
+        instrumentation.record({
+            "function": name,
+            "args": args,
+            "kwargs": kwargs,
+            "result": result,
+            "seconds": seconds,
+            "inputs": _resolution_inputs(name, args, kwargs),
+        })
+        return result
+    return wrapper
+
+
+def enable_instrumentation(hook=None):
+    """Start recording calls to the resolver functions and to the Windows
+    folder lookup.
+
+    While enabled, those module attributes are replaced by wrappers that
+    time each call and record the environment (or Windows folder backend)
+    used. When disabled, the original functions are back in place, so
+    there is no overhead at all. Setting the APPDIRS_INSTRUMENT
+    environment variable enables instrumentation on import.
+
+    Note that references taken earlier with `from appdirs import ...` are
+    not instrumented.
+
+    "hook" is an optional callable to pass to `add_instrumentation_hook`.
+    """
+    global _instrumentation
+    with _instrumentation_lock:
+        if _instrumentation is None:
+            instrumentation = _Instrumentation()
+            module = globals()
+            for name in _INSTRUMENTED:
+                func = module[name]
+                instrumentation.originals[name] = func
+                module[name] = _instrumented(name, func, instrumentation)
+            _instrumentation = instrumentation
+    if hook is not None:
+        add_instrumentation_hook(hook)
+
+
+def disable_instrumentation():
+    """Stop recording calls and drop the recorded stats and hooks."""
+    global _instrumentation
+    with _instrumentation_lock:
+        if _instrumentation is not None:
+            globals().update(_instrumentation.originals)
+            _instrumentation = None
+
+
+def add_instrumentation_hook(hook):
+    """Call `hook(event)` after every instrumented call.
+
+    "event" is a dict with the "function" name, its "args", "kwargs" and
+    "result", the call's duration in "seconds" and the "inputs" that drove
+    the result (see `get_instrumentation_stats`). Hooks run on the calling
+    thread, so they should be quick, e.g. forward to a metrics client.
+    """
+    instrumentation = _instrumentation
+    if instrumentation is None:
+        raise RuntimeError("instrumentation is not enabled")
+    with instrumentation.lock:
+        instrumentation.hooks.append(hook)
+
+
+def remove_instrumentation_hook(hook):
+    instrumentation = _instrumentation
+    if instrumentation is not None:
+        with instrumentation.lock:
+            if hook in instrumentation.hooks:
+                instrumentation.hooks.remove(hook)
+
+
+def get_instrumentation_stats():
+    """Return the stats recorded since instrumentation was enabled, as a
+    dict mapping function names to dicts with:
+
+        "calls": the number of calls
+        "total_seconds", "max_seconds": the cumulative and worst latency
+        "p50_seconds", "p90_seconds", "p99_seconds": latency percentiles
+            over the last 1024 calls
+        "inputs": what drove the last result: the "system" plus the
+            relevant environment variables that were set ("env") for the
+            resolvers, or the "csidl_name" and "backend" for
+            `_get_win_folder`
+
+    Returns an empty dict if instrumentation isn't enabled.
+    """
+    instrumentation = _instrumentation
+    if instrumentation is None:
+        return {}
+    with instrumentation.lock:
+        return dict((name, stats.summary())
+                    for name, stats in instrumentation.stats.items())
+
+
+if os.environ.get("APPDIRS_INSTRUMENT"):
+    enable_instrumentation()
+
+
+#---- command line interface
+
+def _main(argv=None):
+    """Print the dirs for an app as text, a JSON snapshot or shell exports.
+
+    Without an appname, print a demo of the dirs for "MyApp".
+    """
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(
+        prog="python -m appdirs",
+        description="Print the platform-specific dirs for an app.")
+    parser.add_argument("appname", nargs="?",
+                        help="the app name (omit for a demo)")
+    parser.add_argument("--appauthor",
+                        help="the app author (only used on Windows)")
+    parser.add_argument("--no-appauthor", dest="appauthor",
+                        action="store_false",
+                        help="don't use an app author dir on Windows")
+    parser.add_argument("--app-version", help="the app version")
+    parser.add_argument("--roaming", action="store_true",
+                        help="use the roaming appdata dirs on Windows")
+    parser.add_argument("--multipath", action="store_true",
+                        help="list all XDG site dirs")
+    parser.add_argument("-f", "--format", default="text",
+                        choices=("text", "json", "shell"),
+                        help="'json' gives a snapshot for "
+                             "AppDirs.from_snapshot(), 'shell' gives "
+                             "export lines (default: %(default)s)")
+    parser.add_argument("--prefix", default="APPDIRS_",
+                        help="prefix of the shell variable names "
+                             "(default: %(default)s)")
+    parser.add_argument("-o", "--output",
+                        help="write to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.appname is None:
+        _print_demo()
+        return 0
+
+    dirs = AppDirs(args.appname, args.appauthor, args.app_version,
+                   roaming=args.roaming, multipath=args.multipath)
+    if args.format == "json":
+        output = json.dumps(dirs.snapshot(), indent=2, sort_keys=True)
+    elif args.format == "shell":
+        try:
+            from shlex import quote
+        except ImportError:
+            from pipes import quote
+        output = "\n".join(
+            "export %s%s=%s" % (args.prefix, kind.upper(),
+                                quote(getattr(dirs, kind)))
+            for kind in _DIR_KINDS)
+    else:
+        output = "\n".join("%s: %s" % (kind, getattr(dirs, kind))
+                           for kind in _DIR_KINDS)
+    if args.output:
+        _write_file_atomic(args.output, (output + "\n").encode("utf-8"))
+    else:
+        print(output)
+    return 0
+
+
+#---- lazily created attributes
+
+# Public classes that need slow-to-import modules to be defined, and the
+# functions creating them on first use.
+_LAZY_ATTRIBUTES = {
+    "AppDirsRecord": _make_app_dirs_record,
+    "UserLogHandler": _make_user_log_handler,
+}
+_lazy_attributes_lock = _allocate_lock()
+
+def _lazy_attribute(name):
+    """Return the module attribute `name`, creating it if need be."""
+    module = globals()
+    try:
+        return module[name]
+    except KeyError:
+        pass
+    with _lazy_attributes_lock:
+        if name not in module:
+            module[name] = _LAZY_ATTRIBUTES[name]()
+        return module[name]
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name in _LAZY_ATTRIBUTES:
+            return _lazy_attribute(name)
+        raise AttributeError("module %r has no attribute %r"
+                             % (__name__, name))
+
+    def __dir__():
+        return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+else:
+    # No module __getattr__ (PEP 562), so create them up front.
+    for _name in _LAZY_ATTRIBUTES:
+        _lazy_attribute(_name)
+    del _name
+
+
+#---- self test code
+
+def _print_demo():
+    appname = "MyApp"
+    appauthor = "MyCompany"
+
+    props = _DIR_KINDS
+
+    print("-- app dirs %s --" % __version__)
+
+    print("-- app dirs (with optional 'version')")
+    dirs = AppDirs(appname, appauthor, version="1.0")
+    for prop in props:
+        print("%s: %s" % (prop, getattr(dirs, prop)))
+
+    print("\n-- app dirs (without optional 'version')")
+    dirs = AppDirs(appname, appauthor)
+    for prop in props:
+        print("%s: %s" % (prop, getattr(dirs, prop)))
+
+    print("\n-- app dirs (without optional 'appauthor')")
+    dirs = AppDirs(appname)
+    for prop in props:
+        print("%s: %s" % (prop, getattr(dirs, prop)))
+
+    print("\n-- app dirs (with disabled 'appauthor')")
+    dirs = AppDirs(appname, appauthor=False)
+    for prop in props:
+        print("%s: %s" % (prop, getattr(dirs, prop)))
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
@@ -0,0 +1,248 @@
+"""Micro-benchmarks for appdirs.
+
+Times every public resolver under simulated platforms, `AppDirs` property
+access, batch resolution and the cold-start cost of `import appdirs`, and
+measures the per-instance memory footprint of `AppDirs` and `FrozenAppDirs`.
+
+Run with::
+
+    python -m test.benchmark                       # print results
+    python -m test.benchmark -o baseline.json      # save results
+    python -m test.benchmark -c baseline.json      # compare to a baseline
+
+When comparing, the exit status is 1 if any benchmark got slower than the
+baseline by more than the threshold (10% by default).
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+import appdirs
+
+
+# Simulated platforms. The "win32" one uses a stub folder backend so it can
+# run anywhere.
+SYSTEMS = ("win32", "darwin", "linux2")
+
+# Resolver name -> the platform-specific keyword argument it takes, if any.
+RESOLVERS = (
+    ("user_data_dir", "roaming"),
+    ("user_config_dir", "roaming"),
+    ("user_state_dir", "roaming"),
+    ("user_cache_dir", "opinion"),
+    ("user_log_dir", "opinion"),
+    ("user_runtime_dir", None),
+    ("site_data_dir", "multipath"),
+    ("site_config_dir", "multipath"),
+)
+
+APPNAME = "MyApp"
+APPAUTHOR = "MyCompany"
+
+
+def _stub_win_folder(csidl_name):
+    return "C:\\Users\\me\\" + csidl_name
+
+
+class simulated_system(object):
+    """Context manager that makes appdirs resolve as if on `system`."""
+    def __init__(self, system):
+        self.system = system
+
+    def __enter__(self):
+        self._saved = (appdirs.system, appdirs._win_folder_backends)
+        appdirs.system = self.system
+        appdirs._win_folder_backends = [(None, _stub_win_folder, True)]
+        appdirs._reset_win_folder()
+
+    def __exit__(self, *exc_info):
+        appdirs.system, appdirs._win_folder_backends = self._saved
+        appdirs._reset_win_folder()
+
+
+def _time_per_call(func, number, repeat):
+    """Return the best per-call time of `func` in seconds."""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def _resolver_variants(name, option):
+    yield name, {}
+    yield name + "[version]", {"version": "1.0"}
+    if option is None:
+        return
+    yield name + "[%s]" % option, {option: option != "opinion"}
+    yield name + "[version,%s]" % option, {
+        "version": "1.0", option: option != "opinion"}
+
+
+def bench_resolvers(number, repeat):
+    results = {}
+    for system in SYSTEMS:
+        with simulated_system(system):
+            for name, option in RESOLVERS:
+                func = getattr(appdirs, name)
+                for label, kwargs in _resolver_variants(name, option):
+                    results["%s/%s" % (system, label)] = _time_per_call(
+                        lambda: func(APPNAME, APPAUTHOR, **kwargs),
+                        number, repeat)
+    return results
+
+
+def bench_appdirs_properties(number, repeat):
+    results = {}
+    for system in SYSTEMS:
+        with simulated_system(system):
+            for cls in (appdirs.AppDirs, appdirs.FrozenAppDirs):
+                dirs = cls(APPNAME, APPAUTHOR, version="1.0")
+                for name, _ in RESOLVERS:
+                    getter = lambda: getattr(dirs, name)
+                    results["%s/%s.%s" % (system, cls.__name__, name)] = \
+                        _time_per_call(getter, number, repeat)
+    return results
+
+
+def bench_batch(number, repeat):
+    results = {}
+    specs = [("Plugin%d" % i, APPAUTHOR, "1.0") for i in range(100)]
+    for system in SYSTEMS:
+        with simulated_system(system):
+            results["%s/resolve_app_dirs[100]" % system] = _time_per_call(
+                lambda: appdirs.resolve_app_dirs(specs),
+                max(1, number // 1000), repeat)
+    return results
+
+
+def bench_import(repeat):
+    """Return the cold-start cost of `import appdirs` in a fresh interpreter,
+    net of the interpreter's own startup time.
+    """
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def run(code):
+        return min(timeit.repeat(
+            lambda: subprocess.check_call([sys.executable, "-c", code],
+                                          cwd=cwd),
+            number=1, repeat=repeat))
+
+    return {"import appdirs": max(0.0, run("import appdirs") - run("pass"))}
+
+
+def _bytes_per_instance(factory, count):
+    import gc
+    import tracemalloc
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        instances = [factory(i) for i in range(count)]
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del instances
+    return (after - before) / float(count)
+
+
+def bench_memory(count=10000):
+    """Return the bytes allocated per instance, net of the arguments (which
+    are created up front), including the list slot holding it.
+    """
+    try:
+        import tracemalloc
+    except ImportError:     # Python 2
+        return {}
+    names = ["Plugin%d" % i for i in range(count)]
+    return {
+        "AppDirs": _bytes_per_instance(
+            lambda i: appdirs.AppDirs(names[i], APPAUTHOR, "1.0"), count),
+        "FrozenAppDirs": _bytes_per_instance(
+            lambda i: appdirs.FrozenAppDirs(names[i], APPAUTHOR, "1.0"),
+            count),
+        # Every call returns the same interned instance.
+        "FrozenAppDirs[same args]": _bytes_per_instance(
+            lambda i: appdirs.FrozenAppDirs(APPNAME, APPAUTHOR, "1.0"),
+            count),
+    }
+
+
+def run_benchmarks(number=20000, repeat=5):
+    results = {}
+    results.update(bench_resolvers(number, repeat))
+    results.update(bench_appdirs_properties(number, repeat))
+    results.update(bench_batch(number, repeat))
+    results.update(bench_import(repeat))
+    return {
+        "meta": {
+            "appdirs": appdirs.__version__,
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": sys.platform,
+            "number": number,
+            "repeat": repeat,
+        },
+        "results": results,
+        "memory": bench_memory(),
+    }
+
+
+def compare(current, baseline, threshold):
+    """Print a comparison and return the names of regressed benchmarks."""
+    regressions = []
+    old_results = baseline["results"]
+    for name in sorted(current["results"]):
+        new = current["results"][name]
+        old = old_results.get(name)
+        if not old:
+            print("%-50s %12.3fus  (new)" % (name, new * 1e6))
+            continue
+        ratio = new / old
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print("%-50s %12.3fus %8.2fx%s" % (name, new * 1e6, ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the appdirs resolvers.")
+    parser.add_argument("-n", "--number", type=int, default=20000,
+                        help="calls per timing run (default: %(default)s)")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="timing runs per benchmark, the best is kept "
+                             "(default: %(default)s)")
+    parser.add_argument("-o", "--output",
+                        help="write the results as JSON to this file")
+    parser.add_argument("-c", "--compare", metavar="BASELINE",
+                        help="compare against results saved with --output")
+    parser.add_argument("-t", "--threshold", type=float, default=0.10,
+                        help="allowed slowdown when comparing, as a fraction "
+                             "(default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    current = run_benchmarks(args.number, args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print("\n%d benchmark(s) regressed by more than %d%%"
+                  % (len(regressions), args.threshold * 100))
+            return 1
+    else:
+        for name, seconds in sorted(current["results"].items()):
+            print("%-50s %12.3fus" % (name, seconds * 1e6))
+    for name, size in sorted(current["memory"].items()):
+        print("%-50s %12.1f bytes/instance" % ("memory/" + name, size))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
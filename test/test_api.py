@@ -1,4 +1,11 @@
+import gzip
+import logging
+import os
+import shutil
 import sys
+import tempfile
+import threading
+import time
 import unittest
 import appdirs
 
@@ -24,6 +31,23 @@ class Test_AppDir(unittest.TestCase):
             appdirs.user_state_dir('MyApp', 'MyCompany'), STRING_TYPE)
         self.assertIsInstance(
             appdirs.user_log_dir('MyApp', 'MyCompany'), STRING_TYPE)
+        self.assertIsInstance(
+            appdirs.user_runtime_dir('MyApp', 'MyCompany'), STRING_TYPE)
+
+    @unittest.skipIf(sys.version_info < (3, 7), "needs module __getattr__")
+    def test_import_is_cheap(self):
+        # Modules beyond the ones loaded at startup are imported on use.
+        import subprocess
+        code = ("import sys; before = set(sys.modules); import appdirs; "
+                "print(' '.join(sorted(set(sys.modules) - before)))")
+        cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, "-c", code],
+                                         cwd=cwd).decode("ascii")
+        self.assertEqual(
+            set(output.split()) - set(["appdirs", "errno"]), set())
+        self.assertEqual(
+            appdirs.UserLogHandler.__name__, "UserLogHandler")
+        self.assertIn("AppDirsRecord", dir(appdirs))
 
     def test_dirs(self):
         dirs = appdirs.AppDirs('MyApp', 'MyCompany', version='1.0')
@@ -32,6 +56,1887 @@ class Test_AppDir(unittest.TestCase):
         self.assertIsInstance(dirs.user_cache_dir, STRING_TYPE)
         self.assertIsInstance(dirs.user_state_dir, STRING_TYPE)
         self.assertIsInstance(dirs.user_log_dir, STRING_TYPE)
+        self.assertIsInstance(dirs.user_runtime_dir, STRING_TYPE)
+
+
+class PlatformTestCase(unittest.TestCase):
+    """Base for tests that change the platform or environment: restores
+    `os.environ`, `appdirs.system` and the Windows folder backends after
+    each test, and fakes the Windows folders as "/CSIDL_*".
+    """
+    def setUp(self):
+        self._environ = os.environ.copy()
+        self._system = appdirs.system
+        self._backends = appdirs._win_folder_backends
+        appdirs._win_folder_backends = [
+            (None, lambda csidl_name: os.sep + csidl_name, True)]
+        appdirs._reset_win_folder()
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self._environ)
+        appdirs.system = self._system
+        appdirs._win_folder_backends = self._backends
+        appdirs._reset_win_folder()
+
+
+class Test_AppDirsCache(PlatformTestCase):
+    def setUp(self):
+        PlatformTestCase.setUp(self)
+        appdirs.system = "linux2"
+
+    def test_cached(self):
+        dirs = appdirs.AppDirs('MyApp', 'MyCompany', version='1.0')
+        self.assertEqual(dirs.user_data_dir,
+                         appdirs.user_data_dir('MyApp', 'MyCompany', '1.0'))
+        self.assertIs(dirs.user_data_dir, dirs.user_data_dir)
+
+    def test_env_change_invalidates(self):
+        os.environ['XDG_CACHE_HOME'] = '/tmp/one'
+        dirs = appdirs.AppDirs('MyApp')
+        self.assertEqual(dirs.user_cache_dir, os.path.join('/tmp/one', 'MyApp'))
+        os.environ['XDG_CACHE_HOME'] = '/tmp/two'
+        self.assertEqual(dirs.user_cache_dir, os.path.join('/tmp/two', 'MyApp'))
+
+    def test_attribute_change_invalidates(self):
+        dirs = appdirs.AppDirs('MyApp', version='1.0')
+        first = dirs.user_config_dir
+        dirs.version = '2.0'
+        self.assertNotEqual(dirs.user_config_dir, first)
+        self.assertTrue(dirs.user_config_dir.endswith('2.0'))
+
+    def test_refresh(self):
+        dirs = appdirs.AppDirs('MyApp')
+        dirs.user_data_dir
+        self.assertTrue(dirs._cache)
+        dirs.refresh()
+        self.assertFalse(dirs._cache)
+
+
+class Test_FrozenAppDirs(PlatformTestCase):
+    def test_interned(self):
+        dirs = appdirs.FrozenAppDirs("MyApp", "MyCompany", "1.0")
+        self.assertIs(dirs, appdirs.FrozenAppDirs("MyApp", "MyCompany", "1.0"))
+        self.assertIs(dirs, appdirs.AppDirs("MyApp", "MyCompany",
+                                            "1.0").frozen())
+        self.assertIsNot(dirs, appdirs.FrozenAppDirs("MyApp", "MyCompany"))
+        self.assertEqual(dirs.user_data_dir, appdirs.user_data_dir(
+            "MyApp", "MyCompany", "1.0"))
+
+    def test_hashable(self):
+        dirs = appdirs.FrozenAppDirs("MyApp", roaming=True)
+        other = appdirs.FrozenAppDirs("MyApp", roaming=1)
+        self.assertEqual(dirs, other)
+        self.assertEqual({dirs: 1}[other], 1)
+        self.assertNotEqual(dirs, appdirs.FrozenAppDirs("MyApp"))
+        import pickle
+        self.assertIs(pickle.loads(pickle.dumps(dirs)), dirs)
+
+    def test_immutable(self):
+        dirs = appdirs.FrozenAppDirs("MyApp")
+        self.assertRaises(AttributeError, setattr, dirs, "version", "2.0")
+        self.assertRaises(AttributeError, setattr, dirs, "other", 1)
+        self.assertRaises(AttributeError, delattr, dirs, "appname")
+        self.assertFalse(hasattr(dirs, "__dict__"))
+
+    def test_from_snapshot_unsupported(self):
+        dirs = appdirs.FrozenAppDirs("MyApp")
+        expected = dirs.user_data_dir
+        snapshot = appdirs.AppDirs("MyApp").snapshot()
+        snapshot["dirs"]["user_data_dir"] = "/elsewhere"
+        self.assertRaises(TypeError, appdirs.FrozenAppDirs.from_snapshot,
+                          snapshot)
+        self.assertIs(appdirs.FrozenAppDirs("MyApp"), dirs)
+        self.assertEqual(dirs.user_data_dir, expected)
+
+    def test_env_change_invalidates(self):
+        appdirs.system = "linux2"
+        dirs = appdirs.FrozenAppDirs("MyApp")
+        os.environ["XDG_CACHE_HOME"] = "/tmp/one"
+        self.assertEqual(dirs.user_cache_dir, "/tmp/one/MyApp")
+        os.environ["XDG_CACHE_HOME"] = "/tmp/two"
+        self.assertEqual(dirs.user_cache_dir, "/tmp/two/MyApp")
+
+
+class Test_WinFolder(PlatformTestCase):
+    def setUp(self):
+        PlatformTestCase.setUp(self)
+        self.probes = []
+        self.queries = []
+        appdirs.system = "win32"
+        appdirs._win_folder_backends = [
+            (self._failing_probe, self._fake_folder, True),
+            (self._probe, self._fake_folder, True),
+        ]
+        appdirs._reset_win_folder()
+
+    def _failing_probe(self):
+        self.probes.append("missing")
+        raise ImportError("no such backend")
+
+    def _probe(self):
+        self.probes.append("fake")
+
+    def _fake_folder(self, csidl_name):
+        self.queries.append(csidl_name)
+        return os.path.join(os.sep + "win", csidl_name)
+
+    def test_lazy_probe(self):
+        self.assertEqual(self.probes, [])
+        appdirs.user_data_dir('MyApp', 'MyCompany')
+        self.assertEqual(self.probes, ["missing", "fake"])
+
+    def test_probed_and_queried_once(self):
+        for _ in range(3):
+            path = appdirs.user_data_dir('MyApp', 'MyCompany')
+            appdirs.user_cache_dir('MyApp', 'MyCompany')
+            appdirs.site_data_dir('MyApp', 'MyCompany')
+            appdirs.user_data_dir('MyApp', 'MyCompany', roaming=True)
+        self.assertEqual(self.probes, ["missing", "fake"])
+        self.assertEqual(sorted(self.queries), [
+            "CSIDL_APPDATA", "CSIDL_COMMON_APPDATA", "CSIDL_LOCAL_APPDATA"])
+        self.assertEqual(path, os.path.join(
+            os.sep + "win", "CSIDL_LOCAL_APPDATA", "MyCompany", "MyApp"))
+
+    def test_has_high_char(self):
+        self.assertFalse(appdirs._has_high_char(u"C:\\Users\\J\xf6rg"))
+        self.assertTrue(appdirs._has_high_char(u"C:\\Users\\\u0416"))
+
+
+class Test_BatchResolution(PlatformTestCase):
+    def _expected(self, appname, appauthor, version, roaming, multipath,
+                  opinion):
+        return appdirs.AppDirsRecord(
+            appname, appauthor, version,
+            appdirs.user_data_dir(appname, appauthor, version, roaming),
+            appdirs.user_config_dir(appname, appauthor, version, roaming),
+            appdirs.user_cache_dir(appname, appauthor, version, opinion),
+            appdirs.user_state_dir(appname, appauthor, version, roaming),
+            appdirs.user_log_dir(appname, appauthor, version, opinion),
+            appdirs.user_runtime_dir(appname, appauthor, version),
+            appdirs.site_data_dir(appname, appauthor, version, multipath),
+            appdirs.site_config_dir(appname, appauthor, version, multipath))
+
+    def test_matches_individual_resolvers(self):
+        for system in ("win32", "darwin", "linux2"):
+            appdirs.system = system
+            appnames = ["MyApp"] if system == "darwin" else ["MyApp", None]
+            specs = [(appname, appauthor, version)
+                     for appname in appnames
+                     for appauthor in (None, "MyCompany", False)
+                     for version in (None, "1.0")]
+            for roaming in (False, True):
+                for multipath in (False, True):
+                    for opinion in (False, True):
+                        records = appdirs.resolve_app_dirs(
+                            specs, roaming, multipath, opinion)
+                        expected = [self._expected(*(spec + (
+                            roaming, multipath, opinion))) for spec in specs]
+                        self.assertEqual(records, expected)
+
+    def test_spec_forms(self):
+        appdirs.system = "linux2"
+        records = list(appdirs.iter_app_dirs([
+            "MyApp",
+            ("MyApp", "MyCompany"),
+            {"appname": "MyApp", "version": "1.0"},
+        ]))
+        self.assertEqual([r.version for r in records], [None, None, "1.0"])
+        self.assertEqual(records[1].appauthor, "MyCompany")
+        self.assertEqual(records[2].user_data_dir,
+                         appdirs.user_data_dir("MyApp", version="1.0"))
+        self.assertRaises(ValueError, appdirs.resolve_app_dirs,
+                          [("a", "b", "c", "d")])
+
+
+class Test_RuntimeDir(PlatformTestCase):
+    def test_platforms(self):
+        appdirs.system = "win32"
+        self.assertEqual(
+            appdirs.user_runtime_dir("MyApp", "MyCompany", "1.0"),
+            os.path.join(os.sep + "CSIDL_LOCAL_APPDATA", "Temp", "MyCompany",
+                         "MyApp", "1.0"))
+        appdirs.system = "darwin"
+        self.assertEqual(appdirs.user_runtime_dir("MyApp"), os.path.join(
+            os.path.expanduser("~/Library/Caches/TemporaryItems"), "MyApp"))
+        appdirs.system = "linux2"
+        os.environ["XDG_RUNTIME_DIR"] = "/run/user/4242"
+        self.assertEqual(appdirs.user_runtime_dir("MyApp", version="1.0"),
+                         os.path.join("/run/user/4242", "MyApp", "1.0"))
+
+    @unittest.skipIf(sys.platform == "win32", "no uids")
+    def test_fallback(self):
+        appdirs.system = "linux2"
+        os.environ.pop("XDG_RUNTIME_DIR", None)
+        path = appdirs.user_runtime_dir()
+        if path != "/run/user/%d" % os.getuid():
+            self.assertTrue(path.startswith(os.path.join(
+                tempfile.gettempdir(), "runtime-%d" % os.getuid())))
+            self.assertEqual(os.lstat(path).st_mode & 0o777, 0o700)
+
+    @unittest.skipIf(sys.platform == "win32", "no uids")
+    def test_private_temp_dir(self):
+        tempdir = tempfile.tempdir
+        tempfile.tempdir = root = tempfile.mkdtemp()
+        try:
+            path = appdirs._private_temp_dir("runtime-x")
+            self.assertEqual(path, os.path.join(root, "runtime-x"))
+            self.assertEqual(os.lstat(path).st_mode & 0o777, 0o700)
+            # Others could have made it first: not used unless private.
+            os.mkdir(os.path.join(root, "runtime-y"), 0o700)
+            os.chmod(os.path.join(root, "runtime-y"), 0o755)
+            os.symlink(path, os.path.join(root, "runtime-z"))
+            for name in ("runtime-y", "runtime-z"):
+                path = appdirs._private_temp_dir(name)
+                self.assertEqual(os.path.dirname(path), root)
+                self.assertTrue(path.startswith(
+                    os.path.join(root, name + "-")))
+                self.assertEqual(os.lstat(path).st_mode & 0o777, 0o700)
+                self.assertEqual(appdirs._private_temp_dir(name), path)
+        finally:
+            tempfile.tempdir = tempdir
+            appdirs._private_temp_dirs.clear()
+            shutil.rmtree(root)
+
+    @unittest.skipUnless(os.path.exists("/proc/mounts"), "needs /proc/mounts")
+    def test_filesystem_type(self):
+        mounts = appdirs._read_mounts()
+        self.assertEqual(appdirs.filesystem_type("/"), mounts["/"])
+        tmpfs = [path for path, fs_type in mounts.items()
+                 if fs_type == "tmpfs" and os.path.isdir(path)]
+        if tmpfs:
+            self.assertTrue(appdirs.is_memory_backed(
+                os.path.join(tmpfs[0], "no", "such", "dir")))
+
+    def test_unknown_filesystem(self):
+        mounts = appdirs._read_mounts
+        appdirs._read_mounts = lambda: {}
+        try:
+            self.assertIsNone(appdirs.filesystem_type("/"))
+            self.assertIsNone(appdirs.is_memory_backed("/"))
+        finally:
+            appdirs._read_mounts = mounts
+
+
+class Test_Resolver(PlatformTestCase):
+    WIN_FOLDERS = {
+        "CSIDL_APPDATA": "C:\\Users\\me\\AppData\\Roaming",
+        "CSIDL_LOCAL_APPDATA": "C:\\Users\\me\\AppData\\Local",
+        "CSIDL_COMMON_APPDATA": "C:\\ProgramData",
+    }
+
+    def test_win32(self):
+        resolver = appdirs.Resolver("win32", win_folders=self.WIN_FOLDERS)
+        self.assertEqual(
+            resolver.user_data_dir("MyApp", "MyCompany", "1.0"),
+            "C:\\Users\\me\\AppData\\Local\\MyCompany\\MyApp\\1.0")
+        self.assertEqual(
+            resolver.user_config_dir("MyApp", "MyCompany", roaming=True),
+            "C:\\Users\\me\\AppData\\Roaming\\MyCompany\\MyApp")
+        self.assertEqual(resolver.user_log_dir("MyApp", False),
+                         "C:\\Users\\me\\AppData\\Local\\MyApp\\Logs")
+        self.assertEqual(resolver.site_config_dir("MyApp", version="1.0"),
+                         "C:\\ProgramData\\MyApp\\MyApp\\1.0")
+        self.assertEqual(resolver.user_runtime_dir("MyApp"),
+                         "C:\\Users\\me\\AppData\\Local\\Temp\\MyApp\\MyApp")
+        # By default the folders come from "env".
+        resolver = appdirs.Resolver("win32", {"LOCALAPPDATA": "D:/Local/"})
+        self.assertEqual(resolver.user_cache_dir("MyApp", "MyCompany"),
+                         "D:\\Local\\MyCompany\\MyApp\\Cache")
+
+    def test_darwin(self):
+        resolver = appdirs.Resolver("darwin", home="/Users/me/")
+        self.assertEqual(resolver.user_data_dir("MyApp", version="1.0"),
+                         "/Users/me/Library/Application Support/MyApp/1.0")
+        self.assertEqual(resolver.user_log_dir("MyApp"),
+                         "/Users/me/Library/Logs/MyApp")
+        self.assertEqual(resolver.site_data_dir("MyApp"),
+                         "/Library/Application Support/MyApp")
+
+    def test_home_from_env(self):
+        os.environ["HOME"] = "/home/host"
+        resolver = appdirs.Resolver("linux", {"HOME": "/home/target"})
+        self.assertEqual(resolver.user_data_dir("MyApp"),
+                         "/home/target/.local/share/MyApp")
+        resolver = appdirs.Resolver("darwin", {"HOME": "/Users/target"})
+        self.assertEqual(resolver.user_log_dir("MyApp"),
+                         "/Users/target/Library/Logs/MyApp")
+        # "home" wins over the environment.
+        resolver = appdirs.Resolver("linux", {"HOME": "/home/target"},
+                                    home="/home/me")
+        self.assertEqual(resolver.user_cache_dir("MyApp"),
+                         "/home/me/.cache/MyApp")
+
+    def test_xdg(self):
+        resolver = appdirs.Resolver(
+            "linux2", {"XDG_CONFIG_HOME": "/cfg",
+                       "XDG_DATA_DIRS": "~/share/:/usr/share"},
+            home="/home/me", runtime_base="/run/user/1000")
+        self.assertEqual(resolver.user_data_dir("MyApp"),
+                         "/home/me/.local/share/MyApp")
+        self.assertEqual(resolver.user_config_dir("MyApp"), "/cfg/MyApp")
+        self.assertEqual(resolver.user_log_dir("MyApp", version="1.0"),
+                         "/home/me/.cache/MyApp/1.0/log")
+        self.assertEqual(resolver.user_runtime_dir("MyApp"),
+                         "/run/user/1000/MyApp")
+        self.assertEqual(
+            resolver.site_data_dir("MyApp", version="1.0", multipath=True),
+            "/home/me/share/MyApp/1.0:/usr/share/MyApp/1.0")
+        self.assertEqual(resolver.site_config_dir("MyApp"),
+                         "/etc/xdg/MyApp")
+
+    def test_runtime_dir_default(self):
+        # Doesn't depend on the host, e.g. on Windows, which lacks getuid.
+        getuid = getattr(os, "getuid", None)
+        if getuid is not None:
+            del os.getuid
+        try:
+            resolver = appdirs.Resolver("linux", {"XDG_DATA_HOME": "/srv"},
+                                        home="/home/me")
+            self.assertRaises(ValueError, resolver.user_runtime_dir)
+            record = appdirs.resolve_app_dirs(["MyApp"], resolver=resolver)[0]
+            self.assertEqual(record.user_data_dir, "/srv/MyApp")
+            self.assertIsNone(record.user_runtime_dir)
+            resolver = appdirs.Resolver("linux", uid=1000)
+            self.assertEqual(resolver.user_runtime_dir("MyApp", version="1"),
+                             "/run/user/1000/MyApp/1")
+            record = appdirs.resolve_app_dirs([("MyApp", None, "1")],
+                                              resolver=resolver)[0]
+            self.assertEqual(record.user_runtime_dir, "/run/user/1000/MyApp/1")
+            resolver = appdirs.Resolver("linux", {"UID": "501"})
+            self.assertEqual(resolver.user_runtime_dir(), "/run/user/501")
+        finally:
+            if getuid is not None:
+                os.getuid = getuid
+
+    def test_matches_functions(self):
+        os.environ["XDG_RUNTIME_DIR"] = "/run/user/4242"
+        os.environ["XDG_DATA_DIRS"] = "/a:/b"
+        for system in ("win32", "darwin", "linux2"):
+            appdirs.system = system
+            resolver = appdirs.Resolver(
+                system, os.environ,
+                win_folders=lambda csidl_name: os.sep + csidl_name,
+                pathmod=os.path)
+            for kind in appdirs._DIR_KINDS:
+                for args in [(), ("MyApp",), ("MyApp", "MyCompany", "1.0"),
+                             ("MyApp", False, "1.0")]:
+                    if kind == "user_log_dir" and system == "darwin" \
+                            and not args:
+                        continue    # needs an appname on Mac
+                    self.assertEqual(getattr(resolver, kind)(*args),
+                                     getattr(appdirs, kind)(*args),
+                                     (system, kind, args))
+            records = appdirs.resolve_app_dirs(
+                [("MyApp", "MyCompany", "1.0")], multipath=True,
+                resolver=resolver)
+            self.assertEqual(records, appdirs.resolve_app_dirs(
+                [("MyApp", "MyCompany", "1.0")], multipath=True))
+
+    def test_batch(self):
+        resolver = appdirs.Resolver("win32", win_folders=self.WIN_FOLDERS)
+        record = appdirs.resolve_app_dirs(["MyApp"], resolver=resolver)[0]
+        for kind in appdirs._DIR_KINDS:
+            self.assertEqual(getattr(record, kind),
+                             getattr(resolver, kind)("MyApp"))
+
+    def test_pickle(self):
+        import pickle
+        resolver = appdirs.Resolver("win32", win_folders=self.WIN_FOLDERS)
+        loaded = pickle.loads(pickle.dumps(resolver))
+        self.assertIs(loaded.pathmod, resolver.pathmod)
+        self.assertEqual(loaded.user_data_dir("MyApp"),
+                         resolver.user_data_dir("MyApp"))
+
+
+class TempDirsTestCase(PlatformTestCase):
+    """Base for tests that touch the disk: points all XDG dirs at a temp dir
+    and resolves as on Linux.
+    """
+    def setUp(self):
+        PlatformTestCase.setUp(self)
+        appdirs.system = "linux2"
+        self.tmpdir = tempfile.mkdtemp()
+        for name, subdir in (("XDG_DATA_HOME", "data"),
+                             ("XDG_CONFIG_HOME", "config"),
+                             ("XDG_CACHE_HOME", "cache"),
+                             ("XDG_STATE_HOME", "state"),
+                             ("XDG_RUNTIME_DIR", "runtime"),
+                             ("XDG_DATA_DIRS", "site-data"),
+                             ("XDG_CONFIG_DIRS", "site-config")):
+            os.environ[name] = os.path.join(self.tmpdir, subdir)
+        self.dirs = appdirs.AppDirs("MyApp", "MyCompany")
+
+    def tearDown(self):
+        PlatformTestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir)
+
+
+class Test_CacheStore(TempDirsTestCase):
+    def test_get_put_delete(self):
+        store = appdirs.CacheStore(self.dirs)
+        self.assertEqual(store.root,
+                         os.path.join(self.dirs.user_cache_dir, "cache"))
+        self.assertIsNone(store.get("a"))
+        store.put("a", b"alpha")
+        self.assertEqual(store.get("a"), b"alpha")
+        self.assertIn("a", store)
+        self.assertTrue(store.delete("a"))
+        self.assertFalse(store.delete("a"))
+        self.assertEqual(store.get("a", b""), b"")
+        self.assertEqual(store.stats()["hits"], 1)
+        self.assertEqual(store.stats()["misses"], 2)
+
+    def test_lru_eviction_by_entries(self):
+        store = appdirs.CacheStore(self.dirs, max_entries=2)
+        store.put("a", b"1")
+        store.put("b", b"2")
+        store.get("a")
+        store.put("c", b"3")
+        self.assertIn("a", store)
+        self.assertNotIn("b", store)
+        self.assertIn("c", store)
+        self.assertEqual(store.stats()["evictions"], 1)
+        self.assertEqual(len(os.listdir(store.root)), 2)
+
+    def test_lru_eviction_by_bytes(self):
+        store = appdirs.CacheStore(self.dirs, "blobs", max_bytes=10)
+        store.put("a", b"x" * 6)
+        store.put("b", b"y" * 6)
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.stats()["bytes"], 6)
+        store.put("big", b"z" * 11)
+        self.assertNotIn("big", store)
+        self.assertEqual(store.get("b"), b"y" * 6)
+
+    def test_reopen(self):
+        store = appdirs.CacheStore(self.dirs)
+        store.put("a", b"1")
+        store.put("b", b"22")
+        reopened = appdirs.CacheStore(self.dirs)
+        self.assertEqual(len(reopened), 2)
+        self.assertEqual(reopened.stats()["bytes"], 3)
+        self.assertEqual(reopened.get("b"), b"22")
+
+    def test_foreign_names_ignored(self):
+        root = self.dirs.user_cache_dir
+        os.makedirs(os.path.join(root, "log"))
+        os.makedirs(os.path.join(root, "a" * 64))
+        with open(os.path.join(root, "notes.txt"), "wb") as f:
+            f.write(b"not an entry")
+        store = appdirs.CacheStore(self.dirs, subdir=None, max_entries=1)
+        self.assertEqual(len(store), 0)
+        store.put("a", b"1")
+        store.put("b", b"2")
+        self.assertEqual(len(store), 1)
+        self.assertEqual(sorted(os.listdir(root)), sorted(
+            ["a" * 64, "log", "notes.txt", store._entry_name("b")]))
+
+
+def _state_store_incr(appname, times):
+    store = appdirs.StateStore(appdirs.AppDirs(appname))
+    for _ in range(times):
+        store.incr("counter")
+
+
+class Test_StateStore(TempDirsTestCase):
+    def setUp(self):
+        TempDirsTestCase.setUp(self)
+        self.store = appdirs.StateStore(self.dirs)
+
+    def tearDown(self):
+        self.store.close()
+        TempDirsTestCase.tearDown(self)
+
+    def test_connections_closed_with_threads(self):
+        import gc
+        def worker(i):
+            self.store.set("thread-%d" % i, i)
+        threads = [threading.Thread(target=worker, args=(i,))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        gc.collect()
+        # Only this thread's connection is left.
+        self.assertEqual(len(self.store._connections), 1)
+        self.assertEqual(self.store.get("thread-4"), 4)
+
+    def test_get_set_delete(self):
+        self.assertEqual(self.store.path, os.path.join(
+            self.dirs.user_state_dir, "state.sqlite3"))
+        self.assertIsNone(self.store.get("cursor"))
+        self.store.set("cursor", {"offset": 3})
+        self.assertEqual(self.store.get("cursor"), {"offset": 3})
+        self.assertIn("cursor", self.store)
+        self.store.set_many({"a": 1, "b": [2]})
+        self.assertEqual(self.store.keys(), ["a", "b", "cursor"])
+        self.assertEqual(len(self.store), 3)
+        self.assertTrue(self.store.delete("cursor"))
+        self.assertFalse(self.store.delete("cursor"))
+        self.assertEqual(self.store.get("cursor", 0), 0)
+        conn = self.store._state().conn
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0],
+                         "wal")
+
+    def test_set_many_atomic(self):
+        import sqlite3
+        self.assertRaises(sqlite3.Error, self.store.set_many,
+                          [("a", 1), (("bad",), 2)])
+        self.assertIsNone(self.store.get("a"))
+        self.assertEqual(len(self.store), 0)
+
+    def test_ttl(self):
+        self.store.set("token", "abc", ttl=-1)
+        self.store.set("other", "def", ttl=60)
+        self.assertIsNone(self.store.get("token"))
+        self.assertNotIn("token", self.store)
+        self.assertEqual(self.store.get("other"), "def")
+        self.assertEqual(self.store.purge_expired(), 1)
+        self.assertEqual(self.store.keys(), ["other"])
+        self.store.set("hits", 1, ttl=60)
+        self.assertEqual(self.store.incr("hits"), 2)
+        expires = self.store._state().conn.execute(
+            "SELECT expires FROM kv WHERE key = 'hits'").fetchone()[0]
+        self.assertIsNotNone(expires)
+
+    def test_batch(self):
+        with self.store.batch():
+            self.store.set("a", 1)
+            self.assertEqual(self.store.get("a"), 1)
+            self.store.set("b", 2)
+        self.assertEqual(self.store.get("b"), 2)
+        try:
+            with self.store.batch():
+                self.store.set("a", 10)
+                self.store.delete("b")
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(self.store.get("a"), 1)
+        self.assertEqual(self.store.get("b"), 2)
+
+    def test_cache_invalidated_by_other_connections(self):
+        self.store.set("a", 1)
+        self.assertEqual(self.store.get("a"), 1)
+        other = appdirs.StateStore(self.dirs)
+        try:
+            other.set("a", 2)
+            self.assertEqual(self.store.get("a"), 2)
+        finally:
+            other.close()
+
+    def test_threads(self):
+        def worker():
+            for _ in range(50):
+                self.store.incr("counter")
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.store.get("counter"), 200)
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "needs fork")
+    def test_processes(self):
+        import multiprocessing
+        procs = [multiprocessing.Process(target=_state_store_incr,
+                                         args=("MyApp", 100))
+                 for _ in range(4)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+        self.assertEqual(self.store.get("counter"), 400)
+
+
+class Test_CompressedStore(TempDirsTestCase):
+    text = b"".join(b"%06d INFO request handled in 3ms\n" % i
+                    for i in range(20000))
+
+    def test_roundtrip(self):
+        store = appdirs.CompressedStore(self.dirs)
+        store.put("logs/app.log", self.text)
+        self.assertEqual(store.get("logs/app.log"), self.text)
+        with open(store.path("logs/app.log"), "rb") as f:
+            self.assertLess(len(f.read()), len(self.text) // 5)
+        store.put("random", os.urandom(10000))
+        store.put("small", b"small")
+        self.assertEqual(store.get("small"), b"small")
+        self.assertIsNone(store.get("missing"))
+        stats = store.stats()
+        self.assertEqual(stats["files_written"], 3)
+        self.assertEqual(stats["codecs"].get("none"), 2)
+        self.assertEqual(stats["bytes_in"], len(self.text) + 10005)
+        self.assertLess(stats["ratio"], 0.5)
+        self.assertEqual(stats["files_read"], 1)
+        self.assertTrue(store.delete("small"))
+
+    def test_streaming(self):
+        for prefer in ("speed", "balanced", "ratio"):
+            store = appdirs.CompressedStore(self.dirs, subdir=prefer,
+                                            prefer=prefer, sample_size=4096)
+            with store.open("big", "wb") as f:
+                for i in range(0, len(self.text), 1000):
+                    f.write(self.text[i:i + 1000])
+            chunks = []
+            with store.open("big") as f:
+                while True:
+                    chunk = f.read(777)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+            self.assertEqual(b"".join(chunks), self.text)
+            self.assertNotIn("none", store.stats()["codecs"])
+        self.assertRaises(ValueError, appdirs.CompressedStore, self.dirs,
+                          prefer="best")
+
+    def test_short_read_bounded(self):
+        store = appdirs.CompressedStore(self.dirs)
+        chunk_size = appdirs._DecompressingReader.chunk_size
+        data = b"\0" * (8 * 1024 * 1024)
+        for name, codec in appdirs._get_codecs().items():
+            codec_id, compressor, decompressor = codec
+            if not hasattr(decompressor(), "needs_input") \
+                    and not hasattr(decompressor(), "unconsumed_tail"):
+                continue    # Python 2's bz2 can't bound its output
+            compressor = compressor(9)
+            with open(store.path(name), "wb") as f:
+                f.write(appdirs._COMPRESSED_MAGIC + b"\x01" + codec_id)
+                f.write(compressor.compress(data) + compressor.flush())
+            with store.open(name) as f:
+                self.assertEqual(f.read(10), b"\0" * 10)
+                self.assertLessEqual(len(f.raw._buf), chunk_size)
+                self.assertEqual(len(f.read()), len(data) - 10)
+
+    def test_truncated_stream(self):
+        store = appdirs.CompressedStore(self.dirs)
+        data = os.urandom(64 * 1024)
+        for name, codec in appdirs._get_codecs().items():
+            codec_id, compressor, decompressor = codec
+            if not hasattr(decompressor(), "eof"):
+                continue    # Python 2 can't tell where a stream ends
+            compressor = compressor(9)
+            compressed = compressor.compress(data) + compressor.flush()
+            with open(store.path(name), "wb") as f:
+                f.write(appdirs._COMPRESSED_MAGIC + b"\x01" + codec_id)
+                f.write(compressed[:len(compressed) // 2])
+            with store.open(name) as f:
+                self.assertRaises(EOFError, f.read)
+
+    def test_plain_files_and_abort(self):
+        store = appdirs.CompressedStore(self.dirs)
+        with open(store.path("plain"), "wb") as f:
+            f.write(b"not compressed")
+        self.assertEqual(store.get("plain"), b"not compressed")
+        try:
+            with store.open("partial", "wb") as f:
+                f.write(self.text)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(sorted(os.listdir(store.root)), ["plain"])
+
+
+class Test_BlobStore(TempDirsTestCase):
+    def test_put_get(self):
+        store = appdirs.BlobStore(self.dirs)
+        digest = store.put(b"hello")
+        self.assertEqual(bytes(store.get(digest)), b"hello")
+        self.assertEqual(store.path(digest), os.path.join(
+            self.dirs.user_cache_dir, "blobs", digest[:2], digest[2:4], digest))
+        with store.open(digest) as f:
+            self.assertEqual(f.read(), b"hello")
+        self.assertEqual(bytes(store.get(store.put(b""))), b"")
+        self.assertRaises(KeyError, store.get, "0" * 64)
+
+    def test_dedup(self):
+        store = appdirs.BlobStore(self.dirs)
+        self.assertEqual(store.put(b"same"), store.put(b"same"))
+        with store.open_writer() as writer:
+            writer.write(b"sa")
+            writer.write(b"me")
+        self.assertEqual(writer.digest, store.put(b"same"))
+        self.assertEqual(list(store), [writer.digest])
+        self.assertEqual(os.listdir(store.root), [writer.digest[:2]])
+
+    def test_streaming_abort(self):
+        store = appdirs.BlobStore(self.dirs)
+        try:
+            with store.open_writer() as writer:
+                writer.write(b"partial")
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertIsNone(writer.digest)
+        self.assertEqual(os.listdir(store.root), [])
+
+    def test_delete(self):
+        store = appdirs.BlobStore(self.dirs, levels=1)
+        digest = store.put(b"gone")
+        self.assertIn(digest, store)
+        self.assertTrue(store.delete(digest))
+        self.assertNotIn(digest, store)
+
+
+class Test_TransactionalWriter(TempDirsTestCase):
+    def setUp(self):
+        TempDirsTestCase.setUp(self)
+        self.writer = appdirs.TransactionalWriter(self.dirs, "user_state_dir")
+        self.root = self.dirs.user_state_dir
+
+    def read(self, relpath):
+        with open(os.path.join(self.root, *relpath.split("/")), "rb") as f:
+            return f.read()
+
+    def test_commit(self):
+        with open(os.path.join(self.root, "old"), "wb") as f:
+            f.write(b"old")
+        with self.writer.transaction() as txn:
+            for i in range(20):
+                txn.write("items/%d/data" % i, b"item %d" % i)
+            txn.write("a", b"first")
+            txn.write("a", b"second")
+            txn.delete("old")
+            self.assertFalse(os.path.exists(os.path.join(self.root, "a")))
+        self.assertEqual(self.read("items/7/data"), b"item 7")
+        self.assertEqual(self.read("a"), b"second")
+        self.assertFalse(os.path.exists(os.path.join(self.root, "old")))
+        self.assertEqual(os.listdir(os.path.join(self.root, ".txn")),
+                         ["lock"])
+        self.assertRaises(RuntimeError, txn.write, "b", b"")
+
+    def test_delete_under_missing_dir(self):
+        with open(os.path.join(self.root, "file"), "wb") as f:
+            f.write(b"file")
+        with self.writer.transaction() as txn:
+            txn.delete("nosuchdir/x")
+            txn.delete("file/x")
+            txn.write("a", b"a")
+        self.assertEqual(self.read("a"), b"a")
+        self.assertEqual(self.writer.recover(), 0)
+        with self.writer.transaction() as txn:
+            txn.write("b", b"b")
+        self.assertEqual(self.read("b"), b"b")
+
+    def test_abort(self):
+        try:
+            with self.writer.transaction() as txn:
+                txn.write("a", b"data")
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertFalse(os.path.exists(os.path.join(self.root, "a")))
+        self.assertEqual(os.listdir(os.path.join(self.root, ".txn")),
+                         ["lock"])
+        txn = self.writer.transaction()
+        self.assertRaises(ValueError, txn.write, "../a", b"")
+        self.assertRaises(ValueError, txn.write, ".txn/a", b"")
+
+    def test_recover_after_commit_point(self):
+        txn = self.writer.transaction()
+        txn.write("x/a", b"a")
+        txn.write("b", b"b")
+        # Crash right after the journal is written.
+        apply = self.writer._apply
+        self.writer._apply = lambda txid, entries: None
+        txn.commit()
+        self.writer._apply = apply
+        self.assertFalse(os.path.exists(os.path.join(self.root, "b")))
+        writer = appdirs.TransactionalWriter(self.dirs, "user_state_dir")
+        self.assertEqual(writer.recover(), 0)   # already done on open
+        self.assertEqual(self.read("x/a"), b"a")
+        self.assertEqual(self.read("b"), b"b")
+
+    @unittest.skipIf(sys.platform == "win32", "needs os.kill(pid, 0)")
+    def test_recover_before_commit_point(self):
+        txn_dir = os.path.join(self.root, ".txn")
+        dead = os.path.join(txn_dir, "999999999-dead.staging")
+        os.mkdir(dead)
+        txn = self.writer.transaction()
+        txn.write("a", b"a")
+        self.assertEqual(self.writer.recover(), 0)
+        self.assertFalse(os.path.exists(dead))
+        txn.commit()    # a live transaction's staged files are kept
+        self.assertEqual(self.read("a"), b"a")
+
+
+class Test_ResourceLookup(TempDirsTestCase):
+    def setUp(self):
+        TempDirsTestCase.setUp(self)
+        os.environ["XDG_DATA_DIRS"] = os.pathsep.join([
+            os.path.join(self.tmpdir, "site1"),
+            os.path.join(self.tmpdir, "site2")])
+        self.dirs = appdirs.AppDirs("MyApp")
+        self._recheck_interval = appdirs._listing_cache.recheck_interval
+        appdirs._listing_cache.clear()
+
+    def tearDown(self):
+        appdirs._listing_cache.recheck_interval = self._recheck_interval
+        appdirs._listing_cache.clear()
+        TempDirsTestCase.tearDown(self)
+
+    def _write(self, dir, relpath):
+        path = os.path.join(dir, *relpath.split("/"))
+        appdirs._makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(relpath)
+        return path
+
+    def test_data_dirs(self):
+        self.assertEqual(self.dirs.data_dirs, [
+            self.dirs.user_data_dir,
+            os.path.join(self.tmpdir, "site1", "MyApp"),
+            os.path.join(self.tmpdir, "site2", "MyApp")])
+        self.assertEqual(self.dirs.config_dirs[0], self.dirs.user_config_dir)
+
+    def test_find_precedence(self):
+        site1, site2 = self.dirs.data_dirs[1:]
+        self._write(site2, "a/b.txt")
+        self.assertEqual(self.dirs.find_data_file("a/b.txt"),
+                         os.path.join(site2, "a", "b.txt"))
+        self._write(site1, "a/b.txt")
+        user = self._write(self.dirs.user_data_dir, "a/b.txt")
+        self.assertEqual(self.dirs.find_data_file("a/b.txt"), user)
+        self.assertIsNone(self.dirs.find_data_file("a/missing.txt"))
+        self.assertIsNone(self.dirs.find_data_file("a/b.txt/c"))
+        self.assertRaises(ValueError, self.dirs.find_data_file, "../x")
+
+    def test_new_files_found(self):
+        site1 = self.dirs.data_dirs[1]
+        self.assertIsNone(self.dirs.find_data_file("x.txt"))
+        path = self._write(site1, "x.txt")
+        self.assertEqual(self.dirs.find_data_file("x.txt"), path)
+        os.remove(path)
+        self.assertIsNone(self.dirs.find_data_file("x.txt"))
+
+    def test_syscalls_per_lookup(self):
+        path = self._write(self.dirs.data_dirs[2], "icons/sub/x.png")
+        for layer in self.dirs.data_dirs:
+            appdirs._makedirs(os.path.join(layer, "icons", "sub"))
+        # Old enough that the listings are trusted while the mtime holds.
+        past = time.time() - 60
+        for dirpath, dirnames, filenames in os.walk(self.tmpdir):
+            os.utime(dirpath, (past, past))
+        self.assertEqual(self.dirs.find_data_file("icons/sub/x.png"), path)
+
+        calls = []
+        stat, list_dir = os.stat, appdirs._list_dir
+        def counting_stat(*args, **kwargs):
+            calls.append("stat")
+            return stat(*args, **kwargs)
+        def counting_list_dir(path):
+            calls.append("list")
+            return list_dir(path)
+        os.stat, appdirs._list_dir = counting_stat, counting_list_dir
+        try:
+            self.assertEqual(self.dirs.find_data_file("icons/sub/x.png"),
+                             path)
+        finally:
+            os.stat, appdirs._list_dir = stat, list_dir
+        # One stat of "icons/sub" per layer, and no listings.
+        self.assertEqual(calls, ["stat"] * 3)
+
+    def test_cached_listing(self):
+        # With an (opt-in) recheck interval, listings aren't rechecked.
+        appdirs._listing_cache.recheck_interval = 3600
+        site1 = self.dirs.data_dirs[1]
+        self.assertIsNone(self.dirs.find_data_file("x.txt"))
+        self._write(site1, "x.txt")
+        self.assertIsNone(self.dirs.find_data_file("x.txt"))
+        self.dirs.refresh()
+        self.assertEqual(self.dirs.find_data_file("x.txt"),
+                         os.path.join(site1, "x.txt"))
+
+    def test_glob(self):
+        site1, site2 = self.dirs.data_dirs[1:]
+        self._write(site1, "themes/dark.css")
+        self._write(site2, "themes/dark.css")
+        self._write(site2, "themes/light.css")
+        self._write(site2, "themes/.hidden.css")
+        self.assertEqual(self.dirs.glob_data_files("themes/*.css"), [
+            os.path.join(site1, "themes", "dark.css"),
+            os.path.join(site2, "themes", "light.css")])
+        self.assertEqual(self.dirs.glob_data_files("*/light.css"),
+                         [os.path.join(site2, "themes", "light.css")])
+        self.assertEqual(self.dirs.glob_config_files("*"), [])
+
+
+class Test_AssetBundle(TempDirsTestCase):
+    def make_tree(self, root, files):
+        for relpath, data in files.items():
+            path = os.path.join(root, *relpath.split("/"))
+            appdirs._makedirs(os.path.dirname(path))
+            with open(path, "wb") as f:
+                f.write(data)
+
+    def test_pack_and_read(self):
+        files = {"a.txt": b"a", "icons/app.png": b"\x89PNG" * 100,
+                 "icons/empty": b"", "z/y/x": b"xyz"}
+        src = os.path.join(self.tmpdir, "src")
+        self.make_tree(src, files)
+        path = os.path.join(self.tmpdir, "out", "data.bundle")
+        self.assertEqual(appdirs.pack_bundle(src, path), 4)
+        with appdirs.AssetBundle(path) as bundle:
+            self.assertEqual(len(bundle), 4)
+            self.assertEqual(list(bundle), sorted(files))
+            for relpath, data in files.items():
+                view = bundle.get(relpath)
+                self.assertEqual(bytearray(view), data)
+                if hasattr(view, "release"):    # not a Python 2 buffer
+                    view.release()
+            self.assertIn("z/y/x", bundle)
+            self.assertNotIn("z/y", bundle)
+            self.assertIsNone(bundle.get("missing"))
+
+    def test_not_a_bundle(self):
+        path = os.path.join(self.tmpdir, "bad")
+        with open(path, "wb") as f:
+            f.write(b"x" * 100)
+        self.assertRaises(ValueError, appdirs.AssetBundle, path)
+
+    def test_read_data_file(self):
+        dirs = appdirs.AppDirs("MyApp", multipath=True)
+        user_dir, site_dir = dirs.data_dirs[:2]
+        src = os.path.join(self.tmpdir, "src")
+        self.make_tree(src, {"a": b"bundled a", "b": b"bundled b"})
+        appdirs.pack_bundle(src, os.path.join(site_dir, "data.bundle"))
+        self.make_tree(site_dir, {"b": b"loose b"})
+        self.make_tree(user_dir, {"a": b"user a"})
+        dirs.refresh()
+        self.assertEqual(bytearray(dirs.read_data_file("a")), b"user a")
+        self.assertEqual(bytearray(dirs.read_data_file("b")), b"loose b")
+        os.remove(os.path.join(user_dir, "a"))
+        dirs.refresh()
+        self.assertEqual(bytearray(dirs.read_data_file("a")), b"bundled a")
+        self.assertIsNone(dirs.read_data_file("c"))
+
+        # A dir isn't a file; the bundle is looked in instead.
+        os.mkdir(os.path.join(site_dir, "c"))
+        os.mkdir(os.path.join(user_dir, "a"))
+        dirs.refresh()
+        self.assertIsNone(dirs.read_data_file("c"))
+        self.assertEqual(bytearray(dirs.read_data_file("a")), b"bundled a")
+
+    def test_replaced_bundle_closed(self):
+        dirs = appdirs.AppDirs("MyApp", multipath=True)
+        site_dir = dirs.data_dirs[1]
+        src = os.path.join(self.tmpdir, "src")
+        self.make_tree(src, {"a": b"old a"})
+        path = os.path.join(site_dir, "data.bundle")
+        appdirs.pack_bundle(src, path)
+        self.assertEqual(bytearray(dirs.read_data_file("a")), b"old a")
+        old_bundle = appdirs._bundle_cache[path][1]
+        # Other changes to the dir don't reopen it.
+        self.make_tree(site_dir, {"other": b""})
+        self.assertIsNone(dirs.read_data_file("b"))
+        self.assertIs(appdirs._bundle_cache[path][1], old_bundle)
+
+        self.make_tree(src, {"a": b"new a"})
+        appdirs.pack_bundle(src, path)
+        self.assertEqual(bytearray(dirs.read_data_file("a")), b"new a")
+        self.assertIsNot(appdirs._bundle_cache[path][1], old_bundle)
+        self.assertRaises(ValueError, len, old_bundle._mmap)   # closed
+
+
+class Test_EnsureExists(TempDirsTestCase):
+    def tearDown(self):
+        appdirs._ensured_dirs.clear()
+        TempDirsTestCase.tearDown(self)
+
+    def test_functions(self):
+        path = appdirs.user_log_dir("MyApp", ensure_exists=True)
+        self.assertTrue(os.path.isdir(path))
+        if sys.platform != "win32":
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o700)
+        self.assertFalse(os.path.exists(appdirs.user_data_dir("MyApp")))
+        path = appdirs.site_config_dir("MyApp", ensure_exists=True)
+        self.assertTrue(os.path.isdir(path))
+
+    def test_no_syscalls_when_known(self):
+        path = appdirs.user_cache_dir("MyApp", ensure_exists=True)
+        os.rmdir(path)
+        # Known to exist, so not checked again.
+        appdirs.user_cache_dir("MyApp", ensure_exists=True)
+        self.assertFalse(os.path.exists(path))
+
+    def test_appdirs(self):
+        dirs = appdirs.AppDirs("MyApp", version="1.0", ensure_exists=True)
+        self.assertTrue(os.path.isdir(dirs.user_state_dir))
+        self.assertFalse(os.path.exists(dirs.site_data_dir))
+
+    def test_ensure_all(self):
+        dirs = appdirs.AppDirs("MyApp", multipath=True)
+        created = dirs.ensure_all()
+        self.assertEqual(len(created), 6)
+        for path in created:
+            self.assertTrue(os.path.isdir(path))
+        self.assertFalse(os.path.exists(dirs.site_config_dir))
+        created = dirs.ensure_all(include_site=True)
+        self.assertEqual(len(created), 8)
+        self.assertTrue(os.path.isdir(dirs.site_config_dir))
+
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+
+@unittest.skipIf(asyncio is None, "asyncio is not available")
+class Test_AsyncAppDirs(TempDirsTestCase):
+    def setUp(self):
+        TempDirsTestCase.setUp(self)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.adirs = appdirs.AsyncAppDirs("MyApp", "MyCompany")
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        TempDirsTestCase.tearDown(self)
+
+    def run_async(self, awaitable):
+        return self.loop.run_until_complete(awaitable)
+
+    def test_paths(self):
+        self.assertEqual(self.adirs.user_cache_dir, self.dirs.user_cache_dir)
+        self.assertRaises(AttributeError, getattr, self.adirs, "nope")
+        self.assertRaises(ValueError, self.adirs.listdir, "nope")
+
+    def test_file_io(self):
+        adirs = self.adirs
+        path = self.run_async(adirs.makedirs("user_log_dir"))
+        self.assertTrue(os.path.isdir(path))
+        self.run_async(adirs.write_text("user_state_dir", "a/cursor", u"42"))
+        self.assertEqual(
+            self.run_async(adirs.read_text("user_state_dir", "a/cursor")),
+            u"42")
+        self.assertEqual(
+            self.run_async(adirs.read_bytes("user_state_dir", "a/cursor")),
+            b"42")
+        self.assertEqual(
+            self.run_async(adirs.listdir("user_state_dir", "a")), ["cursor"])
+        self.assertEqual(self.run_async(adirs.listdir("user_data_dir")), [])
+        self.assertTrue(
+            self.run_async(adirs.remove("user_state_dir", "a/cursor")))
+        self.assertFalse(
+            self.run_async(adirs.exists("user_state_dir", "a/cursor")))
+        self.run_async(adirs.rmtree("user_state_dir"))
+        self.assertFalse(os.path.exists(self.dirs.user_state_dir))
+
+    def test_bounded_concurrency(self):
+        appdirs.AsyncAppDirs.set_max_workers(2)
+        try:
+            writes = [self.adirs.write_bytes("user_cache_dir", "f%d" % i,
+                                             b"x") for i in range(50)]
+            self.run_async(asyncio.gather(*writes))
+            executor = appdirs.AsyncAppDirs._get_shared_executor()
+            self.assertLessEqual(len(executor._threads), 2)
+        finally:
+            appdirs.AsyncAppDirs.set_max_workers(8)
+        self.assertEqual(len(os.listdir(self.dirs.user_cache_dir)), 50)
+
+
+class Test_UserLogHandler(TempDirsTestCase):
+    def _logger(self, handler):
+        logger = logging.getLogger("appdirs-test-%d" % id(handler))
+        logger.propagate = False
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        return logger
+
+    def test_writes(self):
+        handler = appdirs.UserLogHandler(self.dirs)
+        logger = self._logger(handler)
+        for i in range(100):
+            logger.info("record %d", i)
+        handler.flush()
+        self.assertEqual(handler.metrics()["records_written"], 100)
+        handler.close()
+        self.assertEqual(handler.baseFilename, os.path.join(
+            self.dirs.user_log_dir, "MyApp.log"))
+        with open(handler.baseFilename) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines, ["record %d" % i for i in range(100)])
+
+    def test_snapshot_dirs(self):
+        snapshot = self.dirs.snapshot()
+        log_dir = os.path.join(self.tmpdir, "pinned", "logs")
+        snapshot["dirs"]["user_log_dir"] = log_dir
+        handler = appdirs.UserLogHandler(
+            appdirs.AppDirs.from_snapshot(snapshot))
+        handler.close()
+        self.assertEqual(handler.baseFilename,
+                         os.path.join(log_dir, "MyApp.log"))
+        self.assertTrue(os.path.isdir(log_dir))
+
+    def test_rotation_and_compression(self):
+        handler = appdirs.UserLogHandler(self.dirs, "rot.log", max_bytes=100,
+                                         backup_count=2, batch_size=1)
+        logger = self._logger(handler)
+        for i in range(40):
+            logger.info("record %02d", i)
+        handler.close()
+        metrics = handler.metrics()
+        self.assertEqual(metrics["records_written"], 40)
+        self.assertEqual(metrics["rotations"], 3)
+        self.assertEqual(metrics["compressed"], metrics["rotations"])
+        names = sorted(os.listdir(self.dirs.user_log_dir))
+        self.assertEqual(len(names), 3)
+        self.assertEqual(names[0], "rot.log")
+        gz_path = os.path.join(self.dirs.user_log_dir, names[-1])
+        with gzip.open(gz_path) as f:
+            self.assertTrue(f.read().startswith(b"record"))
+
+    def test_write_errors(self):
+        handler = appdirs.UserLogHandler(self.dirs, max_bytes=100,
+                                         batch_size=1, compress=False)
+        errors = []
+        handler.handleError = lambda record: errors.append(record)
+        logger = self._logger(handler)
+        for i in range(5):
+            logger.info("record %02d", i)
+        handler.flush()
+        # Removed, e.g. by collect_garbage(): rotation has nothing to move.
+        os.remove(handler.baseFilename)
+        for i in range(5, 10):
+            logger.info("record %02d", i)
+        handler.flush()
+        self.assertEqual(handler.metrics()["records_written"], 10)
+
+        handler.max_bytes = 0
+        with handler._io_lock:
+            handler._stream.close()
+        logger.info("lost")
+        handler.flush()
+        logger.info("kept")
+        handler.close()
+        self.assertEqual(len(errors), 1)
+        metrics = handler.metrics()
+        self.assertEqual(metrics["records_dropped"], 1)
+        self.assertEqual(metrics["records_written"], 11)
+        with open(handler.baseFilename) as f:
+            self.assertEqual(f.read().splitlines()[-1], "kept")
+
+    def test_drops_instead_of_blocking(self):
+        handler = appdirs.UserLogHandler(self.dirs, queue_size=5)
+        logger = self._logger(handler)
+        with handler._io_lock:
+            for i in range(50):
+                logger.info("record %d", i)
+        handler.close()
+        metrics = handler.metrics()
+        self.assertGreater(metrics["records_dropped"], 0)
+        self.assertEqual(metrics["records_written"] + metrics["records_dropped"],
+                         50)
+
+
+class Test_ConfigLoader(TempDirsTestCase):
+    def setUp(self):
+        TempDirsTestCase.setUp(self)
+        os.environ["XDG_CONFIG_DIRS"] = os.pathsep.join([
+            os.path.join(self.tmpdir, "etc1"),
+            os.path.join(self.tmpdir, "etc2")])
+        self.dirs = appdirs.AppDirs("MyApp")
+        self.parsed = []
+        self._parse_json = appdirs._CONFIG_PARSERS["json"]
+        def counting_parse_json(f):
+            self.parsed.append(f.name)
+            return self._parse_json(f)
+        appdirs._CONFIG_PARSERS["json"] = counting_parse_json
+
+    def tearDown(self):
+        appdirs._CONFIG_PARSERS["json"] = self._parse_json
+        appdirs._parsed_configs.clear()
+        TempDirsTestCase.tearDown(self)
+
+    def _write(self, dir, name, content):
+        appdirs._makedirs(dir)
+        path = os.path.join(dir, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_precedence(self):
+        user, etc1, etc2 = self.dirs.config_dirs
+        self._write(etc2, "app.json", '{"a": 1, "b": {"x": 1, "y": 1}}')
+        self._write(etc1, "app.json", '{"a": 2, "b": {"x": 2}}')
+        self._write(user, "app.json", '{"b": {"x": 3}, "c": [1]}')
+        config = appdirs.ConfigLoader(self.dirs, "app.json").load()
+        self.assertEqual(config, {"a": 2, "b": {"x": 3, "y": 1}, "c": [1]})
+
+    def test_parse_cache(self):
+        user, etc1, etc2 = self.dirs.config_dirs
+        self._write(etc1, "app.json", '{"a": 1}')
+        user_path = self._write(user, "app.json", '{"b": 1}')
+        loader = appdirs.ConfigLoader(self.dirs, "app.json")
+        loader.load()
+        self.assertEqual(len(self.parsed), 2)
+        self.assertIs(loader.load(), loader.reload())
+        self.assertEqual(len(self.parsed), 2)
+        # Another loader for the same file reuses the parses too.
+        appdirs.ConfigLoader(self.dirs, "app.json").load()
+        self.assertEqual(len(self.parsed), 2)
+        self._write(user, "app.json", '{"b": 22}')
+        self.assertEqual(loader.reload(), {"a": 1, "b": 22})
+        self.assertEqual(self.parsed[2:], [user_path])
+
+    def test_ini(self):
+        user, etc1, etc2 = self.dirs.config_dirs
+        self._write(etc2, "app.ini", "[main]\nName = site\nlevel = 1\n")
+        self._write(user, "app.ini", "[main]\nName = user\n")
+        config = appdirs.ConfigLoader(self.dirs, "app.ini").load()
+        self.assertEqual(config, {"main": {"Name": "user", "level": "1"}})
+
+    def test_toml(self):
+        try:
+            appdirs._parse_toml(None)
+        except RuntimeError:
+            self.skipTest("no TOML parser available")
+        except Exception:
+            pass
+        self._write(self.dirs.user_config_dir, "app.toml",
+                    '[server]\nport = 8080\n')
+        config = appdirs.ConfigLoader(self.dirs, "app.toml").load()
+        self.assertEqual(config, {"server": {"port": 8080}})
+
+    def test_format(self):
+        self.assertRaises(ValueError, appdirs.ConfigLoader, self.dirs, "app")
+        loader = appdirs.ConfigLoader(self.dirs, "app", format="json")
+        self.assertEqual(loader.load(), {})
+
+
+class ConfigWatcherTests(object):
+    use_inotify = None
+
+    def setUp(self):
+        TempDirsTestCase.setUp(self)
+        try:
+            self.watcher = appdirs.ConfigWatcher(
+                debounce=0.05, min_interval=0.01, max_interval=0.05,
+                use_inotify=self.use_inotify)
+        except (OSError, AttributeError):
+            self.skipTest("inotify is not available")
+        self.changes = []
+        self.changed = threading.Event()
+
+    def tearDown(self):
+        self.watcher.close()
+        TempDirsTestCase.tearDown(self)
+
+    def on_change(self, paths):
+        self.changes.append(paths)
+        self.changed.set()
+
+    def wait_for_change(self):
+        self.assertTrue(self.changed.wait(5), "no change seen")
+        self.changed.clear()
+        return self.changes[-1]
+
+    def test_watch(self):
+        config_dir = self.dirs.user_config_dir
+        os.makedirs(config_dir)
+        self.watcher.watch(self.dirs, self.on_change)
+        path = os.path.join(config_dir, "app.json")
+        with open(path, "w") as f:
+            f.write("{}")
+        with open(path, "a") as f:
+            f.write(" ")
+        self.assertEqual(self.wait_for_change(), [path])
+        self.assertEqual(len(self.changes), 1)
+
+    def test_missing_dir(self):
+        self.watcher.watch([self.dirs.user_config_dir], self.on_change)
+        os.makedirs(self.dirs.user_config_dir)
+        self.assertIn(self.dirs.user_config_dir, self.wait_for_change())
+
+    def test_unwatch(self):
+        config_dir = self.dirs.user_config_dir
+        os.makedirs(config_dir)
+        watch = self.watcher.watch([config_dir], self.on_change)
+        self.watcher.unwatch(watch)
+        with open(os.path.join(config_dir, "app.json"), "w") as f:
+            f.write("{}")
+        time.sleep(0.2)
+        self.assertEqual(self.changes, [])
+
+    def test_async_events(self):
+        if asyncio is None:
+            self.skipTest("asyncio is not available")
+        config_dir = self.dirs.user_config_dir
+        os.makedirs(config_dir)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            events = self.watcher.events([config_dir])
+            path = os.path.join(config_dir, "app.ini")
+            with open(path, "w") as f:
+                f.write("[main]")
+            paths = loop.run_until_complete(asyncio.wait_for(
+                events.__aiter__().__anext__(), 5))
+            self.assertEqual(paths, [path])
+            events.close()
+        finally:
+            loop.close()
+            asyncio.set_event_loop(None)
+
+
+class Test_ConfigWatcherPolling(ConfigWatcherTests, TempDirsTestCase):
+    use_inotify = False
+
+    def test_backend(self):
+        self.assertFalse(self.watcher.uses_inotify)
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "Linux only")
+class Test_ConfigWatcherInotify(ConfigWatcherTests, TempDirsTestCase):
+    use_inotify = True
+
+    def test_backend(self):
+        self.assertTrue(self.watcher.uses_inotify)
+
+
+class Test_Instrumentation(PlatformTestCase):
+    def setUp(self):
+        PlatformTestCase.setUp(self)
+        appdirs.system = "linux2"
+
+    def tearDown(self):
+        appdirs.disable_instrumentation()
+        PlatformTestCase.tearDown(self)
+
+    def test_disabled_by_default(self):
+        self.assertFalse(hasattr(appdirs.user_data_dir, "__wrapped__"))
+        self.assertEqual(appdirs.get_instrumentation_stats(), {})
+        self.assertRaises(RuntimeError, appdirs.add_instrumentation_hook,
+                          lambda event: None)
+
+    def test_stats(self):
+        original = appdirs.user_cache_dir
+        appdirs.enable_instrumentation()
+        self.assertIsNot(appdirs.user_cache_dir, original)
+        for _ in range(10):
+            appdirs.user_cache_dir("MyApp")
+        appdirs.user_log_dir("MyApp")
+        stats = appdirs.get_instrumentation_stats()
+        # `user_log_dir` resolves through the `Resolver`, not by calling the
+        # (instrumented) `user_cache_dir`.
+        self.assertEqual(stats["user_cache_dir"]["calls"], 10)
+        self.assertEqual(stats["user_log_dir"]["calls"], 1)
+        cache_stats = stats["user_cache_dir"]
+        self.assertLessEqual(cache_stats["p50_seconds"],
+                             cache_stats["max_seconds"])
+        self.assertGreater(cache_stats["total_seconds"], 0)
+        self.assertEqual(cache_stats["inputs"]["system"], "linux2")
+        appdirs.disable_instrumentation()
+        self.assertIs(appdirs.user_cache_dir, original)
+
+    def test_hook(self):
+        events = []
+        appdirs.enable_instrumentation(events.append)
+        os.environ["XDG_DATA_HOME"], saved = "/tmp/xdg", os.environ.get(
+            "XDG_DATA_HOME")
+        try:
+            path = appdirs.AppDirs("MyApp").user_data_dir
+        finally:
+            if saved is None:
+                del os.environ["XDG_DATA_HOME"]
+            else:
+                os.environ["XDG_DATA_HOME"] = saved
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]["function"], "user_data_dir")
+        self.assertEqual(events[0]["result"], path)
+        self.assertEqual(events[0]["inputs"]["env"]["XDG_DATA_HOME"],
+                         "/tmp/xdg")
+
+    def test_win_folder(self):
+        backends = appdirs._win_folder_backends
+        appdirs._win_folder_backends = [(None, lambda name: "C:\\" + name,
+                                         True)]
+        appdirs._reset_win_folder()
+        appdirs.system = "win32"
+        try:
+            appdirs.enable_instrumentation()
+            appdirs.user_data_dir("MyApp")
+            stats = appdirs.get_instrumentation_stats()
+        finally:
+            appdirs._win_folder_backends = backends
+            appdirs._reset_win_folder()
+        self.assertEqual(stats["_get_win_folder"]["inputs"]["csidl_name"],
+                         "CSIDL_LOCAL_APPDATA")
+        self.assertEqual(stats["_get_win_folder"]["inputs"]["backend"],
+                         "<lambda>")
+
+
+class Test_Snapshot(TempDirsTestCase):
+    def test_round_trip(self):
+        dirs = appdirs.AppDirs("MyApp", "MyCompany", version="1.0")
+        loaded = appdirs.AppDirs.from_snapshot(dirs.snapshot())
+        self.assertEqual(loaded.version, "1.0")
+        for kind in appdirs._DIR_KINDS:
+            self.assertEqual(getattr(loaded, kind), getattr(dirs, kind))
+
+    def test_no_resolution(self):
+        snapshot = appdirs.AppDirs("MyApp").snapshot()
+        snapshot["dirs"]["user_data_dir"] = "/precomputed"
+        dirs = appdirs.AppDirs.from_snapshot(snapshot)
+        os.environ["XDG_DATA_HOME"] = "/elsewhere"
+        self.assertEqual(dirs.user_data_dir, "/precomputed")
+        dirs.refresh()
+        self.assertEqual(dirs.user_data_dir, os.path.join("/elsewhere",
+                                                          "MyApp"))
+        snapshot["format"] = 2
+        self.assertRaises(ValueError, appdirs.AppDirs.from_snapshot, snapshot)
+
+    def test_cli_json(self):
+        path = os.path.join(self.tmpdir, "dirs.json")
+        appdirs._main(["MyApp", "--appauthor", "MyCompany", "--app-version",
+                       "2.0", "--format", "json", "--output", path])
+        dirs = appdirs.AppDirs.from_snapshot(path)
+        self.assertEqual(dirs.appauthor, "MyCompany")
+        self.assertEqual(dirs.user_cache_dir, appdirs.user_cache_dir(
+            "MyApp", "MyCompany", "2.0"))
+
+    def test_cli_shell(self):
+        path = os.path.join(self.tmpdir, "dirs.sh")
+        appdirs._main(["My App", "--format", "shell", "--prefix", "MY_",
+                       "--output", path])
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), len(appdirs._DIR_KINDS))
+        self.assertEqual(lines[0], "export MY_USER_DATA_DIR='%s'"
+                         % appdirs.user_data_dir("My App"))
+
+
+class VersionedDirsTestCase(TempDirsTestCase):
+    def make_file(self, dir, relpath, size=10, age=None):
+        path = os.path.join(dir, *relpath.split("/"))
+        appdirs._makedirs(os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+        if age is not None:
+            mtime = time.time() - age
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def make_versions(self, kind, versions):
+        paths = {}
+        for version in versions:
+            dirs = appdirs.AppDirs("MyApp", "MyCompany", version=version)
+            paths[version] = getattr(dirs, kind)
+            appdirs._makedirs(paths[version])
+        return paths
+
+
+class Test_DiskUsage(VersionedDirsTestCase):
+    def test_version_dirs(self):
+        paths = self.make_versions("user_cache_dir", ["1.0", "2.0"])
+        self.make_file(self.dirs.user_log_dir, "app.log")
+        self.assertEqual(self.dirs.version_dirs("user_cache_dir"), paths)
+        log_paths = self.make_versions("user_log_dir", ["1.0"])
+        self.assertEqual(self.dirs.version_dirs("user_log_dir"), log_paths)
+        self.assertRaises(ValueError, self.dirs.version_dirs, "site_data_dir")
+        self.assertEqual(appdirs.AppDirs().version_dirs("user_cache_dir"), {})
+
+    def test_usage(self):
+        paths = self.make_versions("user_cache_dir", ["1.0", "2.0"])
+        self.make_file(paths["1.0"], "a", 100)
+        self.make_file(paths["1.0"], "sub/b", 20)
+        self.make_file(paths["2.0"], "c", 3)
+        self.make_file(self.dirs.user_state_dir, "d", 4)
+        report = self.dirs.disk_usage(summary_path=False)
+        cache = report["user_cache_dir"]
+        self.assertEqual((cache["bytes"], cache["files"]), (123, 3))
+        self.assertEqual(cache["versions"]["1.0"]["bytes"], 120)
+        self.assertEqual(cache["versions"]["2.0"]["files"], 1)
+        self.assertEqual(report["user_state_dir"]["bytes"], 4)
+        self.assertEqual(report["user_log_dir"]["files"], 0)
+
+    def test_serial_scan(self):
+        # Used on Python 2, which lacks concurrent.futures.
+        root = self.dirs.user_cache_dir
+        self.make_file(root, "a", 5)
+        self.make_file(root, "sub/deeper/b", 7)
+        self.assertEqual(appdirs._scan_tree_serially([root], {}),
+                         appdirs._scan_tree([root], {}, 4))
+
+    def test_scan_dir_reuses_names(self):
+        root = self.dirs.user_cache_dir
+        self.make_file(root, "a", 5)
+        cached = appdirs._scan_dir(root, None)
+        self.assertEqual(cached["filenames"], ["a"])
+        # Only the names are reused: sizes are read again.
+        cached = dict(cached, filenames=["a", "gone"], bytes=0)
+        self.make_file(root, "a", 9)
+        result = appdirs._scan_dir(root, cached)
+        self.assertEqual((result["bytes"], result["files"]), (9, 1))
+        self.assertEqual(result["filenames"], ["a", "gone"])
+
+    def test_incremental_summary(self):
+        path = self.make_file(self.dirs.user_state_dir, "sub/a", 10)
+        self.assertEqual(
+            self.dirs.disk_usage(["user_state_dir"])["user_state_dir"]["bytes"],
+            10)
+        summary_path = os.path.join(self.dirs.user_cache_dir,
+                                    ".appdirs-usage.json")
+        self.assertTrue(os.path.exists(summary_path))
+        # Appending to a file doesn't change its dir's mtime, so the names
+        # from the summary are used, but the files are stat'ed again.
+        with open(path, "ab") as f:
+            f.write(b"x" * 5)
+        report = self.dirs.disk_usage(["user_state_dir"])
+        self.assertEqual(report["user_state_dir"]["bytes"], 15)
+        # Adding one changes the mtime, and a full scan sees everything.
+        self.make_file(self.dirs.user_state_dir, "sub/b", 1)
+        report = self.dirs.disk_usage(["user_state_dir"])
+        self.assertEqual(report["user_state_dir"]["bytes"], 16)
+        self.make_file(self.dirs.user_state_dir, "sub/b", 2)
+        report = self.dirs.disk_usage(["user_state_dir"], full=True)
+        self.assertEqual(report["user_state_dir"]["bytes"], 17)
+
+
+class Test_GarbageCollection(VersionedDirsTestCase):
+    def test_keep_newest(self):
+        paths = self.make_versions("user_cache_dir",
+                                   ["1.9", "1.10", "2.0", "0.1"])
+        self.make_file(paths["1.9"], "a", 7)
+        dirs = appdirs.AppDirs("MyApp", "MyCompany", version="0.1")
+        report = dirs.collect_garbage(["user_cache_dir"], keep=2,
+                                      dry_run=True)
+        self.assertEqual(report["removed_dirs"], [paths["1.9"]])
+        self.assertEqual(report["bytes_freed"], 7)
+        self.assertTrue(os.path.exists(paths["1.9"]))
+        report = dirs.collect_garbage(["user_cache_dir"], keep=2)
+        self.assertEqual(sorted(dirs.version_dirs("user_cache_dir")),
+                         ["0.1", "1.10", "2.0"])
+
+    def test_unversioned_siblings(self):
+        # The unversioned app's own dirs sit next to the version dirs.
+        paths = self.make_versions("user_cache_dir", ["1.0", "2.0"])
+        blobs = appdirs.BlobStore(self.dirs)
+        digest = blobs.put(b"blob")
+        thumbnail = self.make_file(self.dirs.user_cache_dir,
+                                   "thumbnails/a.png")
+        dirs = appdirs.AppDirs("MyApp", "MyCompany", version="2.0")
+        self.assertEqual(dirs.version_dirs("user_cache_dir"), paths)
+        report = dirs.collect_garbage(["user_cache_dir"], keep=1)
+        self.assertEqual(report["removed_dirs"], [paths["1.0"]])
+        self.assertEqual(bytes(blobs.get(digest)), b"blob")
+        self.assertTrue(os.path.exists(thumbnail))
+        # A non-numeric version only counts for its own instance.
+        self.make_versions("user_cache_dir", ["dev"])
+        self.assertEqual(sorted(dirs.version_dirs("user_cache_dir")),
+                         ["2.0"])
+        self.assertEqual(
+            sorted(appdirs.AppDirs("MyApp", "MyCompany", version="dev")
+                   .version_dirs("user_cache_dir")), ["2.0", "dev"])
+
+    def test_keeps_all_by_default(self):
+        paths = self.make_versions("user_cache_dir", ["1.0", "2.0rc1"])
+        reports = self.make_file(self.dirs.user_cache_dir,
+                                 "2024-reports/a.csv")
+        self.assertEqual(self.dirs.version_dirs("user_cache_dir"), paths)
+        report = self.dirs.collect_garbage()
+        self.assertEqual(report["removed_dirs"], [])
+        self.assertTrue(os.path.exists(paths["1.0"]))
+        self.assertTrue(os.path.exists(reports))
+
+    def test_keep_policy(self):
+        self.make_versions("user_state_dir", ["1.0", "2.0", "3.0"])
+        self.dirs.collect_garbage(["user_state_dir"], keep=0,
+                                  keep_versions=lambda v: v.startswith("2."))
+        self.assertEqual(list(self.dirs.version_dirs("user_state_dir")),
+                         ["2.0"])
+
+    def test_ttl(self):
+        paths = self.make_versions("user_log_dir", ["1.0"])
+        old = self.make_file(paths["1.0"], "old.log", 5, age=3600)
+        new = self.make_file(paths["1.0"], "new.log", 5)
+        report = self.dirs.collect_garbage(keep=None, ttl=60)
+        self.assertEqual(report["removed_files"], [old])
+        self.assertEqual(report["bytes_freed"], 5)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+    def test_locked(self):
+        lock = self.dirs.gc_lock()
+        held, done = threading.Event(), threading.Event()
+        def holder():
+            with lock.exclusive():
+                held.set()
+                done.wait(5)
+        thread = threading.Thread(target=holder)
+        thread.start()
+        held.wait(5)
+        try:
+            self.assertRaises(appdirs.LockTimeout, self.dirs.collect_garbage)
+        finally:
+            done.set()
+            thread.join()
+
+    def test_version_sort_key(self):
+        self.assertEqual(sorted(["1.10", "1.9", "1.9b1", "10.0", "2"],
+                                key=appdirs._version_sort_key),
+                         ["1.9b1", "1.9", "1.10", "2", "10.0"])
+
+
+class Test_Migration(VersionedDirsTestCase):
+    def setUp(self):
+        VersionedDirsTestCase.setUp(self)
+        self.old = appdirs.AppDirs("MyApp", "MyCompany", version="1.0")
+        self.new = appdirs.AppDirs("MyApp", "MyCompany", version="2.0")
+        self.make_file(self.old.user_data_dir, "db/main.db", 5000)
+        self.make_file(self.old.user_data_dir, "db/empty", 0)
+        self.make_file(self.old.user_config_dir, "settings.ini", 30)
+        self.make_file(self.old.user_state_dir, "cursor", 7, age=60)
+        if hasattr(os, "symlink"):
+            os.symlink("main.db", os.path.join(self.old.user_data_dir,
+                                               "db", "link.db"))
+
+    def assertSameFile(self, src, dst):
+        with open(src, "rb") as f1:
+            with open(dst, "rb") as f2:
+                self.assertEqual(f1.read(), f2.read())
+        self.assertEqual(int(os.stat(src).st_mtime),
+                         int(os.stat(dst).st_mtime))
+
+    def test_copy_and_resume(self):
+        calls = []
+        report = self.new.migrate_from(
+            "1.0", progress=lambda *args: calls.append(args))
+        self.assertEqual(report["files"], 4)
+        self.assertEqual(report["skipped"], 0)
+        self.assertEqual(report["bytes"], 5037)
+        self.assertEqual(sum(report["methods"].values()), 4)
+        self.assertEqual(calls[-1], (4, 4, 5037, 5037))
+        self.assertSameFile(
+            os.path.join(self.old.user_data_dir, "db", "main.db"),
+            os.path.join(self.new.user_data_dir, "db", "main.db"))
+        self.assertSameFile(
+            os.path.join(self.old.user_state_dir, "cursor"),
+            os.path.join(self.new.user_state_dir, "cursor"))
+        if hasattr(os, "symlink"):
+            self.assertEqual(os.readlink(os.path.join(
+                self.new.user_data_dir, "db", "link.db")), "main.db")
+
+        # An interrupted copy is redone, finished ones are skipped.
+        self.make_file(self.new.user_config_dir, "settings.ini", 3)
+        self.make_file(self.new.user_config_dir, "settings.ini.part", 3)
+        report = self.new.migrate_from("1.0")
+        self.assertEqual((report["files"], report["skipped"]), (1, 3))
+        self.assertSameFile(
+            os.path.join(self.old.user_config_dir, "settings.ini"),
+            os.path.join(self.new.user_config_dir, "settings.ini"))
+        self.assertFalse(os.path.exists(os.path.join(
+            self.new.user_config_dir, "settings.ini.part")))
+
+    @unittest.skipUnless(hasattr(os, "link"), "needs hard links")
+    def test_link(self):
+        report = self.new.migrate_from("1.0", link=True)
+        self.assertEqual(report["methods"], {"link": 4})
+        self.assertTrue(os.path.samefile(
+            os.path.join(self.old.user_data_dir, "db", "main.db"),
+            os.path.join(self.new.user_data_dir, "db", "main.db")))
+
+    def test_from_unversioned(self):
+        unversioned = self.new._with_version(None)
+        self.make_file(unversioned.user_data_dir, "top", 3)
+        self.new.migrate_from("1.0")
+        report = self.new.migrate_from(None, kinds=["user_data_dir"])
+        # "top" and the regular files of 1.0, but nothing from 2.0.
+        self.assertEqual(report["files"], 3)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.new.user_data_dir, "2.0")))
+        self.assertRaises(ValueError, self.new.migrate_from, "2.0")
+
+    def test_copy_returning_zero(self):
+        # Some filesystems return 0 from copy_file_range instead of failing.
+        self.assertRaises(appdirs._CopyNotSupported, appdirs._copy_loop,
+                          lambda count: 0, 100)
+        # A short copy after some data is an error, not the end.
+        results = [10, 0]
+        self.assertRaises(IOError, appdirs._copy_loop,
+                          lambda count: results.pop(0), 100)
+
+        copy_file_range = getattr(os, "copy_file_range", None)
+        os.copy_file_range = lambda fd_in, fd_out, count: 0
+        appdirs._copy_methods_failed.clear()
+        try:
+            report = self.new.migrate_from("1.0")
+        finally:
+            appdirs._copy_methods_failed.clear()
+            if copy_file_range is None:
+                del os.copy_file_range
+            else:
+                os.copy_file_range = copy_file_range
+        self.assertNotIn("copy_file_range", report["methods"])
+        self.assertSameFile(
+            os.path.join(self.old.user_data_dir, "db", "main.db"),
+            os.path.join(self.new.user_data_dir, "db", "main.db"))
+
+    def test_copy_methods(self):
+        data = os.urandom(100000)
+        src = os.path.join(self.tmpdir, "src")
+        with open(src, "wb") as f:
+            f.write(data)
+        dst = os.path.join(self.tmpdir, "dst")
+        for method, copy in appdirs._copy_methods:
+            fd_in = os.open(src, os.O_RDONLY)
+            fd_out = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+            try:
+                copy(fd_in, fd_out, len(data))
+            except appdirs._CopyNotSupported:
+                continue
+            finally:
+                os.close(fd_in)
+                os.close(fd_out)
+            with open(dst, "rb") as f:
+                self.assertEqual(f.read(), data, method)
+
+
+def _locked_increment(path, counter, times):
+    lock = appdirs.AppDirLock(path)
+    for _ in range(times):
+        with lock.exclusive():
+            with open(counter) as f:
+                value = int(f.read())
+            with open(counter, "w") as f:
+                f.write(str(value + 1))
+
+
+def _try_lock(path, shared):
+    try:
+        appdirs.AppDirLock(path).acquire(shared, timeout=0)
+    except appdirs.LockTimeout:
+        return False
+    return True
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "needs fork and flock")
+class Test_AppDirLock(TempDirsTestCase):
+    def setUp(self):
+        TempDirsTestCase.setUp(self)
+        import multiprocessing
+        if hasattr(multiprocessing, "get_context"):
+            self.mp = multiprocessing.get_context("fork")
+        else:
+            self.mp = multiprocessing
+
+    def run_in_child(self, func, *args):
+        pool = self.mp.Pool(1)
+        try:
+            return pool.apply(func, args)
+        finally:
+            pool.terminate()
+
+    def test_lock_path(self):
+        lock = self.dirs.lock("index", "user_cache_dir")
+        self.assertEqual(lock.path, os.path.join(
+            self.dirs.user_cache_dir, ".locks", "index.lock"))
+        self.assertRaises(ValueError, self.dirs.lock, "a/b")
+
+    def test_exclusive_between_processes(self):
+        lock = self.dirs.lock("counter")
+        counter = os.path.join(self.tmpdir, "counter")
+        with open(counter, "w") as f:
+            f.write("0")
+        procs = [self.mp.Process(target=_locked_increment,
+                                 args=(lock.path, counter, 50))
+                 for _ in range(4)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+        with open(counter) as f:
+            self.assertEqual(int(f.read()), 200)
+
+    def test_shared_and_exclusive(self):
+        lock = self.dirs.lock("res")
+        with lock.shared():
+            self.assertTrue(self.run_in_child(_try_lock, lock.path, True))
+            self.assertFalse(self.run_in_child(_try_lock, lock.path, False))
+        with lock.exclusive():
+            self.assertEqual(lock.holder_pid(), os.getpid())
+            self.assertFalse(self.run_in_child(_try_lock, lock.path, True))
+        self.assertTrue(self.run_in_child(_try_lock, lock.path, False))
+
+    @unittest.skipUnless(hasattr(os, "register_at_fork"),
+                         "children drop the fd on their next acquire")
+    def test_forked_child_drops_lock(self):
+        lock = self.dirs.lock("res")
+        lock.acquire()
+        ready_r, ready_w = os.pipe()
+        done_r, done_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.write(ready_w, b"x")
+            os.read(done_r, 1)
+            os._exit(0)
+        try:
+            os.read(ready_r, 1)
+            # Let the fd go, as if this process had died holding the lock:
+            # the idle child mustn't keep it locked.
+            lock_file = lock._file
+            os.close(lock_file._fd)
+            lock_file._fd = None
+            lock_file._owners.clear()
+            self.assertTrue(self.run_in_child(_try_lock, lock.path, False))
+        finally:
+            os.write(done_w, b"x")
+            os.waitpid(pid, 0)
+            for fd in (ready_r, ready_w, done_r, done_w):
+                os.close(fd)
+
+    def test_timeout(self):
+        lock = self.dirs.lock("res")
+        with lock.exclusive():
+            start = time.time()
+            self.assertFalse(self.run_in_child(_try_lock, lock.path, False))
+            self.assertLess(time.time() - start, 5)
+
+    def test_reentrant(self):
+        lock = self.dirs.lock("res")
+        with lock.exclusive():
+            with lock.exclusive():
+                with lock.shared():
+                    pass
+            self.assertFalse(self.run_in_child(_try_lock, lock.path, True))
+        with lock.shared():
+            self.assertRaises(RuntimeError, lock.acquire, False, 0)
+        self.assertRaises(RuntimeError, lock.release)
+
+    def test_threads(self):
+        lock = self.dirs.lock("res")
+        lock.acquire()
+        acquired = []
+        def worker():
+            try:
+                lock.acquire(timeout=0.05)
+            except appdirs.LockTimeout:
+                acquired.append(False)
+            else:
+                acquired.append(True)
+                lock.release()
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        lock.release()
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        self.assertEqual(acquired, [False, True])
+
+    def test_stale_lock_file(self):
+        lock = self.dirs.lock("res")
+        with lock.exclusive():
+            pass
+        os.remove(lock.path)
+        with lock.exclusive():
+            self.assertTrue(os.path.exists(lock.path))
+            self.assertFalse(self.run_in_child(_try_lock, lock.path, False))
+
 
 if __name__ == "__main__":
     unittest.main()